@@ -3,6 +3,7 @@ from werkzeug.utils import secure_filename
 import os
 import logging
 from datetime import datetime
+import config
 
 # Importar módulos do sistema
 from modules.auth import auth_bp, login_required
@@ -11,6 +12,8 @@ from modules.data_converter import converter_bp
 from modules.base_manager import base_bp
 from modules.bot_manager import bot_bp
 from modules.report_manager import report_bp
+from modules.manutencao import iniciar_manutencao
+from modules.metricas import metricas_bp
 
 def create_app():
     app = Flask(__name__)
@@ -18,7 +21,7 @@ def create_app():
     
     # Configurações
     app.config['UPLOAD_FOLDER'] = 'uploads'
-    app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # Aumentar para 50MB
+    app.config['MAX_CONTENT_LENGTH'] = config.MAX_FILE_SIZE
     
     # Criar diretórios necessários
     os.makedirs('uploads', exist_ok=True)
@@ -33,7 +36,10 @@ def create_app():
         handlers=[
             logging.FileHandler("logs/app.log", encoding='utf-8'),
             logging.StreamHandler()
-        ]
+        ],
+        # Módulos que registram algo ao serem importados já deram ao logger
+        # raiz um handler padrão; ele é trocado pelos de cima
+        force=True
     )
 
     # Configurar o handler do console para UTF-8
@@ -59,6 +65,10 @@ def create_app():
     app.register_blueprint(base_bp, url_prefix='/bases')
     app.register_blueprint(bot_bp, url_prefix='/bot')
     app.register_blueprint(report_bp, url_prefix='/reports')
+    app.register_blueprint(metricas_bp)
+    
+    # Agendador das tarefas de manutenção, iniciado na primeira requisição
+    app.before_request(iniciar_manutencao)
     
     # Rota principal
     @app.route('/')
@@ -79,4 +89,4 @@ def create_app():
 
 if __name__ == '__main__':
     app = create_app()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=True, host='0.0.0.0', port=config.FLASK_PORT)
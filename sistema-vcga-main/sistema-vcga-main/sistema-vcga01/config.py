@@ -6,22 +6,106 @@ ADMIN_PASSWORD1 = "PROGRAMADORVCGA"  # ALTERE ESTA SENHA!
 
 # Configurações do Sistema
 SECRET_KEY = "vcga_secret_key_2024_change_this"
-MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB (planilhas grandes são lidas em lotes)
+
+# Conversão de planilhas
+CONVERSAO_STREAMING_MB = 10  # acima disso a planilha é lida em lotes, sem carregar tudo
+CONVERSAO_LOTE = 5000  # linhas por lote na leitura em lotes
+CONVERSAO_WORKERS = 2  # conversões executadas ao mesmo tempo
+IMPORTACAO_PROCESSOS = 4  # processos usados na importação em lote
+CACHE_CONVERSOES = 5  # conversões anteriores guardadas para restaurar sem converter
+DELTA_LIMITE = 0.1  # fração das chaves de uma base que o modo delta mantém fora do .bin antes de recompilá-lo
+
+# Porta do Flask (app.py)
+FLASK_PORT = 5000
 
 # Configurações do WhatsApp
 WHATSAPP_PORT = 3000
 WHATSAPP_TIMEOUT = 60000
 
+# Cliente HTTP do servidor WhatsApp (modules/bridge_client.py)
+BRIDGE_URL = f'http://localhost:{WHATSAPP_PORT}'
+BRIDGE_CONEXOES = 10  # conexões keep-alive reaproveitadas
+BRIDGE_TIMEOUT_CONEXAO = 3  # segundos para abrir a conexão
+BRIDGE_TIMEOUTS = {  # segundos esperando a resposta, por endpoint
+    '/send-message': 30,
+    '/unread-messages': 15,
+    '/chats': 10,
+    '/mark-seen': 5,
+    '/status': 5,
+    '/ping': 5,
+    '/qr': 5,
+    '/shutdown': 5
+}
+BRIDGE_TIMEOUT_PADRAO = 10
+BRIDGE_BACKOFF_BASE = 0.5  # primeira espera entre tentativas; dobra a cada uma
+BRIDGE_BACKOFF_MAXIMO = 10
+BRIDGE_FALHAS_CIRCUITO = 5  # falhas de conexão seguidas que abrem o circuito
+BRIDGE_CIRCUITO_ABERTO = 15  # segundos recusando chamadas antes de testar de novo
+
+# Envio das respostas (modules/despachante.py)
+ENVIO_TAXA = 1.0  # mensagens por segundo toleradas pelo WhatsApp
+ENVIO_RAJADA = 5  # mensagens que podem sair de uma vez depois de um período parado
+ENVIO_TENTATIVAS = 4
+ENVIO_BACKOFF_BASE = 2  # segundos antes da segunda tentativa; dobra a cada uma
+ENVIO_BACKOFF_MAXIMO = 60
+ENVIO_FALHAS_LIMITE = 500  # envios que falharam de vez guardados para reenvio
+ENVIO_OUTBOX = 'user_data/outbox'  # respostas gravadas antes do envio, reenviadas após um reinício
+ENVIO_OUTBOX_SEGMENTO_MB = 4
+ENVIO_OUTBOX_FSYNC_MS = 20  # gravações juntadas num só fsync
+ENVIO_OUTBOX_ESPERA = 2  # segundos esperando o fsync; depois a resposta sai sem ele
+ENVIO_OUTBOX_REPETIR_MAXIMO = 5  # segundos entre tentativas de fsync depois de um erro de disco
+# Intervalo fixo do servidor Node entre envios; o ritmo fica com ENVIO_TAXA
+WHATSAPP_INTERVALO_ENVIO_MS = 0
+
 # Diretórios
 UPLOAD_FOLDER = 'uploads'
 DADOS_FOLDER = 'dados_matriculas'
 LOGS_FOLDER = 'logs'
 
+# Armazenamento das bases: 'arquivo' (CSV + .bin via mmap) ou 'sqlite'
+BASE_STORAGE = 'arquivo'
+
 # Configurações do Bot
 BOT_RESPONSE_DELAY = 1  # segundos entre verificações
 BOT_RETRY_ATTEMPTS = 3
 BOT_RETRY_DELAY = 5  # segundos
 
+# Recebimento de mensagens: 'eventos' (o servidor WhatsApp envia cada
+# mensagem recebida para BOT_INGESTAO_URL) ou 'polling' (GET /chats a cada
+# segundo)
+BOT_INGESTAO = 'eventos'
+BOT_INGESTAO_URL = None  # None: /bot/ingest na porta em que o Flask atende, em 127.0.0.1
+BOT_POLLING_MINIMO = 0.25  # segundos entre varreduras enquanto chegam mensagens
+BOT_POLLING_MAXIMO = 10  # teto do intervalo com o WhatsApp parado
+BOT_POLLING_FATOR = 1.5  # crescimento do intervalo a cada varredura sem mensagens
+BOT_POLLING_ERRO_MAXIMO = 60  # teto da espera depois de erros seguidos
+BOT_FILA_MENSAGENS = 1000  # mensagens aguardando o bot; as excedentes são descartadas
+BOT_REGISTRO_MENSAGENS = 'user_data/mensagens_processadas.log'  # ids das mensagens já respondidas
+BOT_REGISTRO_LIMITE = 10000  # ids lembrados para não responder a mesma mensagem duas vezes
+BOT_WORKERS = 4  # threads respondendo chats em paralelo; cada chat fica sempre na mesma
+BOT_FILA_WORKER = 100  # chats aguardando cada thread; com a fila cheia o bot espera
+CONTADORES_ARQUIVO = 'contadores.json'  # contadores do dia, lidos pelo relatório
+CONTADORES_INTERVALO = 5  # segundos entre gravações do arquivo de contadores
+CONTADORES_EVENTOS = 50  # incrementos que antecipam a gravação
+HISTORICO_ARQUIVO = 'user_data/historico_contadores.db'  # contadores por minuto, hora e dia
+HISTORICO_MINUTOS_DIAS = 7  # dias com o detalhe por minuto
+HISTORICO_HORAS_DIAS = 400  # dias com o detalhe por hora; os totais por dia ficam sempre
+
+# Tarefas agendadas (modules/manutencao.py)
+RELATORIO_PREGERAR_MINUTOS = 10  # intervalo para gerar de antemão o PDF do relatório
+MANUTENCAO_HORARIO = '03:00'  # compactação do registro de mensagens e do banco das bases
+LOGS_RETENCAO_DIAS = 30  # logs rotacionados (à meia-noite) guardados
+
+# Rastros das respostas do bot (modules/rastreamento.py, página /bot/traces)
+RASTREAMENTO_AMOSTRAGEM = 0.1  # fração das respostas rastreadas; 0 desliga
+RASTREAMENTO_LIMITE = 1000  # rastros concluídos guardados
+
+# Motor do bot quando /bot/start não indica outro: 'threads' ou 'asyncio'
+# (um único loop de eventos, requer o pacote aiohttp)
+BOT_MOTOR = 'threads'
+BOT_ASYNC_CONEXOES = 20  # conexões keep-alive com o servidor WhatsApp
+
 # Mensagens do Bot
 BOT_WELCOME_MESSAGE = "🥳𝙎𝙚𝙟𝙖𝙢 𝙗𝙚𝙢 𝙫𝙞𝙣𝙙𝙤𝙨 𝙖𝙤 🤖𝙑𝘾𝙂𝘼-𝙇𝙚𝙞𝙩𝙪𝙧𝙖𝘼𝙀"
 
@@ -0,0 +1,60 @@
+import threading
+import random
+import config
+from modules.bridge_client import bridge
+from modules.metricas import duracao_polling
+
+class AgendaPolling:
+    """Intervalo entre as varreduras de GET /chats no modo 'polling'.
+
+    Enquanto chegam mensagens novas o bot varre a cada
+    config.BOT_POLLING_MINIMO segundos; a cada varredura sem nada novo o
+    intervalo cresce config.BOT_POLLING_FATOR vezes, até
+    config.BOT_POLLING_MAXIMO. Um erro de conexão espera um backoff
+    exponencial com jitter (até config.BOT_POLLING_ERRO_MAXIMO), ou o
+    circuito do cliente do servidor WhatsApp reabrir, o que for maior.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.intervalo = config.BOT_POLLING_MINIMO
+        self.erros_seguidos = 0
+        self.consultas = 0
+        self.consultas_com_mensagens = 0
+        self.ultima_duracao = None
+        self.duracao_media = None
+
+    def apos_consulta(self, chats_com_mensagens, duracao):
+        """Registra uma varredura e devolve a espera até a próxima"""
+        duracao_polling.observar(duracao)
+        with self.lock:
+            self.erros_seguidos = 0
+            self.consultas += 1
+            self.ultima_duracao = duracao
+            # Média móvel exponencial: pesa mais as varreduras recentes
+            self.duracao_media = duracao if self.duracao_media is None else 0.8 * self.duracao_media + 0.2 * duracao
+            if chats_com_mensagens:
+                self.consultas_com_mensagens += 1
+                self.intervalo = config.BOT_POLLING_MINIMO
+            else:
+                self.intervalo = min(config.BOT_POLLING_MAXIMO, self.intervalo * config.BOT_POLLING_FATOR)
+            return self.intervalo
+
+    def apos_erro(self):
+        """Registra uma varredura que falhou e devolve a espera até a próxima"""
+        with self.lock:
+            self.erros_seguidos += 1
+            teto = min(config.BOT_POLLING_ERRO_MAXIMO, config.BOT_POLLING_MINIMO * 2 ** self.erros_seguidos)
+            self.intervalo = max(teto / 2 + random.uniform(0, teto / 2), bridge.pausa())
+            return self.intervalo
+
+    def status(self):
+        with self.lock:
+            return {
+                'intervalo_s': round(self.intervalo, 2),
+                'erros_seguidos': self.erros_seguidos,
+                'consultas': self.consultas,
+                'consultas_com_mensagens': self.consultas_com_mensagens,
+                'ultima_duracao_ms': round(1000 * self.ultima_duracao, 1) if self.ultima_duracao is not None else None,
+                'duracao_media_ms': round(1000 * self.duracao_media, 1) if self.duracao_media is not None else None
+            }
@@ -0,0 +1,117 @@
+from datetime import datetime
+import threading
+import logging
+import time
+import schedule
+
+class Tarefa:
+    def __init__(self, nome, descricao, funcao, job):
+        self.nome = nome
+        self.descricao = descricao
+        self.funcao = funcao
+        self.job = job
+        self.execucoes = 0
+        self.falhas = 0
+        self.em_execucao = False
+        self.ultima_execucao = None
+        self.ultima_duracao = None
+        self.ultimo_status = None
+        self.ultimo_erro = None
+
+    def resumo(self):
+        return {
+            'nome': self.nome,
+            'descricao': self.descricao,
+            'execucoes': self.execucoes,
+            'falhas': self.falhas,
+            'em_execucao': self.em_execucao,
+            'ultima_execucao': self.ultima_execucao.isoformat(timespec='seconds') if self.ultima_execucao else None,
+            'ultima_duracao_ms': round(1000 * self.ultima_duracao, 1) if self.ultima_duracao is not None else None,
+            'ultimo_status': self.ultimo_status,
+            'ultimo_erro': self.ultimo_erro,
+            'proxima_execucao': self.job.next_run.isoformat(timespec='seconds') if self.job.next_run else None
+        }
+
+class Agendador:
+    """Tarefas de manutenção executadas numa thread própria, fora do bot.
+
+    Usa um `schedule.Scheduler` só dele: `adicionar` recebe o job já com o
+    intervalo (`agendador.a_cada(5).seconds`, `agendador.a_cada().day.at('00:00')`)
+    e guarda, por tarefa, a última execução, a duração e o erro, se houve.
+    Uma tarefa que falha é registrada e volta a rodar no próximo horário.
+    """
+
+    def __init__(self):
+        self.scheduler = schedule.Scheduler()
+        self.tarefas = {}
+        self.lock = threading.Lock()
+        self.acordar = threading.Event()
+        self.thread = None
+
+    def a_cada(self, intervalo=1):
+        return self.scheduler.every(intervalo)
+
+    def adicionar(self, nome, job, funcao, descricao=''):
+        tarefa = Tarefa(nome, descricao, funcao, job)
+        job.do(self.executar, tarefa)
+        with self.lock:
+            self.tarefas[nome] = tarefa
+        self.acordar.set()
+        return tarefa
+
+    def executar(self, tarefa):
+        with self.lock:
+            tarefa.em_execucao = True
+        inicio = time.monotonic()
+        try:
+            tarefa.funcao()
+            status, erro = 'ok', None
+        except Exception as e:
+            logging.error(f"Erro na tarefa agendada {tarefa.nome}: {e}")
+            status, erro = 'erro', str(e)
+        with self.lock:
+            tarefa.em_execucao = False
+            tarefa.execucoes += 1
+            tarefa.falhas += status == 'erro'
+            tarefa.ultima_execucao = datetime.now()
+            tarefa.ultima_duracao = time.monotonic() - inicio
+            tarefa.ultimo_status = status
+            tarefa.ultimo_erro = erro
+
+    def executar_agora(self, nome):
+        """Antecipa a tarefa para a próxima volta da thread"""
+        with self.lock:
+            tarefa = self.tarefas.get(nome)
+            if tarefa is None:
+                return False
+            tarefa.job.next_run = datetime.now()
+        self.acordar.set()
+        return True
+
+    def iniciar(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.rodar, name='agendador', daemon=True)
+        self.thread.start()
+        logging.info("Agendador de tarefas iniciado")
+
+    def rodar(self):
+        while True:
+            try:
+                self.scheduler.run_pending()
+            except Exception as e:
+                logging.error(f"Erro no agendador de tarefas: {e}")
+            espera = self.scheduler.idle_seconds
+            self.acordar.wait(60 if espera is None else min(max(espera, 0), 60))
+            self.acordar.clear()
+
+    def status(self):
+        with self.lock:
+            return {
+                'ativo': self.thread is not None,
+                'tarefas': [tarefa.resumo() for tarefa in self.tarefas.values()]
+            }
+
+# Agendador único do processo
+agendador = Agendador()
@@ -0,0 +1,328 @@
+from array import array
+import itertools
+import logging
+import shutil
+import struct
+import json
+import mmap
+import csv
+import sys
+import os
+
+# Campos de uma ligação, na ordem das colunas do CSV e do arquivo compilado.
+# Cada ligação é gravada uma única vez; HD e matrícula são duas chaves que
+# apontam para a mesma linha.
+CAMPOS = ['HD', 'Matricula', 'Cliente', 'Endereço', 'Cidade', 'Bairro', 'Classificação', 'Latitude', 'Longitude']
+TOTAL_CAMPOS = len(CAMPOS)
+
+# Formato compilado das bases (.bin), lido via mmap. Todas as seções são
+# vetores de uint32 little-endian, exceto a última:
+#
+#   cabeçalho    MAGICO, versão, total de ligações, chaves e textos, e a
+#                assinatura (mtime/tamanho) do CSV de origem
+#   offsets      início de cada texto na área de textos (+1 sentinela)
+#   linhas       uma por ligação: o id do texto de cada um dos CAMPOS
+#   entradas     uma por chave, ordenadas pelos bytes da chave:
+#                (id do texto da chave, número da linha)
+#   textos       bytes UTF-8 de cada texto distinto, concatenados
+#
+# Os textos são um dicionário: Cidade, Bairro, Classificação e qualquer
+# outro valor repetido são gravados uma vez só. A busca é binária sobre as
+# entradas e só a linha encontrada é decodificada. Como o arquivo é mapeado
+# somente leitura, todos os processos que o abrem compartilham a mesma cópia
+# no page cache.
+
+MAGICO = b'VCGB'
+VERSAO = 2
+CABECALHO = struct.Struct('<4sHHIIIqQ')
+
+# Textos distintos lembrados de uma vez para gravar cada um só uma vez
+LIMITE_DICIONARIO = 250_000
+
+def caminho_binario(caminho_csv):
+    """Retorna o caminho do arquivo compilado correspondente ao CSV"""
+    return os.path.splitext(caminho_csv)[0] + '.bin'
+
+def caminho_alteracoes(caminho_csv):
+    """Retorna o caminho das alterações gravadas pelo modo delta sobre o .bin"""
+    return os.path.splitext(caminho_csv)[0] + '.delta.json'
+
+def vetor_le(valores):
+    vetor = valores if isinstance(valores, array) else array('I', valores)
+    if sys.byteorder != 'little':
+        vetor.byteswap()
+    return vetor
+
+def escrever_base_binaria(caminho, ligacoes, origem=(0, 0)):
+    """Grava o arquivo compilado a partir de uma sequência de ligações.
+
+    Cada ligação é uma tupla com os valores de CAMPOS; `ligacoes` pode ser
+    um iterador, consumido uma única vez. `origem` é (mtime_ns, tamanho) do
+    CSV que gerou as ligações, usado para saber se o arquivo compilado está
+    atualizado.
+
+    Os textos vão direto para um arquivo temporário e só os ids ficam na
+    memória, em arrays de uint32. O dicionário de textos repetidos tem no
+    máximo LIMITE_DICIONARIO entradas; ao encher ele recomeça, e um valor
+    repetido pode ser gravado mais de uma vez.
+    """
+    arquivo_temp = f"{caminho}.{os.getpid()}.tmp"
+    arquivo_textos = f"{caminho}.{os.getpid()}.textos.tmp"
+    ids_textos = {}
+    offsets = array('I', [0])
+    # (id do texto da chave, número da linha), na ordem das linhas
+    pares = array('I')
+    linhas = array('I')
+
+    try:
+        with open(arquivo_textos, 'w+b') as textos:
+            def id_texto(valor):
+                id_ = ids_textos.get(valor)
+                if id_ is None:
+                    if len(ids_textos) >= LIMITE_DICIONARIO:
+                        ids_textos.clear()
+                    id_ = ids_textos[valor] = len(offsets) - 1
+                    dados = valor.encode('utf-8')
+                    textos.write(dados)
+                    offsets.append(offsets[-1] + len(dados))
+                return id_
+
+            for numero, ligacao in enumerate(ligacoes):
+                ids = [id_texto(valor) for valor in ligacao]
+                linhas.extend(ids)
+                if ligacao[0]:
+                    pares.extend((ids[0], numero))
+                if ligacao[1]:
+                    pares.extend((ids[1], numero))
+            ids_textos.clear()
+            textos.flush()
+
+            entradas = array('I')
+            if pares:
+                with mmap.mmap(textos.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    def chave(i):
+                        id_ = pares[2 * i]
+                        return mm[offsets[id_]:offsets[id_ + 1]]
+
+                    # Ordenação estável: chaves iguais ficam na ordem das
+                    # linhas e uma chave repetida vale a da última linha
+                    for _, grupo in itertools.groupby(sorted(range(len(pares) // 2), key=chave), key=chave):
+                        *_, ultimo = grupo
+                        entradas.extend((pares[2 * ultimo], pares[2 * ultimo + 1]))
+
+            total_ligacoes = len(linhas) // TOTAL_CAMPOS
+            total_textos = len(offsets) - 1
+            textos.seek(0)
+            with open(arquivo_temp, 'wb') as f:
+                f.write(CABECALHO.pack(MAGICO, VERSAO, TOTAL_CAMPOS, total_ligacoes, len(entradas) // 2, total_textos, origem[0], origem[1]))
+                f.write(vetor_le(offsets).tobytes())
+                f.write(vetor_le(linhas).tobytes())
+                f.write(vetor_le(entradas).tobytes())
+                shutil.copyfileobj(textos, f)
+        os.replace(arquivo_temp, caminho)
+    finally:
+        for arquivo in (arquivo_textos, arquivo_temp):
+            if os.path.exists(arquivo):
+                os.remove(arquivo)
+    return total_ligacoes
+
+def ler_ligacoes_csv(caminho_csv):
+    """Lê as ligações de um CSV de base.
+
+    Aceita o formato atual (cabeçalho com CAMPOS e uma linha por ligação) e
+    o formato antigo (chave, json) em que cada ligação aparecia duas vezes.
+    É um gerador: no formato atual as linhas são lidas conforme consumidas,
+    sem carregar o arquivo inteiro.
+    """
+    with open(caminho_csv, encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        primeira = next(reader, None)
+        if primeira is None:
+            return
+        if primeira == CAMPOS:
+            for linha in reader:
+                if len(linha) == TOTAL_CAMPOS:
+                    yield tuple(linha)
+        else:
+            yield from ler_ligacoes_legado([primeira], reader)
+
+def ler_ligacoes_legado(*leitores):
+    ligacoes = []
+    for leitor in leitores:
+        for linha in leitor:
+            if len(linha) != 2:
+                continue
+            chave, json_str = linha
+            try:
+                dados = json.loads(json_str)
+            except json.JSONDecodeError:
+                logging.error(f"Erro ao decodificar JSON para chave {chave}")
+                continue
+
+            hd = dados.get('HD', '')
+            valores = [dados.get(campo, '') for campo in CAMPOS[1:]]
+            if hd == chave:
+                ligacoes.append((hd, '', *valores[1:]))
+                continue
+
+            # A linha da matrícula vinha logo após a do HD da mesma ligação
+            anterior = ligacoes[-1] if ligacoes else None
+            if anterior and anterior[1] == '' and list(anterior[2:]) == valores[1:] and valores[0] == chave:
+                ligacoes[-1] = (anterior[0], chave, *anterior[2:])
+            else:
+                ligacoes.append(('', chave, *valores[1:]))
+    return ligacoes
+
+def compilar_csv(caminho_csv, caminho_bin=None):
+    """Compila um CSV de base no formato binário"""
+    caminho_bin = caminho_bin or caminho_binario(caminho_csv)
+    info = os.stat(caminho_csv)
+    total = escrever_base_binaria(caminho_bin, ler_ligacoes_csv(caminho_csv), (info.st_mtime_ns, info.st_size))
+    logging.info(f"Base compilada: {caminho_bin} ({total} ligações)")
+    # O .bin novo já tem tudo; alterações de um delta anterior não valem mais
+    if caminho_bin == caminho_binario(caminho_csv) and os.path.exists(caminho_alteracoes(caminho_csv)):
+        os.remove(caminho_alteracoes(caminho_csv))
+    return total
+
+def ler_origem(caminho_bin):
+    """Retorna (mtime_ns, tamanho) do CSV de origem gravado no cabeçalho"""
+    try:
+        with open(caminho_bin, 'rb') as f:
+            cabecalho = f.read(CABECALHO.size)
+    except OSError:
+        return None
+    if len(cabecalho) < CABECALHO.size:
+        return None
+    magico, versao, campos, _, _, _, mtime_ns, tamanho = CABECALHO.unpack(cabecalho)
+    if magico != MAGICO or versao != VERSAO or campos != TOTAL_CAMPOS:
+        return None
+    return (mtime_ns, tamanho)
+
+def ler_alteracoes(caminho_csv, origem_csv, origem_bin):
+    """Lê as alterações do modo delta, se valem para o CSV e o .bin atuais.
+
+    O arquivo (JSON) guarda a assinatura do CSV que as alterações completam
+    e a do CSV que gerou o .bin, o total de chaves resultante e, para cada
+    chave alterada, os valores de CAMPOS da ligação (ou null se a chave
+    saiu da base). Retorna (alteracoes, chaves) ou None.
+    """
+    try:
+        with open(caminho_alteracoes(caminho_csv), 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if origem_bin is None or tuple(dados['origem_csv']) != tuple(origem_csv) or tuple(dados['origem_bin']) != tuple(origem_bin):
+        return None
+    return dados['alteracoes'], dados['chaves']
+
+class BaseBinaria:
+    """Base compilada aberta via mmap"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        with open(caminho, 'rb') as f:
+            tamanho = os.fstat(f.fileno()).st_size
+            # mmap de arquivo vazio não é permitido; o cabeçalho sempre existe
+            self.mm = mmap.mmap(f.fileno(), tamanho, access=mmap.ACCESS_READ)
+
+        magico, versao, campos, self.total, self.total_chaves, total_textos, _, _ = CABECALHO.unpack_from(self.mm, 0)
+        if magico != MAGICO or versao != VERSAO or campos != TOTAL_CAMPOS or sys.byteorder != 'little':
+            self.mm.close()
+            raise ValueError(f"Arquivo de base inválido: {caminho}")
+
+        # Visões sem cópia sobre as seções do arquivo
+        self.memoria = memoria = memoryview(self.mm)
+        inicio = CABECALHO.size
+        self.offsets = memoria[inicio:inicio + 4 * (total_textos + 1)].cast('I')
+        inicio += 4 * (total_textos + 1)
+        self.linhas = memoria[inicio:inicio + 4 * TOTAL_CAMPOS * self.total].cast('I')
+        inicio += 4 * TOTAL_CAMPOS * self.total
+        self.entradas = memoria[inicio:inicio + 8 * self.total_chaves].cast('I')
+        self.inicio_textos = inicio + 8 * self.total_chaves
+
+    def texto(self, id_texto):
+        inicio = self.inicio_textos + self.offsets[id_texto]
+        return self.mm[inicio:self.inicio_textos + self.offsets[id_texto + 1]]
+
+    def buscar(self, chave):
+        """Retorna o número da linha da chave ou None"""
+        alvo = chave.encode('utf-8')
+        entradas = self.entradas
+        inicio, fim = 0, self.total_chaves
+        while inicio < fim:
+            meio = (inicio + fim) // 2
+            atual = self.texto(entradas[2 * meio])
+            if atual < alvo:
+                inicio = meio + 1
+            elif atual > alvo:
+                fim = meio
+            else:
+                return entradas[2 * meio + 1]
+        return None
+
+    def obter(self, chave):
+        """Retorna os dados da matrícula/HD ou None"""
+        numero = self.buscar(chave)
+        if numero is None:
+            return None
+
+        base = numero * TOTAL_CAMPOS
+        dados = {campo: self.texto(self.linhas[base + i]).decode('utf-8') for i, campo in enumerate(CAMPOS)}
+        if not dados['HD']:
+            del dados['HD']
+        return dados
+
+    def obter_varios(self, chaves):
+        """Como obter, para várias chaves; retorna só as encontradas"""
+        encontrados = {}
+        for chave in chaves:
+            dados = self.obter(chave)
+            if dados is not None:
+                encontrados[chave] = dados
+        return encontrados
+
+    def __len__(self):
+        return self.total_chaves
+
+    def fechar(self):
+        # As visões precisam ser liberadas antes de fechar o mmap
+        for visao in (self.offsets, self.linhas, self.entradas, self.memoria):
+            visao.release()
+        self.mm.close()
+
+class BaseComAlteracoes:
+    """Base compilada com as alterações do modo delta por cima.
+
+    As chaves alteradas são respondidas pelo dicionário de alterações; as
+    demais, pelo .bin, que não precisa ser recompilado a cada delta.
+    """
+
+    def __init__(self, base, alteracoes, chaves):
+        self.base = base
+        self.alteracoes = alteracoes
+        self.chaves = chaves
+
+    def obter(self, chave):
+        """Retorna os dados da matrícula/HD ou None"""
+        if chave not in self.alteracoes:
+            return self.base.obter(chave)
+
+        valores = self.alteracoes[chave]
+        if valores is None:
+            return None
+        dados = dict(zip(CAMPOS, valores))
+        if not dados['HD']:
+            del dados['HD']
+        return dados
+
+    def obter_varios(self, chaves):
+        """Como obter, para várias chaves; retorna só as encontradas"""
+        encontrados = {}
+        for chave in chaves:
+            dados = self.obter(chave)
+            if dados is not None:
+                encontrados[chave] = dados
+        return encontrados
+
+    def __len__(self):
+        return self.chaves
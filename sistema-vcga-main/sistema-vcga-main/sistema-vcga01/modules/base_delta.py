@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import json
+import csv
+import os
+import config
+from modules.base_index import indice_bases
+from modules.base_binaria import (
+    CAMPOS, BaseBinaria, caminho_binario, caminho_alteracoes, compilar_csv,
+    ler_alteracoes, ler_ligacoes_csv, ler_origem
+)
+
+def resumo_valores(valores):
+    """Hash de 64 bits de uma sequência de textos"""
+    dados = '\x1f'.join(map(str, valores)).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(dados, digest_size=8).digest(), 'little')
+
+def identificar(pares):
+    """Gera (identidade, hash do conteúdo, posição, ligação) de cada par
+    (posição, ligação).
+
+    A identidade é o par (HD, matrícula); se o par se repete na base, a
+    ordem em que aparece entra na identidade para distinguir as repetições.
+    """
+    ocorrencias = {}
+    for posicao, ligacao in pares:
+        par = resumo_valores(ligacao[:2])
+        ordem = ocorrencias.get(par, 0)
+        ocorrencias[par] = ordem + 1
+        yield (par, ordem), resumo_valores(ligacao), posicao, ligacao
+
+class DeltaBase:
+    """Diferença entre a base gravada e uma conversão nova da mesma base.
+
+    As linhas da base gravada são identificadas pela posição (no CSV) ou
+    pelo id (no SQLite): `removidas` é um conjunto delas e `alteradas` leva
+    cada uma à ligação nova. `inseridas` são as ligações que não existiam,
+    na ordem da planilha.
+    """
+
+    def __init__(self):
+        self.inseridas = []
+        self.alteradas = {}
+        self.removidas = set()
+        self.inalteradas = 0
+
+    @classmethod
+    def calcular(cls, atuais, novas):
+        """Compara as ligações gravadas com as convertidas.
+
+        `atuais` gera pares (posição ou id, ligação) da base gravada; `novas`
+        gera as ligações da conversão. Cada lado é lido uma vez e só os
+        hashes da base gravada e as ligações que mudaram ficam na memória.
+        """
+        gravadas = {
+            identidade: (conteudo, posicao)
+            for identidade, conteudo, posicao, _ in identificar(atuais)
+        }
+
+        delta = cls()
+        for identidade, conteudo, _, ligacao in identificar(enumerate(novas)):
+            anterior = gravadas.pop(identidade, None)
+            if anterior is None:
+                delta.inseridas.append(ligacao)
+            elif anterior[0] != conteudo:
+                delta.alteradas[anterior[1]] = ligacao
+            else:
+                delta.inalteradas += 1
+        delta.removidas = {posicao for _, posicao in gravadas.values()}
+        return delta
+
+    @property
+    def vazio(self):
+        return not (self.inseridas or self.alteradas or self.removidas)
+
+    def resumo(self):
+        return {
+            'inseridas': len(self.inseridas),
+            'alteradas': len(self.alteradas),
+            'removidas': len(self.removidas),
+            'inalteradas': self.inalteradas
+        }
+
+def chaves_ligacao(ligacao):
+    return [chave for chave in ligacao[:2] if chave]
+
+def aplicar_delta_arquivo(caminho_csv, delta):
+    """Aplica o delta numa base em CSV sem recompilar o .bin.
+
+    O CSV é regravado em sequência (as linhas alteradas no lugar, as novas
+    no fim). As chaves cujo resultado pode ter mudado vão para o arquivo de
+    alterações, com a ligação que a busca passa a encontrar; o índice abre
+    o .bin antigo com elas por cima. Quando as alterações passam de
+    config.DELTA_LIMITE das chaves do .bin, ele é recompilado.
+    """
+    arquivo_temp = caminho_csv + '.tmp'
+    arquivo_bin = caminho_binario(caminho_csv)
+    info = os.stat(caminho_csv)
+    origem_bin = ler_origem(arquivo_bin)
+
+    # Chaves alteradas por deltas anteriores continuam valendo sobre o .bin
+    afetadas = set()
+    if origem_bin != (info.st_mtime_ns, info.st_size):
+        anteriores = ler_alteracoes(caminho_csv, (info.st_mtime_ns, info.st_size), origem_bin)
+        if anteriores is not None:
+            afetadas.update(anteriores[0])
+        else:
+            origem_bin = None
+
+    try:
+        with open(arquivo_temp, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(CAMPOS)
+            for posicao, ligacao in enumerate(ler_ligacoes_csv(caminho_csv)):
+                if posicao in delta.removidas:
+                    afetadas.update(chaves_ligacao(ligacao))
+                elif posicao in delta.alteradas:
+                    nova = delta.alteradas[posicao]
+                    afetadas.update(chaves_ligacao(ligacao))
+                    afetadas.update(chaves_ligacao(nova))
+                    writer.writerow(nova)
+                else:
+                    writer.writerow(ligacao)
+            for ligacao in delta.inseridas:
+                afetadas.update(chaves_ligacao(ligacao))
+                writer.writerow(ligacao)
+
+        # Uma chave repetida vale a da última linha, como no .bin
+        alteracoes = dict.fromkeys(afetadas)
+        for ligacao in ler_ligacoes_csv(arquivo_temp):
+            for chave in chaves_ligacao(ligacao):
+                if chave in alteracoes:
+                    alteracoes[chave] = list(ligacao)
+
+        novo = os.stat(arquivo_temp)
+        with indice_bases.publicando():
+            if origem_bin is None or not salvar_alteracoes(caminho_csv, alteracoes, (novo.st_mtime_ns, novo.st_size), origem_bin):
+                os.replace(arquivo_temp, caminho_csv)
+                compilar_csv(caminho_csv)
+            else:
+                os.replace(arquivo_temp, caminho_csv)
+    finally:
+        if os.path.exists(arquivo_temp):
+            os.remove(arquivo_temp)
+
+    logging.info(f"Delta aplicado em {caminho_csv}: {delta.resumo()}")
+
+def salvar_alteracoes(caminho_csv, alteracoes, origem_csv, origem_bin):
+    """Grava o arquivo de alterações; False se é melhor recompilar o .bin"""
+    base = BaseBinaria(caminho_binario(caminho_csv))
+    try:
+        if len(alteracoes) > config.DELTA_LIMITE * max(len(base), 1):
+            return False
+        # Total de chaves: as do .bin, mais as que entraram, menos as que saíram
+        chaves = len(base) + sum(
+            (valores is not None) - (base.buscar(chave) is not None)
+            for chave, valores in alteracoes.items()
+        )
+    finally:
+        base.fechar()
+
+    arquivo = caminho_alteracoes(caminho_csv)
+    with open(arquivo + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({
+            'origem_csv': list(origem_csv),
+            'origem_bin': list(origem_bin),
+            'chaves': chaves,
+            'alteracoes': alteracoes
+        }, f, ensure_ascii=False)
+    os.replace(arquivo + '.tmp', arquivo)
+    return True
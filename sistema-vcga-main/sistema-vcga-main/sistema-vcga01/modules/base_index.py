@@ -0,0 +1,218 @@
+from contextlib import contextmanager
+import threading
+import logging
+import time
+import os
+from datetime import datetime
+from modules.base_binaria import BaseBinaria, BaseComAlteracoes, caminho_binario, compilar_csv, ler_origem, ler_alteracoes
+from modules.base_sqlite import base_sqlite
+import config
+
+PASTA_BASES = 'dados_matriculas'
+TOTAL_BASES = 10
+
+def nome_arquivo_base(numero):
+    """Retorna o nome do arquivo CSV da base (a base 1 não tem sufixo)"""
+    if numero == 1:
+        return "base_vcga.csv"
+    return f"base_vcga{numero}.csv"
+
+def caminho_base(numero):
+    """Retorna o caminho do arquivo CSV da base"""
+    return os.path.join(PASTA_BASES, nome_arquivo_base(numero))
+
+class SnapshotBases:
+    """Versão imutável do índice, identificada por um número de geração"""
+
+    def __init__(self, geracao, bases, assinatura, duracao):
+        self.geracao = geracao
+        self.bases = bases
+        self.assinatura = assinatura
+        self.duracao = duracao
+        self.criado_em = datetime.now()
+
+    def obter(self, chave):
+        """Retorna os dados da matrícula/HD ou None"""
+        # Uma chave repetida vale a da última base, como na leitura dos CSVs
+        for base in reversed(self.bases):
+            dados = base.obter(chave)
+            if dados is not None:
+                return dados
+        return None
+
+    def obter_varios(self, chaves):
+        """Busca várias matrículas/HDs de uma vez; retorna {chave: dados}
+        só com as encontradas"""
+        encontrados = {}
+        pendentes = set(chaves)
+        for base in reversed(self.bases):
+            if not pendentes:
+                break
+            dados = base.obter_varios(pendentes)
+            encontrados.update(dados)
+            pendentes.difference_update(dados)
+        return encontrados
+
+    def __len__(self):
+        return sum(len(base) for base in self.bases)
+
+class IndiceBases:
+    """Índice em memória de matrículas/HDs de todas as bases.
+
+    O índice é montado uma única vez e só é reconstruído quando o mtime ou o
+    tamanho de algum arquivo de base muda. As consultas são feitas nos
+    arquivos compilados (.bin) mapeados em memória, sem reler os CSVs; os
+    arquivos são verificados no máximo uma vez a cada `intervalo_verificacao`
+    segundos. Uma base atualizada pelo modo delta reaproveita o .bin com as
+    alterações por cima (ver base_delta).
+
+    Cada reconstrução gera um novo `SnapshotBases` numa thread separada, que
+    só substitui o atual quando está completo. Quem já pegou um snapshot
+    continua usando a geração antiga até terminar o que estava fazendo.
+
+    Com `config.BASE_STORAGE = 'sqlite'` as consultas vão direto ao banco e a
+    assinatura passa a ser a geração de cada base registrada nele.
+    """
+
+    def __init__(self, arquivos=None, intervalo_verificacao=2.0):
+        self.arquivos = arquivos or [caminho_base(i) for i in range(1, TOTAL_BASES + 1)]
+        self.intervalo_verificacao = intervalo_verificacao
+        self.snapshot = SnapshotBases(0, [], None, 0.0)
+        self.proxima_verificacao = 0.0
+        self.lock = threading.Lock()
+        self.lock_montagem = threading.RLock()
+        self.thread_construcao = None
+        self.recarga_pendente = False
+
+    def calcular_assinatura(self):
+        """Retorna (arquivo, mtime, tamanho) de cada base existente"""
+        if config.BASE_STORAGE == 'sqlite':
+            return base_sqlite.assinatura()
+
+        assinatura = []
+        for arquivo in self.arquivos:
+            try:
+                info = os.stat(arquivo)
+            except OSError:
+                continue
+            assinatura.append((arquivo, info.st_mtime_ns, info.st_size))
+        return tuple(assinatura)
+
+    def abrir_base(self, arquivo, mtime_ns, tamanho):
+        """Abre o .bin da base, recompilando-o se o CSV mudou.
+
+        Se o CSV mudou por um delta, o .bin antigo é aberto com as
+        alterações por cima, sem recompilar.
+        """
+        arquivo_bin = caminho_binario(arquivo)
+        origem = ler_origem(arquivo_bin)
+        if origem == (mtime_ns, tamanho):
+            return BaseBinaria(arquivo_bin)
+
+        alteracoes = ler_alteracoes(arquivo, (mtime_ns, tamanho), origem)
+        if alteracoes is not None:
+            return BaseComAlteracoes(BaseBinaria(arquivo_bin), *alteracoes)
+
+        logging.info(f"Compilando base {arquivo}")
+        compilar_csv(arquivo, arquivo_bin)
+        return BaseBinaria(arquivo_bin)
+
+    def construir(self, assinatura):
+        if config.BASE_STORAGE == 'sqlite':
+            return [base_sqlite]
+
+        bases = []
+        for arquivo, mtime_ns, tamanho in assinatura:
+            try:
+                bases.append(self.abrir_base(arquivo, mtime_ns, tamanho))
+            except (OSError, ValueError) as e:
+                logging.error(f"Erro ao abrir a base {arquivo}: {e}")
+        return bases
+
+    def montar_snapshot(self):
+        """Monta uma nova geração e a publica no lugar da atual"""
+        with self.lock_montagem:
+            inicio = time.perf_counter()
+            assinatura = self.calcular_assinatura()
+            logging.info(f"Montando índice das bases ({len(assinatura)} arquivos)")
+            bases = self.construir(assinatura)
+            duracao = time.perf_counter() - inicio
+
+            # Troca atômica: uma única atribuição de referência
+            snapshot = SnapshotBases(self.snapshot.geracao + 1, bases, assinatura, duracao)
+            self.snapshot = snapshot
+
+        logging.info(f"Índice geração {snapshot.geracao} montado com {len(snapshot)} chaves em {duracao:.2f}s")
+        return snapshot
+
+    def executar_recargas(self):
+        while True:
+            try:
+                self.montar_snapshot()
+            except Exception as e:
+                logging.error(f"Erro ao montar índice das bases: {e}")
+
+            with self.lock:
+                # Uma mudança chegou durante a montagem: montar de novo
+                if not self.recarga_pendente:
+                    self.thread_construcao = None
+                    return
+                self.recarga_pendente = False
+
+    def recarregar(self):
+        """Agenda a montagem de uma nova geração em segundo plano"""
+        with self.lock:
+            if self.thread_construcao is not None:
+                self.recarga_pendente = True
+                return
+            self.thread_construcao = threading.Thread(target=self.executar_recargas, daemon=True)
+            self.thread_construcao.start()
+
+    @contextmanager
+    def publicando(self):
+        """Bloco em que várias bases são trocadas de uma vez.
+
+        Nenhuma geração é montada enquanto o bloco roda, então o bot nunca vê
+        só parte das bases novas; no fim é agendada uma única recarga.
+        """
+        with self.lock_montagem:
+            yield
+        self.recarregar()
+
+    def snapshot_atual(self):
+        """Retorna a geração atual, agendando recarga se as bases mudaram"""
+        snapshot = self.snapshot
+        if snapshot.assinatura is None:
+            # Primeira montagem: sem geração anterior para servir, montar já
+            with self.lock_montagem:
+                if self.snapshot.assinatura is None:
+                    self.montar_snapshot()
+            return self.snapshot
+
+        agora = time.monotonic()
+        if agora < self.proxima_verificacao:
+            return snapshot
+        self.proxima_verificacao = agora + self.intervalo_verificacao
+
+        # Durante uma montagem a mudança será vista na próxima verificação
+        if self.thread_construcao is None and self.calcular_assinatura() != snapshot.assinatura:
+            self.recarregar()
+        return snapshot
+
+    def obter(self, chave):
+        """Retorna os dados da matrícula/HD ou None"""
+        return self.snapshot_atual().obter(chave)
+
+    def status(self):
+        snapshot = self.snapshot
+        return {
+            'geracao': snapshot.geracao,
+            'chaves': len(snapshot),
+            'arquivos': len(snapshot.assinatura or ()),
+            'duracao_montagem': round(snapshot.duracao, 3),
+            'montado_em': snapshot.criado_em.strftime('%d/%m/%Y %H:%M:%S') if snapshot.geracao else None,
+            'montando': self.thread_construcao is not None
+        }
+
+# Índice único compartilhado pelo processo
+indice_bases = IndiceBases()
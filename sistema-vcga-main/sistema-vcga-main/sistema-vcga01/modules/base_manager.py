@@ -2,19 +2,42 @@ from flask import Blueprint, render_template, request, jsonify, session, redirec
 import os
 import json
 from datetime import datetime
+from modules.base_index import indice_bases, nome_arquivo_base, caminho_base
+from modules.base_binaria import CAMPOS, caminho_binario, caminho_alteracoes
+from modules.base_sqlite import base_sqlite
+from modules.cache_conversao import cache_conversoes
+from modules.fila_conversao import fila_conversoes
+import config
 
 base_bp = Blueprint('base', __name__)
 
+def get_base_status_sqlite():
+    """Status das bases no SQLite, lido da tabela de metadados"""
+    bases_status = {}
+    registradas = base_sqlite.status()
+    for i in range(1, 11):
+        if i in registradas:
+            linhas, modificado, _ = registradas[i]
+            bases_status[f"base{i}"] = {
+                'status': 'completo' if linhas else 'vazio',
+                'arquivo': os.path.basename(base_sqlite.caminho),
+                'linhas': linhas,
+                'modificado': datetime.fromisoformat(modificado).strftime('%d/%m/%Y %H:%M')
+            }
+        else:
+            bases_status[f"base{i}"] = {'status': 'inexistente', 'arquivo': os.path.basename(base_sqlite.caminho)}
+    
+    return bases_status
+
 def get_base_status():
     """Retorna o status de todas as bases"""
+    if config.BASE_STORAGE == 'sqlite':
+        return get_base_status_sqlite()
+    
     bases_status = {}
     for i in range(1, 11):
-        if i == 1:
-            base_name = "base_vcga.csv"
-        else:
-            base_name = f"base_vcga{i}.csv"
-            
-        base_path = os.path.join('dados_matriculas', base_name)
+        base_name = nome_arquivo_base(i)
+        base_path = caminho_base(i)
         
         if os.path.exists(base_path):
             try:
@@ -22,6 +45,9 @@ def get_base_status():
                     content = f.read().strip()
                     if content:
                         linhas = content.count('\n') + 1 if content else 0
+                        if content.startswith(','.join(CAMPOS)):
+                            # Desconta o cabeçalho
+                            linhas -= 1
                         bases_status[f"base{i}"] = {
                             'status': 'completo',
                             'arquivo': base_name,
@@ -45,7 +71,30 @@ def bases_config():
 
 @base_bp.route('/status')
 def get_status():
-    return jsonify(get_base_status())
+    status = get_base_status()
+    status['indice'] = indice_bases.status()
+    return jsonify(status)
+
+def remover_base(base_number):
+    cache_conversoes.esquecer(base_number)
+    
+    if config.BASE_STORAGE == 'sqlite':
+        if base_sqlite.remover_base(base_number):
+            indice_bases.recarregar()
+            return jsonify({'success': True, 'message': f'Base {base_number} removida com sucesso!'})
+        return jsonify({'success': False, 'message': f'Base {base_number} não encontrada'})
+    
+    output_path = caminho_base(base_number)
+    
+    if os.path.exists(output_path):
+        os.remove(output_path)
+        for arquivo in (caminho_binario(output_path), caminho_alteracoes(output_path)):
+            if os.path.exists(arquivo):
+                os.remove(arquivo)
+        indice_bases.recarregar()
+        return jsonify({'success': True, 'message': f'Base {base_number} removida com sucesso!'})
+    else:
+        return jsonify({'success': False, 'message': f'Base {base_number} não encontrada'})
 
 @base_bp.route('/delete/<int:base_number>', methods=['POST'])
 def delete_base(base_number):
@@ -53,18 +102,14 @@ def delete_base(base_number):
         if base_number < 1 or base_number > 10:
             return jsonify({'success': False, 'message': 'Número da base inválido'})
         
-        if base_number == 1:
-            output_filename = "base_vcga.csv"
-        else:
-            output_filename = f"base_vcga{base_number}.csv"
-            
-        output_path = os.path.join('dados_matriculas', output_filename)
-        
-        if os.path.exists(output_path):
-            os.remove(output_path)
-            return jsonify({'success': True, 'message': f'Base {base_number} removida com sucesso!'})
-        else:
-            return jsonify({'success': False, 'message': f'Base {base_number} não encontrada'})
+        # Uma conversão em andamento regravaria a base (ou falharia sem ela)
+        reserva = fila_conversoes.reservar([base_number])
+        if reserva is None:
+            return jsonify({'success': False, 'message': f'A base {base_number} está sendo convertida; aguarde para remover'})
+        try:
+            return remover_base(base_number)
+        finally:
+            fila_conversoes.liberar([base_number], reserva)
     
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao remover base: {str(e)}'})
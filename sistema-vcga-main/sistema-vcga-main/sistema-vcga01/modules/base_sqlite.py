@@ -0,0 +1,243 @@
+import threading
+import sqlite3
+import logging
+import os
+from datetime import datetime
+
+CAMINHO_PADRAO = os.path.join('dados_matriculas', 'bases.db')
+
+# Colunas do registro, na ordem da tabela e de base_binaria.CAMPOS, e o nome
+# usado nas respostas do bot
+CAMPOS = [
+    ('hd', 'HD'),
+    ('matricula', 'Matricula'),
+    ('cliente', 'Cliente'),
+    ('endereco', 'Endereço'),
+    ('cidade', 'Cidade'),
+    ('bairro', 'Bairro'),
+    ('classificacao', 'Classificação'),
+    ('latitude', 'Latitude'),
+    ('longitude', 'Longitude'),
+]
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS registros (
+    id INTEGER PRIMARY KEY,
+    base_id INTEGER NOT NULL,
+    hd TEXT,
+    matricula TEXT,
+    cliente TEXT,
+    endereco TEXT,
+    cidade TEXT,
+    bairro TEXT,
+    classificacao TEXT,
+    latitude TEXT,
+    longitude TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_registros_matricula ON registros(matricula);
+CREATE INDEX IF NOT EXISTS idx_registros_hd ON registros(hd);
+CREATE INDEX IF NOT EXISTS idx_registros_base ON registros(base_id);
+CREATE TABLE IF NOT EXISTS bases (
+    base_id INTEGER PRIMARY KEY,
+    linhas INTEGER NOT NULL,
+    modificado TEXT NOT NULL,
+    geracao INTEGER NOT NULL
+);
+"""
+
+COLUNAS = ', '.join(coluna for coluna, _ in CAMPOS)
+
+# A mesma chave pode ser matrícula numa linha e HD em outra; vale a última
+# base e, dentro dela, a última linha, como na leitura dos CSVs
+SQL_BUSCA = f"""
+SELECT {COLUNAS}, base_id, id FROM registros WHERE matricula = ?
+UNION ALL
+SELECT {COLUNAS}, base_id, id FROM registros WHERE hd = ?
+ORDER BY base_id DESC, id DESC
+LIMIT 1
+"""
+
+# Chaves distintas (HDs e matrículas) de cada base, somadas, como o total
+# de chaves dos .bin
+SQL_CHAVES = """
+SELECT COUNT(*) FROM (
+    SELECT base_id, matricula FROM registros WHERE matricula IS NOT NULL
+    UNION
+    SELECT base_id, hd FROM registros WHERE hd IS NOT NULL
+)
+"""
+
+# Chaves por consulta em obter_varios (o SQLite limita os parâmetros)
+CHAVES_POR_CONSULTA = 400
+
+SQL_INSERCAO = f"INSERT INTO registros (base_id, {COLUNAS}) VALUES ({', '.join(['?'] * (len(CAMPOS) + 1))})"
+SQL_ATUALIZACAO = f"UPDATE registros SET {', '.join(f'{coluna} = ?' for coluna, _ in CAMPOS)} WHERE id = ?"
+SQL_GERACAO = (
+    'INSERT OR REPLACE INTO bases (base_id, linhas, modificado, geracao) '
+    'VALUES (?, ?, ?, COALESCE((SELECT MAX(geracao) FROM bases), 0) + 1)'
+)
+
+def valores_registro(ligacao):
+    """Valores de CAMPOS para gravar; HD ou matrícula vazios viram NULL"""
+    return (ligacao[0] or None, ligacao[1] or None, *ligacao[2:])
+
+class BaseSQLite:
+    """Armazenamento das bases num único banco SQLite.
+
+    Uma linha por ligação, com índices em `matricula` e `hd`. O banco usa
+    WAL, então o site e o bot leem ao mesmo tempo enquanto um único escritor
+    (a conversão) grava. Cada thread tem a sua conexão; as consultas usam o
+    cache de comandos preparados do módulo sqlite3.
+    """
+
+    def __init__(self, caminho=CAMINHO_PADRAO):
+        self.caminho = caminho
+        self.local = threading.local()
+        self.lock_escrita = threading.Lock()
+        # (assinatura, total de chaves): a contagem varre os índices
+        self.total_chaves = None
+
+    def conexao(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            dir_path = os.path.dirname(self.caminho)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+            conn = sqlite3.connect(self.caminho, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(ESQUEMA)
+            self.local.conn = conn
+        return conn
+
+    def substituir_base(self, numero, ligacoes):
+        """Troca todo o conteúdo da base numa única transação.
+
+        `ligacoes` é uma sequência de tuplas com os valores de CAMPOS, como
+        no CSV; HD ou matrícula vazios são gravados como NULL.
+        """
+        return self.substituir_bases({numero: ligacoes})[numero]
+
+    def substituir_bases(self, bases):
+        """Troca várias bases ({numero: ligacoes}) numa única transação.
+
+        Quem lê o banco vê todas as bases antigas ou todas as novas.
+        Retorna {numero: total de ligações gravadas}.
+        """
+        totais = {}
+        with self.lock_escrita:
+            conn = self.conexao()
+            with conn:
+                for numero, ligacoes in bases.items():
+                    linhas = ((numero, *valores_registro(ligacao)) for ligacao in ligacoes)
+                    conn.execute('DELETE FROM registros WHERE base_id = ?', (numero,))
+                    totais[numero] = conn.executemany(SQL_INSERCAO, linhas).rowcount
+                    conn.execute(SQL_GERACAO, (numero, totais[numero], datetime.now().isoformat()))
+        for numero, total in totais.items():
+            logging.info(f"Base {numero} gravada no SQLite com {total} ligações")
+        return totais
+
+    def aplicar_delta(self, numero, delta):
+        """Aplica um base_delta.DeltaBase na base, numa única transação.
+
+        Só as linhas removidas, alteradas e inseridas são tocadas; as
+        alteradas mantêm o id e, com ele, a posição na base. Retorna o total
+        de ligações da base depois do delta.
+        """
+        with self.lock_escrita:
+            conn = self.conexao()
+            with conn:
+                linha = conn.execute('SELECT linhas FROM bases WHERE base_id = ?', (numero,)).fetchone()
+                anteriores = linha[0] if linha else 0
+                conn.executemany('DELETE FROM registros WHERE id = ?', ((id_,) for id_ in delta.removidas))
+                conn.executemany(SQL_ATUALIZACAO, ((*valores_registro(ligacao), id_) for id_, ligacao in delta.alteradas.items()))
+                conn.executemany(SQL_INSERCAO, ((numero, *valores_registro(ligacao)) for ligacao in delta.inseridas))
+                total = anteriores - len(delta.removidas) + len(delta.inseridas)
+                conn.execute(SQL_GERACAO, (numero, total, datetime.now().isoformat()))
+        logging.info(f"Delta aplicado na base {numero} (SQLite): {delta.resumo()}")
+        return total
+
+    def remover_base(self, numero):
+        """Remove a base; retorna False se ela não existia"""
+        with self.lock_escrita:
+            conn = self.conexao()
+            with conn:
+                conn.execute('DELETE FROM registros WHERE base_id = ?', (numero,))
+                removidas = conn.execute('DELETE FROM bases WHERE base_id = ?', (numero,)).rowcount
+        return removidas > 0
+
+    def obter(self, chave):
+        """Retorna os dados da matrícula/HD ou None"""
+        linha = self.conexao().execute(SQL_BUSCA, (chave, chave)).fetchone()
+        if linha is None:
+            return None
+
+        dados = {campo: (linha[i] or '') for i, (_, campo) in enumerate(CAMPOS)}
+        if not dados['HD']:
+            del dados['HD']
+        return dados
+
+    def obter_varios(self, chaves):
+        """Busca várias matrículas/HDs numa única consulta; retorna só as encontradas"""
+        chaves = list(dict.fromkeys(chaves))
+        melhores = {}
+        for inicio in range(0, len(chaves), CHAVES_POR_CONSULTA):
+            lote = chaves[inicio:inicio + CHAVES_POR_CONSULTA]
+            marcadores = ', '.join(['?'] * len(lote))
+            sql = (
+                f"SELECT {COLUNAS}, base_id, id FROM registros WHERE matricula IN ({marcadores}) "
+                f"UNION ALL SELECT {COLUNAS}, base_id, id FROM registros WHERE hd IN ({marcadores})"
+            )
+            pedidas = set(lote)
+            for linha in self.conexao().execute(sql, lote + lote):
+                ordem = linha[-2:]
+                # Mesma regra de SQL_BUSCA: vale a última base e a última linha
+                for chave in (linha[1], linha[0]):
+                    if chave in pedidas and (chave not in melhores or melhores[chave][-2:] < ordem):
+                        melhores[chave] = linha
+
+        encontrados = {}
+        for chave, linha in melhores.items():
+            dados = {campo: (linha[i] or '') for i, (_, campo) in enumerate(CAMPOS)}
+            if not dados['HD']:
+                del dados['HD']
+            encontrados[chave] = dados
+        return encontrados
+
+    def ligacoes(self, numero):
+        """Itera as ligações da base na ordem em que foram gravadas, como no CSV"""
+        for _, ligacao in self.ligacoes_com_id(numero):
+            yield ligacao
+
+    def ligacoes_com_id(self, numero):
+        """Como ligacoes, em pares (id da linha, ligação)"""
+        cursor = self.conexao().execute(f'SELECT id, {COLUNAS} FROM registros WHERE base_id = ? ORDER BY id', (numero,))
+        for id_, *valores in cursor:
+            yield id_, tuple(valor or '' for valor in valores)
+
+    def status(self):
+        """Retorna {base_id: (linhas, modificado, geracao)} sem varrer os registros"""
+        cursor = self.conexao().execute('SELECT base_id, linhas, modificado, geracao FROM bases')
+        return {base_id: (linhas, modificado, geracao) for base_id, linhas, modificado, geracao in cursor}
+
+    def assinatura(self):
+        """Identifica o conteúdo atual para o índice saber quando recarregar"""
+        return tuple(sorted((base_id, geracao) for base_id, (_, _, geracao) in self.status().items()))
+
+    def otimizar(self):
+        """Atualiza as estatísticas dos índices e esvazia o WAL (tarefa agendada)"""
+        with self.lock_escrita:
+            conn = self.conexao()
+            conn.execute('PRAGMA optimize')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def __len__(self):
+        """Total de chaves, como BaseBinaria; recontado quando as bases mudam"""
+        assinatura = self.assinatura()
+        total_chaves = self.total_chaves
+        if total_chaves is None or total_chaves[0] != assinatura:
+            total_chaves = self.total_chaves = (assinatura, self.conexao().execute(SQL_CHAVES).fetchone()[0])
+        return total_chaves[1]
+
+# Banco único compartilhado pelo processo (aberto só no primeiro uso)
+base_sqlite = BaseSQLite()
@@ -0,0 +1,250 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import logging
+import queue
+import time
+import aiohttp
+import config
+import modules.bot_manager as bot_manager
+from modules.bot_manager import ChatBot, eventos_por_chat, fila_mensagens
+from modules.base_index import indice_bases
+from modules.metricas import tamanho_chats, duracao_busca
+from modules.rastreamento import rastreador, trecho
+from modules.registro_mensagens import registro_mensagens
+
+ERROS_CONEXAO = (aiohttp.ClientError, asyncio.TimeoutError)
+
+def devolver_evento(futuro):
+    """Põe de volta na fila o evento lido depois do cancelamento"""
+    if futuro.cancelled() or futuro.exception() is not None:
+        return
+    try:
+        fila_mensagens.put_nowait(futuro.result())
+    except queue.Full:
+        # A varredura inicial da próxima execução cobre a mensagem
+        logging.warning("Fila de mensagens do bot cheia; evento devolvido descartado")
+
+class ChatBotAsync(ChatBot):
+    """Motor 'asyncio' do bot: um único loop de eventos, numa thread.
+
+    No loop ficam só a varredura dos chats (sessão aiohttp com keep-alive
+    para o servidor WhatsApp), a leitura dos eventos e as buscas nas bases.
+    Os envios não: as respostas vão para o despachante de envios, que tem a
+    sua própria thread, como no motor 'threads'. Cada chat com mensagens
+    novas vira uma tarefa, que espera a tarefa anterior do mesmo chat para
+    manter a ordem das respostas. /bot/stop cancela o loop e as tarefas em
+    andamento.
+    """
+
+    motor = 'asyncio'
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self.principal = None
+        self.sessao = None
+        self.tarefas = set()
+        self.ultima_do_chat = {}
+
+    def processar_mensagens(self):
+        try:
+            asyncio.run(self.executar())
+        except Exception as e:
+            logging.error(f"Erro no motor asyncio do bot: {e}")
+
+    async def executar(self):
+        self.loop = asyncio.get_running_loop()
+        self.principal = asyncio.current_task()
+        conector = aiohttp.TCPConnector(limit=config.BOT_ASYNC_CONEXOES)
+        timeout = aiohttp.ClientTimeout(total=30)
+
+        async with aiohttp.ClientSession(connector=conector, timeout=timeout) as self.sessao:
+            try:
+                if config.BOT_INGESTAO == 'eventos':
+                    await self.consumir_eventos()
+                else:
+                    await self.consultar_chats()
+            except asyncio.CancelledError:
+                logging.info("Motor asyncio do bot cancelado")
+            finally:
+                for tarefa in list(self.tarefas):
+                    tarefa.cancel()
+                await asyncio.gather(*self.tarefas, return_exceptions=True)
+
+    def finalizar(self):
+        """Chamado por /bot/stop, de outra thread"""
+        super().finalizar()
+        if self.loop and self.principal:
+            try:
+                self.loop.call_soon_threadsafe(self.principal.cancel)
+            except RuntimeError:
+                # O loop já terminou
+                pass
+
+    def status_motor(self):
+        return {
+            'motor': self.motor,
+            'tarefas': len(self.tarefas)
+        }
+
+    def agendar(self, chat_id, sender_name, mensagens, recebido_em=None, ids=()):
+        """Cria a tarefa que responde ao chat, depois da anterior do mesmo chat"""
+        anterior = self.ultima_do_chat.get(chat_id)
+        tarefa = asyncio.create_task(self.tratar_em_ordem(anterior, chat_id, sender_name, mensagens, recebido_em, ids))
+        self.ultima_do_chat[chat_id] = tarefa
+        self.tarefas.add(tarefa)
+        tarefa.add_done_callback(lambda t: self.concluida(chat_id, t, ids))
+
+    def concluida(self, chat_id, tarefa, ids=()):
+        self.tarefas.discard(tarefa)
+        if self.ultima_do_chat.get(chat_id) is tarefa:
+            del self.ultima_do_chat[chat_id]
+        if tarefa.cancelled():
+            # Cancelada por /bot/stop, talvez antes de começar: as mensagens
+            # voltam a ser novas para a próxima execução
+            registro_mensagens.esquecer(ids)
+        elif tarefa.exception():
+            logging.error(f"Erro ao responder chat {chat_id}: {tarefa.exception()}")
+
+    async def tratar_em_ordem(self, anterior, chat_id, sender_name, mensagens, recebido_em, ids):
+        if anterior:
+            await asyncio.wait([anterior])
+        await self.tratar_mensagens(chat_id, sender_name, mensagens, recebido_em, ids)
+
+    async def tratar_mensagens(self, chat_id, sender_name, mensagens, recebido_em=None, ids=()):
+        mensagens = [mensagem.strip() for mensagem in mensagens]
+        if not mensagens:
+            return
+
+        # Cada tarefa tem o seu contexto, então o rastro não passa para outro chat
+        rastro, token = rastreador.iniciar(chat_id, len(mensagens), recebido_em)
+        try:
+            with trecho('classificar'):
+                chaves = self.chaves_das_mensagens(sender_name, mensagens)
+            dados = {}
+            if chaves:
+                with trecho('buscar'):
+                    # No modo SQLite a busca vai ao disco; fica fora do loop
+                    inicio = time.perf_counter()
+                    dados = await asyncio.to_thread(indice_bases.snapshot_atual().obter_varios, chaves)
+                    duracao_busca.observar(time.perf_counter() - inicio, tipo=self.tipo_da_busca(mensagens))
+
+            with trecho('montar'):
+                resposta = self.resposta_conjunta(sender_name, mensagens, dados)
+            if resposta:
+                # Só enfileira no despachante; não bloqueia o loop
+                self.responder_mensagem(chat_id, resposta, recebido_em)
+            elif rastro:
+                rastreador.concluir(rastro)
+        except BaseException as e:
+            # Inclui o CancelledError de /bot/stop
+            registro_mensagens.esquecer(ids)
+            if rastro:
+                rastreador.concluir(rastro, str(e) or type(e).__name__)
+            raise
+        else:
+            registro_mensagens.confirmar(ids)
+        finally:
+            rastreador.soltar(token)
+
+    async def marcar_como_lida(self, chat_id):
+        try:
+            async with self.sessao.post(f'{self.base_url}/mark-seen', json={'chatId': chat_id}):
+                pass
+        except ERROS_CONEXAO as e:
+            logging.error(f"Erro ao marcar chat {chat_id} como lido: {e}")
+
+    async def mensagens_nao_lidas(self, chat):
+        unread_count = chat.get('unreadCount', 0)
+        last_message = chat.get('lastMessage') or {}
+        if unread_count <= 1:
+            return [last_message] if last_message else []
+
+        params = {'chatId': chat['id']['_serialized'], 'limit': unread_count}
+        async with self.sessao.get(f'{self.base_url}/unread-messages', params=params) as response:
+            if response.status != 200:
+                logging.warning(f"Não foi possível buscar as mensagens não lidas: {response.status}")
+                return [last_message] if last_message else []
+            return await response.json()
+
+    async def verificar_chats(self):
+        chats_com_mensagens = 0
+        async with self.sessao.get(f'{self.base_url}/chats') as response:
+            if response.status != 200:
+                return chats_com_mensagens
+            corpo = await response.read()
+        recebido_em = time.monotonic()
+        tamanho_chats.observar(len(corpo))
+        chats = json.loads(corpo)
+
+        for chat in chats:
+            if chat.get('isGroup', False):
+                continue
+            if chat.get('unreadCount', 0) > 0 and chat.get('lastMessage'):
+                chat_id = chat['id']['_serialized']
+                novas, ids = self.mensagens_novas(await self.mensagens_nao_lidas(chat))
+                if not novas:
+                    # Já respondidas, mas o chat continua como não lido
+                    await self.marcar_como_lida(chat_id)
+                    continue
+                chats_com_mensagens += 1
+                self.agendar(chat_id, chat.get('name', 'Usuário Desconhecido'), novas, recebido_em, ids)
+        return chats_com_mensagens
+
+    async def consultar_chats(self):
+        while bot_manager.is_bot_running:
+            try:
+                inicio = time.monotonic()
+                chats_com_mensagens = await self.verificar_chats()
+                espera = self.agenda.apos_consulta(chats_com_mensagens, time.monotonic() - inicio)
+
+            except ERROS_CONEXAO as e:
+                logging.error(f"Erro de conexão com o servidor WhatsApp: {e}")
+                espera = self.agenda.apos_erro()
+
+            except Exception as e:
+                logging.error(f"Erro ao processar mensagens: {e}")
+                espera = 2
+
+            await asyncio.sleep(espera)
+
+    async def consumir_eventos(self):
+        try:
+            await self.verificar_chats()
+        except ERROS_CONEXAO as e:
+            logging.error(f"Erro de conexão com o servidor WhatsApp: {e}")
+        except Exception as e:
+            logging.error(f"Erro ao processar mensagens: {e}")
+
+        # A fila é alimentada pelas threads do Flask; a espera fica numa
+        # thread auxiliar para não travar o loop
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='bot-eventos') as leitor:
+            await self.ler_eventos(leitor)
+
+    async def ler_eventos(self, leitor):
+        while bot_manager.is_bot_running:
+            try:
+                futuro = leitor.submit(fila_mensagens.get, timeout=1)
+                try:
+                    eventos = [await asyncio.wrap_future(futuro)]
+                except queue.Empty:
+                    continue
+                except asyncio.CancelledError:
+                    # A thread pode terminar de tirar um evento da fila depois
+                    # do cancelamento: ele volta para a fila em vez de se perder
+                    futuro.add_done_callback(devolver_evento)
+                    raise
+
+                while len(eventos) < config.BOT_FILA_MENSAGENS:
+                    try:
+                        eventos.append(fila_mensagens.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for chat_id, (sender_name, textos, recebido_em, ids) in eventos_por_chat(eventos).items():
+                    self.agendar(chat_id, sender_name, textos, recebido_em, ids)
+
+            except Exception as e:
+                logging.error(f"Erro ao processar mensagens: {e}")
+                await asyncio.sleep(2)
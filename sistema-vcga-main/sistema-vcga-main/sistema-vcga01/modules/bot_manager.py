@@ -1,15 +1,22 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, render_template
 import threading
+import queue
 import time
 import requests
 import logging
-import json
-import os
-import csv
 from datetime import datetime
-import schedule
 import re
 import config
+from modules.base_index import indice_bases
+from modules.registro_mensagens import registro_mensagens
+from modules.pool_chats import PoolChats
+from modules.bridge_client import bridge
+from modules.despachante import despachante
+from modules.agenda_polling import AgendaPolling
+from modules.contadores import contadores
+from modules.agendador import agendador
+from modules.metricas import tamanho_chats, duracao_busca
+from modules.rastreamento import rastreador, trecho
 
 bot_bp = Blueprint('bot', __name__)
 
@@ -17,6 +24,16 @@ bot_bp = Blueprint('bot', __name__)
 bot_thread = None
 is_bot_running = False
 
+# Bot em execução e, no motor 'threads', as threads que respondem os chats
+bot_ativo = None
+pool_chats = None
+
+# Mensagens recebidas por /bot/ingest aguardando o bot (modo 'eventos')
+fila_mensagens = queue.Queue(maxsize=config.BOT_FILA_MENSAGENS)
+
+# Entre as respostas de várias mensagens do mesmo chat, enviadas juntas
+SEPARADOR_RESPOSTAS = "\n━━━━━━━━━━━━━━━━━━━━\n"
+
 def clean_text_for_log(text):
     """Remove emojis e caracteres especiais para logging seguro"""
     if not text:
@@ -27,20 +44,49 @@ def clean_text_for_log(text):
 
 def get_bot_status():
     """Retorna o status do bot"""
-    return {
+    status = {
         'running': is_bot_running,
-        'last_activity': datetime.now().isoformat() if is_bot_running else None
+        'last_activity': datetime.now().isoformat() if is_bot_running else None,
+        'ingestao': config.BOT_INGESTAO,
+        'fila_mensagens': fila_mensagens.qsize(),
+        'mensagens_registradas': len(registro_mensagens),
+        'envios': despachante.status(),
+        'agendador': agendador.status()
+    }
+    if bot_ativo:
+        status.update(bot_ativo.status_motor())
+        if config.BOT_INGESTAO != 'eventos':
+            status['polling'] = bot_ativo.agenda.status()
+    return status
+
+def eventos_por_chat(eventos):
+    """Agrupa por chat os eventos ainda não processados:
+    {chat_id: (nome, textos, recebimento do primeiro, ids)}"""
+    chats = {}
+    for evento in eventos:
+        if registro_mensagens.primeira_vez(evento.get('id')):
+            chats.setdefault(evento['chatId'], []).append(evento)
+    return {
+        chat_id: (
+            mensagens[-1].get('name') or 'Usuário Desconhecido',
+            [evento.get('body') or '' for evento in mensagens],
+            mensagens[0].get('recebido_em'),
+            [evento.get('id') for evento in mensagens]
+        )
+        for chat_id, mensagens in chats.items()
     }
 
 class ChatBot:
-    base_url = 'http://localhost:3000'
+    base_url = config.BRIDGE_URL
+    motor = 'threads'
     
-    def __init__(self, arquivo_contadores="contadores.json"):
+    def __init__(self):
         logging.info("Inicializando ChatBot VCGA-LeituraAE")
         
         self.digitdocliente = ["ola", "olá", "bom dia", "oi", "boa tarde", "boa noite", "foto", "foto da fachada", "fachada", "faxada", "pode me ajudar", "ajuda", "imagem"]
-        self.arquivo_contadores = arquivo_contadores
-        self.carregar_contadores()
+        # Intervalo das varreduras no modo 'polling'; `parado` interrompe a espera
+        self.agenda = AgendaPolling()
+        self.parado = threading.Event()
         
         # Carregar links do config
         self.msg_links = [
@@ -53,110 +99,23 @@ class ChatBot:
             config.msg_link_enviar_7
         ]
         
-    def carregar_contadores(self):
-        if os.path.exists(self.arquivo_contadores):
-            with open(self.arquivo_contadores, 'r', encoding='utf-8') as file:
-                try:
-                    dados = json.load(file)
-                    self.total_respostas_parecer = dados.get("total_respostas_parecer", 0)
-                    self.total_hd_encontrado = dados.get("total_hd_encontrado", 0)
-                    self.total_matriculas_encontradas = dados.get("total_matriculas_encontradas", 0)
-                    self.total_hd_nao_encontrado = dados.get("total_hd_nao_encontrado", 0)
-                    self.total_mensagens_invalidas = dados.get("total_mensagens_invalidas", 0)
-                    self.total_respostas_link = dados.get("total_respostas_link", 0) 
-                    self.total_matriculas_nao_encontrada = dados.get("total_matriculas_nao_encontrada", 0)
-                    self.total_mesagens_respondidas = dados.get("total_mesagens_respondidas", 0)
-                    self.ultima_data = dados.get("ultima_data", None)
-
-                    if self.ultima_data:
-                        self.ultima_data = datetime.strptime(self.ultima_data, "%Y-%m-%d")
-
-                    self.verificar_novo_dia()
-
-                except json.JSONDecodeError:
-                    logging.error("Erro ao ler o arquivo de contadores. Inicializando os contadores como 0.")
-                    self.inicializar_contadores()
-        else:
-            logging.info("Arquivo de contadores não encontrado. Inicializando os contadores como 0.")
-            self.inicializar_contadores()
-
-    def inicializar_contadores(self):
-        self.total_hd_encontrado = 0
-        self.total_matriculas_encontradas = 0
-        self.total_hd_nao_encontrado = 0
-        self.total_mensagens_invalidas = 0
-        self.total_respostas_link = 0
-        self.total_matriculas_nao_encontrada = 0
-        self.total_mesagens_respondidas = 0
-        self.ultima_data = datetime.now().date()
-
-    def verificar_novo_dia(self):
-        data_atual = datetime.now().date()
-        if self.ultima_data is None:
-            logging.info("Última data não definida, resetando contadores.")
-            self.inicializar_contadores()
-        elif self.ultima_data.date() < data_atual:
-            logging.info("Novo dia detectado, resetando contadores.")
-            self.inicializar_contadores()
-
-    def salvar_contadores(self):
-        dados = {
-            "total_hd_encontrado": self.total_hd_encontrado,
-            "total_matriculas_encontradas": self.total_matriculas_encontradas,
-            "total_hd_nao_encontrado": self.total_hd_nao_encontrado,
-            "total_mensagens_invalidas": self.total_mensagens_invalidas,
-            "total_respostas_link": self.total_respostas_link,
-            "total_matriculas_nao_encontrada": self.total_matriculas_nao_encontrada,
-            "total_mesagens_respondidas": self.total_mesagens_respondidas,
-            "ultima_data": str(datetime.now().date())
-        }
-        with open(self.arquivo_contadores, 'w', encoding='utf-8') as file:
-            json.dump(dados, file, indent=4, ensure_ascii=False)
-
+        # Montar o índice das bases antes da primeira mensagem
+        self.load_json_data_01_MATRICULA()
+        
     def load_json_data_01_MATRICULA(self):
         try:
-            dados = {}
-            arquivos_csv = [
-                'dados_matriculas/base_vcga.csv',
-                'dados_matriculas/base_vcga2.csv',
-                'dados_matriculas/base_vcga3.csv',
-                'dados_matriculas/base_vcga4.csv',
-                'dados_matriculas/base_vcga5.csv',
-                'dados_matriculas/base_vcga6.csv',
-                'dados_matriculas/base_vcga7.csv',
-                'dados_matriculas/base_vcga8.csv',
-                'dados_matriculas/base_vcga9.csv',
-                'dados_matriculas/base_vcga10.csv',
-            ]
-
-            for arquivo in arquivos_csv:
-                if not os.path.exists(arquivo):
-                    continue
-
-                with open(arquivo, encoding='utf-8') as file:
-                    reader = csv.reader(file)
-                    for linha in reader:
-                        if len(linha) != 2:
-                            continue
-
-                        chave, json_str = linha
-                        try:
-                            dados[chave] = json.loads(json_str)
-                        except json.JSONDecodeError as e:
-                            logging.error(f"Erro ao decodificar JSON para chave {chave} no arquivo {arquivo}")
-
-            return dados
+            return indice_bases.snapshot_atual()
 
         except Exception as exc:
             logging.error('Erro inesperado ao carregar os arquivos CSV', exc_info=exc)
             return None
 
-    def montar_url_google_maps_da_01(self, matricula, source=None):
+    def montar_url_google_maps_da_01(self, matricula, source=None, info=None, snapshot=None):
         try:
-            data = self.load_json_data_01_MATRICULA()
+            if info is None:
+                info = (snapshot or indice_bases.snapshot_atual()).obter(matricula)
 
-            if data and matricula in data:
-                info = data[matricula]
+            if info is not None:
                 latitude = info.get('Latitude') or info.get('latitude')
                 longitude = info.get('Longitude') or info.get('longitude')
 
@@ -188,7 +147,8 @@ class ChatBot:
             logging.error(f"Erro ao montar URL do Google Maps: {e}")
             return None
 
-    def verificar_matricula(self, matricula_recebida, chat_id, sender_name):
+    def resposta_matricula(self, matricula_recebida, sender_name, info):
+        """Monta a resposta para uma matrícula já buscada nas bases (info ou None)"""
         try:
             sender_clean = clean_text_for_log(sender_name)
             logging.info(f"Verificando matrícula: {matricula_recebida} para {sender_clean}")
@@ -202,10 +162,7 @@ class ChatBot:
             else:
                 saudacao = f"🅱🅾🅰 ​ 🅽🅾🅸🆃🅴! 🌜"
             
-            bases_vcga_matriculas = self.load_json_data_01_MATRICULA()
-          
-            if bases_vcga_matriculas and matricula_recebida in bases_vcga_matriculas:
-                info = bases_vcga_matriculas[matricula_recebida]
+            if info is not None:
                 
                 # Dados básicos da resposta
                 data_formatada = datetime.now().strftime("%Y-%m-%d")
@@ -230,17 +187,16 @@ class ChatBot:
 📆𝘿𝙖𝙩𝙖 𝙙𝙖 𝙍𝙚𝙨𝙥𝙤𝙨𝙩𝙖: {data_formatada}"""
                 
                 # Tentar obter URL do Google Maps
-                url_maps = self.montar_url_google_maps_da_01(matricula_recebida, "BASE_VCGA_MATRICULAS")
+                with trecho('mapa'):
+                    url_maps = self.montar_url_google_maps_da_01(matricula_recebida, "BASE_VCGA_MATRICULAS", info)
                 if url_maps:
                     message += f"\n📍𝙇𝙞𝙣𝙠 𝙥𝙖𝙧𝙖 𝙤 𝙂𝙤𝙤𝙜𝙡𝙚 𝙈𝙖𝙥𝙨: {url_maps}"
-                    self.total_respostas_link += 1
+                    contadores.incrementar("total_respostas_link")
                 else:
                     message += f"\n⚠️ 𝘾𝙤𝙤𝙧𝙙𝙚𝙣𝙖𝙙𝙖𝙨 𝙣𝙖̃𝙤 𝙙𝙞𝙨𝙥𝙤𝙣𝙞́𝙫𝙚𝙞𝙨 𝙥𝙖𝙧𝙖 𝙚𝙨𝙩𝙖 𝙢𝙖𝙩𝙧𝙞́𝙘𝙪𝙡𝙖"
                 
-                self.responder_mensagem(chat_id, message)
-                self.total_matriculas_encontradas += 1
-                self.salvar_contadores()
-                return True
+                contadores.incrementar("total_matriculas_encontradas")
+                return message
             else:
                 alerta_nao_encontrado = f"""
 🥳𝙎𝙚𝙟𝙖𝙢 𝙗𝙚𝙢 𝙫𝙞𝙣𝙙𝙤𝙨 𝙖𝙤 🤖𝙑𝘾𝙂𝘼-𝙇𝙚𝙞𝙩𝙪𝙧𝙖𝘼𝙀
@@ -251,16 +207,15 @@ class ChatBot:
 ➡️ 𝘼 𝙢𝙖𝙩𝙧𝙞́𝙘𝙪𝙡𝙖: ⚠️{matricula_recebida}
 𝙉𝙤 𝙢𝙤𝙢𝙚𝙣𝙩𝙤 𝙣𝙖̃𝙤 𝙨𝙚 𝙚𝙣𝙘𝙤𝙣𝙩𝙧𝙖 𝙣𝙤 𝙗𝙖𝙣𝙘𝙤 𝙙𝙚 𝙙𝙖𝙙𝙤𝙨
                 """
-                self.responder_mensagem(chat_id, alerta_nao_encontrado)
-                self.total_matriculas_nao_encontrada += 1
-                self.salvar_contadores()
-                return True
+                contadores.incrementar("total_matriculas_nao_encontrada")
+                return alerta_nao_encontrado
                 
         except Exception as e:
             logging.error(f"Erro ao verificar matrícula: {e}")
-            return False
+            return None
 
-    def verificar_hd(self, matricula_hd, chat_id, sender_name):
+    def resposta_hd(self, matricula_hd, sender_name, info):
+        """Monta a resposta para um HD já buscado nas bases (info ou None)"""
         try:
             sender_clean = clean_text_for_log(sender_name)
             logging.info(f"Verificando HD: {matricula_hd} para {sender_clean}")
@@ -274,10 +229,7 @@ class ChatBot:
             else:
                 saudacao = f"🅱🅾🅰 ​ 🅽🅾🅸🆃🅴! 🌜"
             
-            bases_vcga_hd = self.load_json_data_01_MATRICULA()
-
-            if bases_vcga_hd and matricula_hd in bases_vcga_hd:
-                info = bases_vcga_hd[matricula_hd]
+            if info is not None:
                 
                 # Dados básicos da resposta
                 data_formatada = datetime.now().strftime("%Y-%m-%d")
@@ -303,17 +255,16 @@ class ChatBot:
 📆𝘿𝙖𝙩𝙖 𝙙𝙖 𝙍𝙚𝙨𝙥𝙤𝙨𝙩𝙖: {data_formatada}"""
                 
                 # Tentar obter URL do Google Maps
-                url_maps = self.montar_url_google_maps_da_01(matricula_hd, "BASE_VCGA_HD")
+                with trecho('mapa'):
+                    url_maps = self.montar_url_google_maps_da_01(matricula_hd, "BASE_VCGA_HD", info)
                 if url_maps:
                     message += f"\n📍𝙇𝙞𝙣𝙠 𝙥𝙖𝙧𝙖 𝙤 𝙂𝙤𝙤𝙜𝙡𝙚 𝙈𝙖𝙥𝙨: {url_maps}"
-                    self.total_respostas_link += 1
+                    contadores.incrementar("total_respostas_link")
                 else:
                     message += f"\n⚠️ 𝘾𝙤𝙤𝙧𝙙𝙚𝙣𝙖𝙙𝙖𝙨 𝙣𝙖̃𝙤 𝙙𝙞𝙨𝙥𝙤𝙣𝙞́𝙫𝙚𝙞𝙨 𝙥𝙖𝙧𝙖 𝙚𝙨𝙩𝙚 𝙃𝘿"
                 
-                self.responder_mensagem(chat_id, message)
-                self.total_hd_encontrado += 1
-                self.salvar_contadores()
-                return True
+                contadores.incrementar("total_hd_encontrado")
+                return message
             else:
                 alerta_nao_encontrado = f"""
 🥳𝙎𝙚𝙟𝙖𝙢 𝙗𝙚𝙢 𝙫𝙞𝙣𝙙𝙤𝙨 𝙖𝙤 🤖𝙑𝘾𝙂𝘼-𝙇𝙚𝙞𝙩𝙪𝙧𝙖𝘼𝙀
@@ -324,49 +275,24 @@ class ChatBot:
 ➡️ 𝙊 𝙃𝘿: ⚠️{matricula_hd}
 𝙉𝙤 𝙢𝙤𝙢𝙚𝙣𝙩𝙤 𝙣𝙖̃𝙤 𝙨𝙚 𝙚𝙣𝙘𝙤𝙣𝙩𝙧𝙖 𝙣𝙤 𝙗𝙖𝙣𝙘𝙤 𝙙𝙚 𝙙𝙖𝙙𝙤𝙨
                 """
-                self.responder_mensagem(chat_id, alerta_nao_encontrado)
-                self.total_hd_nao_encontrado += 1
-                self.salvar_contadores()
-                return True
+                contadores.incrementar("total_hd_nao_encontrado")
+                return alerta_nao_encontrado
                 
         except Exception as e:
             logging.error(f"Erro ao verificar HD: {e}")
-            return False
+            return None
 
-    def responder_mensagem(self, chat_id, mensagem):
-        max_retries = 3
-        retry_delay = 5
-        attempt = 0
+    def responder_mensagem(self, chat_id, mensagem, recebido_em=None):
+        """Enfileira a resposta no despachante, que cuida do ritmo e das novas tentativas.
 
-        while attempt < max_retries:
-            try:
-                url = f'{self.base_url}/send-message'
-                payload = {
-                    'number': chat_id.split('@')[0] if '@' in chat_id else chat_id,
-                    'message': mensagem
-                }
-                response = requests.post(url, json=payload)
-
-                if response.status_code == 200:
-                    logging.info(f"Mensagem enviada para {chat_id}")
-                    self.total_mesagens_respondidas += 1
-                    self.salvar_contadores()
-                    return True
-                elif response.status_code == 500:
-                    logging.warning(f"Erro 500 ao enviar mensagem para {chat_id} - Tentativa {attempt + 1} de {max_retries}")
-                    attempt += 1
-                    time.sleep(retry_delay)
-                    return
-                else:
-                    logging.error(f"Erro ao enviar mensagem para {chat_id}: {response.status_code}")
-                    return False
+        `recebido_em` (time.monotonic()) é quando a mensagem chegou, para a
+        latência até a entrega.
+        """
+        despachante.enviar(chat_id, mensagem, ao_enviar=self.mensagem_enviada, recebido_em=recebido_em)
+        return True
 
-            except Exception as e:
-                logging.error(f"Exceção ao enviar mensagem: {e}")
-                attempt += 1
-                time.sleep(retry_delay)
-                
-        return False
+    def mensagem_enviada(self):
+        contadores.incrementar("total_mesagens_respondidas")
 
     def as_msg_enviadas(self, respost_chat, mensagem_texto, sender_name):
         if respost_chat == "explicaar_sistema":
@@ -447,87 +373,287 @@ Desenvolvido por Alisson Cardozo Varela
 
         return "Mensagem não reconhecida"
 
+    def chave_da_mensagem(self, mensagem_texto):
+        """Matrícula ou HD que a mensagem pede, ou None"""
+        if mensagem_texto.isdigit() and len(mensagem_texto) == 9:
+            return mensagem_texto
+        if mensagem_texto.startswith("/"):
+            return mensagem_texto[1:].upper()
+        return None
+
+    def resposta_mensagem(self, mensagem_texto, sender_name, dados):
+        """Monta a resposta de uma mensagem; `dados` traz o resultado da busca
+        de cada matrícula/HD pedida"""
+        sender_clean = clean_text_for_log(sender_name)
+        
+        # Verificar se é matrícula (9 dígitos)
+        if mensagem_texto.isdigit() and len(mensagem_texto) == 9:
+            logging.info(f"Verificando matrícula: {mensagem_texto}")
+            return self.resposta_matricula(mensagem_texto, sender_name, dados.get(mensagem_texto))
+        
+        elif mensagem_texto.upper().startswith("LINK"):
+            contadores.incrementar("total_respostas_link")
+            return self.as_msg_enviadas("mensagem_link", mensagem_texto, sender_name)
+            
+        # Verificar se é HD (começa com /)
+        elif mensagem_texto.startswith("/"):
+            HD_EM_BUSCAR = mensagem_texto[1:].upper()
+            logging.info(f"Verificando HD: {HD_EM_BUSCAR}")
+            return self.resposta_hd(HD_EM_BUSCAR, sender_name, dados.get(HD_EM_BUSCAR))
+        
+        # Verificar saudações
+        elif any(mensagem_texto.lower().startswith(prefix.lower()) for prefix in self.digitdocliente):
+            logging.info(f"Enviando explicação do sistema para: {sender_clean}")
+            contadores.incrementar("total_mensagens_invalidas")
+            return self.as_msg_enviadas("explicaar_sistema", mensagem_texto, sender_name)
+        
+        # Mensagem não reconhecida
+        else:
+            logging.info(f"Mensagem não reconhecida de: {sender_clean}")
+            contadores.incrementar("total_mensagens_invalidas")
+            return self.as_msg_enviadas("mensagem_erradas", mensagem_texto, sender_name)
+
+    def chaves_das_mensagens(self, sender_name, mensagens):
+        """Matrículas/HDs pedidas nas mensagens, para uma única busca nas bases"""
+        # Log com texto limpo
+        sender_clean = clean_text_for_log(sender_name)
+        for mensagem_texto in mensagens:
+            logging.info(f"Processando mensagem de {sender_clean}: {clean_text_for_log(mensagem_texto)}")
+        
+        return [chave for chave in map(self.chave_da_mensagem, mensagens) if chave]
+
+    def tipo_da_busca(self, mensagens):
+        """'matricula', 'hd' ou 'misto', para as métricas das buscas"""
+        tipos = {'hd' if mensagem.startswith("/") else 'matricula' for mensagem in mensagens if self.chave_da_mensagem(mensagem)}
+        return tipos.pop() if len(tipos) == 1 else 'misto'
+
+    def resposta_conjunta(self, sender_name, mensagens, dados):
+        """Junta as respostas das mensagens num só texto, ou None"""
+        respostas = [self.resposta_mensagem(mensagem_texto, sender_name, dados) for mensagem_texto in mensagens]
+        respostas = [resposta for resposta in respostas if resposta]
+        return SEPARADOR_RESPOSTAS.join(respostas) if respostas else None
+
+    def tratar_mensagens(self, chat_id, sender_name, mensagens, recebido_em=None, ids=()):
+        """Responde às mensagens de um chat individual com uma única resposta.
+
+        Todas as matrículas/HDs pedidas são buscadas de uma vez, na mesma
+        geração das bases, e as respostas vão juntas num só send-message.
+        `ids` são as mensagens reservadas no registro: confirmadas quando a
+        resposta está no despachante, liberadas se algo falhar antes.
+        """
+        mensagens = [mensagem.strip() for mensagem in mensagens]
+        if not mensagens:
+            return
+        
+        rastro, token = rastreador.iniciar(chat_id, len(mensagens), recebido_em)
+        try:
+            with trecho('classificar'):
+                chaves = self.chaves_das_mensagens(sender_name, mensagens)
+            dados = {}
+            if chaves:
+                with trecho('buscar'):
+                    inicio = time.perf_counter()
+                    dados = indice_bases.snapshot_atual().obter_varios(chaves)
+                    duracao_busca.observar(time.perf_counter() - inicio, tipo=self.tipo_da_busca(mensagens))
+            
+            with trecho('montar'):
+                resposta = self.resposta_conjunta(sender_name, mensagens, dados)
+            if resposta:
+                # O despachante conclui o rastro depois do envio
+                self.responder_mensagem(chat_id, resposta, recebido_em)
+            elif rastro:
+                rastreador.concluir(rastro)
+        except Exception as e:
+            registro_mensagens.esquecer(ids)
+            if rastro:
+                rastreador.concluir(rastro, str(e))
+            raise
+        else:
+            registro_mensagens.confirmar(ids)
+        finally:
+            rastreador.soltar(token)
+
+    def enviar_para_pool(self, chat_id, sender_name, mensagens, recebido_em=None, ids=()):
+        """Passa as mensagens do chat para a thread que atende esse chat"""
+        if pool_chats is None:
+            self.tratar_mensagens(chat_id, sender_name, mensagens, recebido_em, ids)
+        else:
+            pool_chats.enviar(chat_id, self.tratar_mensagens, chat_id, sender_name, mensagens, recebido_em, ids)
+
+    def tratar_mensagem(self, chat_id, sender_name, mensagem_texto):
+        """Responde a uma única mensagem recebida de um chat individual"""
+        self.tratar_mensagens(chat_id, sender_name, [mensagem_texto])
+
+    def verificar_matricula(self, matricula_recebida, chat_id, sender_name, snapshot=None):
+        return self.verificar_chave(matricula_recebida, chat_id, sender_name, 'matricula', self.resposta_matricula, snapshot)
+
+    def verificar_hd(self, matricula_hd, chat_id, sender_name, snapshot=None):
+        return self.verificar_chave(matricula_hd, chat_id, sender_name, 'hd', self.resposta_hd, snapshot)
+
+    def verificar_chave(self, chave, chat_id, sender_name, tipo, montar_resposta, snapshot=None):
+        """Busca uma matrícula/HD e responde; False se não há resposta"""
+        rastro, token = rastreador.iniciar(chat_id)
+        try:
+            snapshot = snapshot or indice_bases.snapshot_atual()
+            with trecho('buscar'):
+                inicio = time.perf_counter()
+                dados = snapshot.obter(chave)
+                duracao_busca.observar(time.perf_counter() - inicio, tipo=tipo)
+            with trecho('montar'):
+                resposta = montar_resposta(chave, sender_name, dados)
+            if resposta is None:
+                if rastro:
+                    rastreador.concluir(rastro)
+                return False
+            self.responder_mensagem(chat_id, resposta)
+            return True
+        finally:
+            rastreador.soltar(token)
+
+    def marcar_como_lida(self, chat_id):
+        """Marca o chat como visto no WhatsApp, para ele sair da lista de não lidos"""
+        try:
+            bridge.post('/mark-seen', json={'chatId': chat_id})
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Erro ao marcar chat {chat_id} como lido: {e}")
+
+    def mensagens_nao_lidas(self, chat):
+        """Mensagens não lidas do chat (id e texto), numa única chamada ao servidor"""
+        unread_count = chat.get('unreadCount', 0)
+        last_message = chat.get('lastMessage') or {}
+        if unread_count <= 1:
+            return [last_message] if last_message else []
+
+        response = bridge.get(
+            '/unread-messages',
+            params={'chatId': chat['id']['_serialized'], 'limit': unread_count}
+        )
+        if response.status_code != 200:
+            logging.warning(f"Não foi possível buscar as mensagens não lidas: {response.status_code}")
+            return [last_message] if last_message else []
+        return response.json()
+
+    def mensagens_novas(self, mensagens):
+        """Textos e ids das mensagens que o bot ainda não processou"""
+        novas, ids = [], []
+        for mensagem in mensagens:
+            id_mensagem = mensagem.get('id')
+            if isinstance(id_mensagem, dict):
+                id_mensagem = id_mensagem.get('_serialized')
+            if registro_mensagens.primeira_vez(id_mensagem):
+                novas.append(mensagem.get('body', ''))
+                ids.append(id_mensagem)
+        return novas, ids
+
+    def verificar_chats(self):
+        """Varre GET /chats e responde às mensagens não lidas de cada chat;
+        devolve quantos chats tinham mensagens novas"""
+        response = bridge.get('/chats')
+        chats_com_mensagens = 0
+        
+        if response.status_code == 200:
+            recebido_em = time.monotonic()
+            tamanho_chats.observar(len(response.content))
+            chats = response.json()
+            
+            for chat in chats:
+                is_group = chat.get('isGroup', False)
+                if is_group:
+                    continue
+                    
+                unread_count = chat.get('unreadCount', 0)
+                last_message = chat.get('lastMessage', {})
+                
+                if unread_count > 0 and last_message:
+                    novas, ids = self.mensagens_novas(self.mensagens_nao_lidas(chat))
+                    if not novas:
+                        # Já respondidas, mas o chat continua como não lido
+                        self.marcar_como_lida(chat['id']['_serialized'])
+                        continue
+                    chats_com_mensagens += 1
+                    self.enviar_para_pool(
+                        chat['id']['_serialized'],
+                        chat.get('name', 'Usuário Desconhecido'),
+                        novas,
+                        recebido_em,
+                        ids
+                    )
+        
+        return chats_com_mensagens
+
     def processar_mensagens(self):
-        global is_bot_running
+        if config.BOT_INGESTAO == 'eventos':
+            self.consumir_eventos()
+        else:
+            self.consultar_chats()
 
+    def consultar_chats(self):
+        """Modo 'polling': consulta os chats no intervalo dado por self.agenda"""
         while is_bot_running:
             try:
-                schedule.run_pending()
+                inicio = time.monotonic()
+                chats_com_mensagens = self.verificar_chats()
+                espera = self.agenda.apos_consulta(chats_com_mensagens, time.monotonic() - inicio)
                 
-                response = requests.get(f'{self.base_url}/chats', timeout=10)
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Erro de conexão com o servidor WhatsApp: {e}")
+                espera = self.agenda.apos_erro()
                 
-                if response.status_code == 200:
-                    chats = response.json()
-                    
-                    for chat in chats:
-                        is_group = chat.get('isGroup', False)
-                        if is_group:
-                            continue
-                            
-                        unread_count = chat.get('unreadCount', 0)
-                        last_message = chat.get('lastMessage', {})
-                        
-                        if unread_count > 0 and last_message:
-                            mensagem_texto = last_message.get('body', '').strip()
-                            sender_name = chat.get('name', 'Usuário Desconhecido')
-                            chat_id = chat['id']['_serialized']
-                            
-                            # Log com texto limpo
-                            sender_clean = clean_text_for_log(sender_name)
-                            message_clean = clean_text_for_log(mensagem_texto)
-                            logging.info(f"Processando mensagem de {sender_clean}: {message_clean}")
-                            
-                            # Verificar se é matrícula (9 dígitos)
-                            if mensagem_texto.isdigit() and len(mensagem_texto) == 9:
-                                logging.info(f"Verificando matrícula: {mensagem_texto}")
-                                self.verificar_matricula(mensagem_texto, chat_id, sender_name)
-                            
-                            elif mensagem_texto.upper().startswith("LINK"):
-                                resposta = self.as_msg_enviadas("mensagem_link", mensagem_texto, sender_name)
-                                self.responder_mensagem(chat_id, resposta)
-                                self.total_respostas_link += 1
-                                self.salvar_contadores()
-                                
-                            # Verificar se é HD (começa com /)
-                            elif mensagem_texto.startswith("/"):
-                                HD_EM_BUSCAR = mensagem_texto[1:].upper()
-                                logging.info(f"Verificando HD: {HD_EM_BUSCAR}")
-                                self.verificar_hd(HD_EM_BUSCAR, chat_id, sender_name)
-                            
-                            # Verificar saudações
-                            elif any(mensagem_texto.lower().startswith(prefix.lower()) for prefix in self.digitdocliente):
-                                logging.info(f"Enviando explicação do sistema para: {sender_clean}")
-                                resposta = self.as_msg_enviadas("explicaar_sistema", mensagem_texto, sender_name)
-                                self.responder_mensagem(chat_id, resposta)
-                                self.total_mensagens_invalidas += 1
-                                self.salvar_contadores()
-                            
-                            # Mensagem não reconhecida
-                            else:
-                                logging.info(f"Mensagem não reconhecida de: {sender_clean}")
-                                resposta = self.as_msg_enviadas("mensagem_erradas", mensagem_texto, sender_name)
-                                self.responder_mensagem(chat_id, resposta)
-                                self.total_mensagens_invalidas += 1
-                                self.salvar_contadores()
+            except Exception as e:
+                logging.error(f"Erro ao processar mensagens: {e}")
+                espera = 2
             
-                time.sleep(1)
+            self.parado.wait(espera)
+
+    def consumir_eventos(self):
+        """Modo 'eventos': responde às mensagens que o servidor WhatsApp envia
+        para /bot/ingest, assim que chegam"""
+        # Mensagens que chegaram com o bot parado continuam não lidas no
+        # WhatsApp; uma varredura inicial responde a elas
+        try:
+            self.verificar_chats()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Erro de conexão com o servidor WhatsApp: {e}")
+        except Exception as e:
+            logging.error(f"Erro ao processar mensagens: {e}")
+
+        while is_bot_running:
+            try:
+                try:
+                    # Acorda a cada segundo só para ver se o bot foi parado
+                    eventos = [fila_mensagens.get(timeout=1)]
+                except queue.Empty:
+                    continue
                 
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Erro de conexão com o servidor WhatsApp: {e}")
-                time.sleep(5)
+                # Mensagens que chegaram juntas são respondidas juntas, por chat
+                while len(eventos) < config.BOT_FILA_MENSAGENS:
+                    try:
+                        eventos.append(fila_mensagens.get_nowait())
+                    except queue.Empty:
+                        break
+                
+                for chat_id, (sender_name, textos, recebido_em, ids) in eventos_por_chat(eventos).items():
+                    self.enviar_para_pool(chat_id, sender_name, textos, recebido_em, ids)
                 
             except Exception as e:
                 logging.error(f"Erro ao processar mensagens: {e}")
                 time.sleep(2)
 
+    def status_motor(self):
+        return {
+            'motor': self.motor,
+            'workers': pool_chats.status() if pool_chats else None
+        }
+
     def finalizar(self):
         global is_bot_running
         logging.info("Finalizando o bot")
         is_bot_running = False
+        self.parado.set()
 
 @bot_bp.route('/start', methods=['POST'])
 def start_bot():
-    global bot_thread, is_bot_running
+    global bot_thread, is_bot_running, bot_ativo, pool_chats
     
     # Verificar se o servidor WhatsApp está rodando
     from modules.whatsapp_manager import is_server_running
@@ -536,12 +662,41 @@ def start_bot():
         return jsonify({'success': False, 'message': 'Servidor WhatsApp não está rodando'})
     
     if not is_bot_running:
+        dados = request.get_json(silent=True) or request.form
+        motor = dados.get('motor') or config.BOT_MOTOR
+        if motor not in ('threads', 'asyncio'):
+            return jsonify({'success': False, 'message': f'Motor desconhecido: {motor}'})
+        
+        # Threads da execução anterior ainda respondendo: um pool novo
+        # atenderia os mesmos chats em paralelo com elas
+        if pool_chats is not None:
+            if not pool_chats.parar():
+                return jsonify({
+                    'success': False,
+                    'message': 'O bot ainda está respondendo mensagens da execução anterior; tente novamente em instantes'
+                })
+            pool_chats = None
+        
         try:
-            response = requests.get('http://localhost:3000/status')
+            response = bridge.get('/status')
             if response.status_code != 200:
                 return jsonify({'success': False, 'message': 'WhatsApp não está conectado'})
             
-            bot = ChatBot()
+            if motor == 'asyncio':
+                try:
+                    from modules.bot_async import ChatBotAsync
+                except ImportError:
+                    return jsonify({'success': False, 'message': 'O motor asyncio precisa do pacote aiohttp'})
+                bot = ChatBotAsync()
+            else:
+                bot = ChatBot()
+                pool_chats = PoolChats(config.BOT_WORKERS, config.BOT_FILA_WORKER)
+            
+            # Eventos que ficaram na fila da execução anterior são
+            # respondidos agora; o registro ignora os que a varredura
+            # inicial também encontrar
+            despachante.retomar()
+            bot_ativo = bot
             is_bot_running = True
             bot_thread = threading.Thread(target=bot.processar_mensagens)
             bot_thread.daemon = True
@@ -557,12 +712,23 @@ def start_bot():
 
 @bot_bp.route('/stop', methods=['POST'])
 def stop_bot():
-    global is_bot_running
+    global is_bot_running, bot_ativo, pool_chats
     
     if is_bot_running:
+        if bot_ativo:
+            bot_ativo.finalizar()
         is_bot_running = False
         if bot_thread:
             bot_thread.join(timeout=5)
+        # Responde ao que já foi recebido antes de encerrar as threads
+        # Se alguma thread não terminou, o pool fica para o /start esperar por ele
+        if pool_chats:
+            if pool_chats.parar():
+                pool_chats = None
+            else:
+                logging.warning("Threads do bot ainda respondendo depois de parar")
+        bot_ativo = None
+        contadores.salvar()
         return jsonify({'success': True})
     
     return jsonify({'success': True, 'message': 'Bot não está rodando'})
@@ -570,3 +736,54 @@ def stop_bot():
 @bot_bp.route('/status')
 def status():
     return jsonify(get_bot_status())
+
+@bot_bp.route('/ingest', methods=['POST'])
+def ingest():
+    """Recebe do servidor WhatsApp cada mensagem nova (modo 'eventos')"""
+    # Só o servidor Node, que roda na mesma máquina, envia mensagens
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'success': False, 'message': 'Origem não permitida'})
+    
+    if not is_bot_running:
+        return jsonify({'success': False, 'message': 'Bot não está rodando'})
+    
+    evento = request.get_json(silent=True) or {}
+    if not evento.get('chatId'):
+        return jsonify({'success': False, 'message': 'Mensagem inválida'})
+    evento['recebido_em'] = time.monotonic()
+    
+    try:
+        fila_mensagens.put_nowait(evento)
+    except queue.Full:
+        logging.warning("Fila de mensagens do bot cheia; mensagem descartada")
+        return jsonify({'success': False, 'message': 'Fila de mensagens cheia'})
+    
+    return jsonify({'success': True})
+
+# Ordem das etapas na página de rastros
+ETAPAS_RASTRO = ['espera', 'classificar', 'buscar', 'mapa', 'montar', 'fila_envio', 'enviar', 'total']
+
+@bot_bp.route('/traces')
+def traces():
+    """Rastros mais lentos e percentis por etapa das respostas amostradas"""
+    percentis = rastreador.percentis()
+    etapas = [(etapa, percentis[etapa]) for etapa in ETAPAS_RASTRO if etapa in percentis]
+    return render_template('traces.html', etapas=etapas, rastros=rastreador.mais_lentos(), status=rastreador.status())
+
+@bot_bp.route('/traces/dados')
+def traces_dados():
+    return jsonify({
+        'status': rastreador.status(),
+        'percentis': rastreador.percentis(),
+        'mais_lentos': rastreador.mais_lentos()
+    })
+
+@bot_bp.route('/envios-falhos')
+def envios_falhos():
+    """Respostas que o despachante não conseguiu entregar"""
+    return jsonify({'success': True, 'envios': despachante.falhas_definitivas()})
+
+@bot_bp.route('/envios-falhos/reenviar', methods=['POST'])
+def reenviar_envios_falhos():
+    total = despachante.reenviar_falhas()
+    return jsonify({'success': True, 'message': f'{total} mensagem(ns) de volta à fila'})
@@ -0,0 +1,151 @@
+import threading
+import logging
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import config
+
+class CircuitoAberto(requests.exceptions.ConnectionError):
+    """Chamada recusada sem ir à rede: o servidor WhatsApp está fora do ar"""
+
+class ClienteBridge:
+    """Cliente HTTP único do servidor WhatsApp (Node, porta 3000).
+
+    Uma Session com conexões keep-alive, compartilhada pelas threads; cada
+    endpoint tem o seu timeout (config.BRIDGE_TIMEOUTS). As chamadas com
+    mais de uma tentativa esperam entre elas um backoff exponencial com
+    jitter. Depois de config.BRIDGE_FALHAS_CIRCUITO falhas de conexão
+    seguidas o circuito abre: por config.BRIDGE_CIRCUITO_ABERTO segundos as
+    chamadas falham na hora com CircuitoAberto; depois disso uma chamada de
+    teste passa, e o circuito fecha se ela der certo.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=config.BRIDGE_CONEXOES)
+        self.sessao.mount('http://', adaptador)
+        self.lock = threading.Lock()
+        self.falhas_seguidas = 0
+        self.aberto_ate = None
+        self.testando = False
+        self.recusadas = 0
+        self.endpoints = {}
+
+    def get(self, caminho, **kwargs):
+        return self.requisitar('GET', caminho, **kwargs)
+
+    def post(self, caminho, **kwargs):
+        return self.requisitar('POST', caminho, **kwargs)
+
+    def requisitar(self, metodo, caminho, tentativas=1, repetir_status=(500, 502, 503, 504), **kwargs):
+        """Faz a chamada, repetindo falhas de conexão e os status em
+        `repetir_status` até `tentativas` vezes. Devolve a última resposta ou
+        levanta a última exceção (requests.exceptions.RequestException)."""
+        kwargs.setdefault('timeout', (
+            config.BRIDGE_TIMEOUT_CONEXAO,
+            config.BRIDGE_TIMEOUTS.get(caminho, config.BRIDGE_TIMEOUT_PADRAO)
+        ))
+
+        for tentativa in range(tentativas):
+            if tentativa:
+                time.sleep(self.backoff(tentativa))
+            self.liberar(caminho)
+
+            inicio = time.monotonic()
+            try:
+                response = self.sessao.request(metodo, self.base_url + caminho, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.registrar(caminho, time.monotonic() - inicio, erro=True)
+                self.falhou()
+                if tentativa + 1 == tentativas:
+                    raise
+                logging.warning(f"Falha ao chamar {caminho} - Tentativa {tentativa + 1} de {tentativas}: {e}")
+                continue
+
+            self.registrar(caminho, time.monotonic() - inicio, erro=response.status_code >= 500)
+            self.funcionou()
+            if response.status_code not in repetir_status or tentativa + 1 == tentativas:
+                return response
+            logging.warning(f"Erro {response.status_code} em {caminho} - Tentativa {tentativa + 1} de {tentativas}")
+
+    def backoff(self, tentativa):
+        """Espera antes da tentativa seguinte: metade fixa, metade aleatória"""
+        teto = min(config.BRIDGE_BACKOFF_MAXIMO, config.BRIDGE_BACKOFF_BASE * 2 ** (tentativa - 1))
+        return teto / 2 + random.uniform(0, teto / 2)
+
+    def liberar(self, caminho):
+        """Levanta CircuitoAberto se a chamada não deve ir ao servidor"""
+        with self.lock:
+            if self.aberto_ate is None:
+                return
+            if time.monotonic() < self.aberto_ate or self.testando:
+                self.recusadas += 1
+                raise CircuitoAberto(f"Servidor WhatsApp indisponível; chamada a {caminho} recusada")
+            # Tempo esgotado: esta chamada testa o servidor
+            self.testando = True
+
+    def falhou(self):
+        with self.lock:
+            self.falhas_seguidas += 1
+            if self.testando or self.falhas_seguidas >= config.BRIDGE_FALHAS_CIRCUITO:
+                if self.aberto_ate is None or self.testando:
+                    logging.error(f"Servidor WhatsApp sem resposta; circuito aberto por {config.BRIDGE_CIRCUITO_ABERTO}s")
+                self.aberto_ate = time.monotonic() + config.BRIDGE_CIRCUITO_ABERTO
+                self.testando = False
+
+    def funcionou(self):
+        with self.lock:
+            if self.aberto_ate is not None:
+                logging.info("Servidor WhatsApp respondeu; circuito fechado")
+            self.falhas_seguidas = 0
+            self.aberto_ate = None
+            self.testando = False
+
+    def reiniciar(self):
+        """Fecha o circuito, p.ex. quando o servidor acabou de ser iniciado"""
+        self.funcionou()
+
+    def pausa(self):
+        """Segundos até o servidor poder ser chamado de novo (ao menos 1)"""
+        with self.lock:
+            if self.aberto_ate is None:
+                return 1
+            return max(1, self.aberto_ate - time.monotonic())
+
+    def registrar(self, caminho, duracao, erro):
+        with self.lock:
+            dados = self.endpoints.setdefault(caminho, {
+                'chamadas': 0, 'erros': 0, 'latencia_total': 0.0, 'latencia_maxima': 0.0
+            })
+            dados['chamadas'] += 1
+            dados['erros'] += erro
+            dados['latencia_total'] += duracao
+            dados['latencia_maxima'] = max(dados['latencia_maxima'], duracao)
+
+    def status(self):
+        with self.lock:
+            if self.aberto_ate is None:
+                circuito = 'fechado'
+            elif self.testando or time.monotonic() >= self.aberto_ate:
+                circuito = 'testando'
+            else:
+                circuito = 'aberto'
+            return {
+                'circuito': circuito,
+                'falhas_seguidas': self.falhas_seguidas,
+                'recusadas': self.recusadas,
+                'endpoints': {
+                    caminho: {
+                        'chamadas': dados['chamadas'],
+                        'erros': dados['erros'],
+                        'latencia_media_ms': round(1000 * dados['latencia_total'] / dados['chamadas'], 1),
+                        'latencia_maxima_ms': round(1000 * dados['latencia_maxima'], 1)
+                    }
+                    for caminho, dados in self.endpoints.items()
+                }
+            }
+
+# Cliente único do processo
+bridge = ClienteBridge(config.BRIDGE_URL)
@@ -0,0 +1,216 @@
+import threading
+import hashlib
+import logging
+import shutil
+import json
+import csv
+import os
+from datetime import datetime
+import config
+from modules.base_index import indice_bases, caminho_base, PASTA_BASES
+from modules.base_binaria import CAMPOS, caminho_binario, caminho_alteracoes, compilar_csv, ler_ligacoes_csv
+from modules.base_sqlite import base_sqlite
+
+PASTA_CACHE = os.path.join(PASTA_BASES, 'cache')
+CAMINHO_MANIFESTO = os.path.join(PASTA_BASES, 'manifesto.json')
+
+# Nome do CSV dentro de cada entrada do cache (o .bin fica ao lado)
+ARQUIVO_CACHE = 'base.csv'
+
+def salvar_upload(arquivo, caminho, tamanho_bloco=1024 * 1024):
+    """Grava o arquivo enviado em blocos, calculando o sha256 no caminho.
+
+    Retorna o hash em hexadecimal.
+    """
+    sha = hashlib.sha256()
+    with open(caminho, 'wb') as destino:
+        while True:
+            bloco = arquivo.stream.read(tamanho_bloco)
+            if not bloco:
+                break
+            sha.update(bloco)
+            destino.write(bloco)
+    return sha.hexdigest()
+
+def chave_conversao(hash_arquivo, versao):
+    """Identifica o resultado de converter um arquivo com uma versão do conversor"""
+    return f"{hash_arquivo}-v{versao}"
+
+def copiar_base(origem_csv, destino_csv):
+    """Copia o CSV, o .bin e as alterações do modo delta de uma base,
+    trocando os destinos de uma vez.
+
+    copy2 preserva o mtime do CSV, que o .bin guarda como origem; sem .bin
+    na origem ele é compilado no destino.
+    """
+    arquivos = (
+        (caminho_binario(origem_csv), caminho_binario(destino_csv)),
+        (caminho_alteracoes(origem_csv), caminho_alteracoes(destino_csv)),
+        (origem_csv, destino_csv),
+    )
+    for origem, destino in arquivos:
+        if not os.path.exists(origem):
+            # Alterações de outra versão da base não valem para esta
+            if os.path.exists(destino) and destino == caminho_alteracoes(destino_csv):
+                os.remove(destino)
+            continue
+        temp = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copy2(origem, temp)
+        os.replace(temp, destino)
+
+    if not os.path.exists(caminho_binario(destino_csv)):
+        compilar_csv(destino_csv)
+
+class CacheConversoes:
+    """Cache das bases já convertidas, endereçado pelo conteúdo da planilha.
+
+    O manifesto registra, para cada base, qual arquivo (sha256 + versão do
+    conversor) gerou o conteúdo atual e como reconhecer que ele não mudou
+    desde então (mtime/tamanho do CSV, ou a geração no SQLite). A pasta do
+    cache guarda as últimas `limite` conversões; reenviar uma planilha já
+    convertida restaura a base dali sem converter de novo.
+    """
+
+    def __init__(self, pasta=PASTA_CACHE, manifesto=CAMINHO_MANIFESTO, limite=5):
+        self.pasta = pasta
+        self.manifesto = manifesto
+        self.limite = limite
+        self.lock = threading.Lock()
+
+    def ler_manifesto(self):
+        try:
+            with open(self.manifesto, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def gravar_manifesto(self, dados):
+        temp = self.manifesto + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, indent=2)
+        os.replace(temp, self.manifesto)
+
+    def marca_base(self, numero):
+        """O que identifica o conteúdo atual da base, ou None se ela não existe"""
+        if config.BASE_STORAGE == 'sqlite':
+            status = base_sqlite.status().get(numero)
+            return ['sqlite', status[2]] if status else None
+
+        try:
+            info = os.stat(caminho_base(numero))
+        except OSError:
+            return None
+        return ['arquivo', info.st_mtime_ns, info.st_size]
+
+    def base_atual(self, numero):
+        """Retorna a entrada do manifesto se a base ainda é a que ele registrou"""
+        entrada = self.ler_manifesto().get(str(numero))
+        if entrada and entrada['marca'] == self.marca_base(numero):
+            return entrada
+        return None
+
+    def pasta_entrada(self, chave):
+        return os.path.join(self.pasta, chave)
+
+    def registrar(self, numero, chave, registros):
+        """Anota no manifesto que a base veio de `chave` e guarda o resultado no cache"""
+        pasta = self.pasta_entrada(chave)
+        try:
+            if not os.path.exists(pasta):
+                self.guardar(numero, pasta)
+            # mtime da pasta marca o último uso, para descartar as mais antigas
+            os.utime(pasta)
+        except Exception as e:
+            logging.error(f"Erro ao guardar a base {numero} no cache: {e}")
+
+        with self.lock:
+            dados = self.ler_manifesto()
+            dados[str(numero)] = {
+                'chave': chave,
+                'registros': registros,
+                'marca': self.marca_base(numero),
+                'registrado_em': datetime.now().isoformat()
+            }
+            self.gravar_manifesto(dados)
+        self.limpar()
+
+    def guardar(self, numero, pasta):
+        temp = f"{pasta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(temp, exist_ok=True)
+        destino = os.path.join(temp, ARQUIVO_CACHE)
+
+        if config.BASE_STORAGE == 'sqlite':
+            with open(destino, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(CAMPOS)
+                writer.writerows(base_sqlite.ligacoes(numero))
+            compilar_csv(destino)
+        else:
+            copiar_base(caminho_base(numero), destino)
+
+        try:
+            os.replace(temp, pasta)
+        except OSError:
+            # Outra thread guardou a mesma conversão primeiro
+            shutil.rmtree(temp, ignore_errors=True)
+
+    def preparar(self, chave, caminho_csv):
+        """Copia uma conversão do cache para `caminho_csv`; False se não houver"""
+        origem = os.path.join(self.pasta_entrada(chave), ARQUIVO_CACHE)
+        if not os.path.exists(origem):
+            return False
+        copiar_base(origem, caminho_csv)
+        os.utime(self.pasta_entrada(chave))
+        return True
+
+    def restaurar(self, numero, chave):
+        """Coloca na base uma conversão guardada; retorna a entrada do manifesto ou None"""
+        origem = os.path.join(self.pasta_entrada(chave), ARQUIVO_CACHE)
+        if not os.path.exists(origem):
+            return None
+
+        if config.BASE_STORAGE == 'sqlite':
+            registros = base_sqlite.substituir_base(numero, ler_ligacoes_csv(origem))
+            indice_bases.recarregar()
+        else:
+            with indice_bases.publicando():
+                copiar_base(origem, caminho_base(numero))
+            with open(origem, 'r', encoding='utf-8') as f:
+                # Desconta o cabeçalho
+                registros = sum(1 for line in f) - 1
+
+        logging.info(f"Base {numero} restaurada do cache ({chave})")
+        self.registrar(numero, chave, registros)
+        return self.base_atual(numero)
+
+    def esquecer(self, numero):
+        """Remove a base do manifesto (a conversão continua no cache)"""
+        with self.lock:
+            dados = self.ler_manifesto()
+            if dados.pop(str(numero), None) is not None:
+                self.gravar_manifesto(dados)
+
+    def limpar(self):
+        """Mantém só as `limite` conversões usadas mais recentemente"""
+        try:
+            nomes = os.listdir(self.pasta)
+        except OSError:
+            return
+
+        entradas = []
+        for nome in nomes:
+            caminho = os.path.join(self.pasta, nome)
+            if nome.endswith('.tmp'):
+                continue
+            try:
+                entradas.append((os.path.getmtime(caminho), caminho))
+            except OSError:
+                continue
+
+        entradas.sort(reverse=True)
+        for _, pasta in entradas[self.limite:]:
+            shutil.rmtree(pasta, ignore_errors=True)
+            logging.info(f"Conversão removida do cache: {os.path.basename(pasta)}")
+
+# Cache único do processo
+cache_conversoes = CacheConversoes(limite=config.CACHE_CONVERSOES)
@@ -0,0 +1,140 @@
+from datetime import datetime
+import threading
+import logging
+import atexit
+import sqlite3
+import json
+import os
+import config
+from modules.historico_contadores import historico_contadores
+
+CAMPOS = [
+    "total_hd_encontrado",
+    "total_matriculas_encontradas",
+    "total_hd_nao_encontrado",
+    "total_mensagens_invalidas",
+    "total_respostas_link",
+    "total_matriculas_nao_encontrada",
+    "total_mesagens_respondidas"
+]
+
+class Contadores:
+    """Contadores do dia do bot, na memória e gravados em contadores.json.
+
+    `incrementar` só soma sob o lock; o agendador (modules/manutencao.py)
+    chama `salvar` a cada config.CONTADORES_INTERVALO segundos, ou antes,
+    via `ao_acumular`, quando passam config.CONTADORES_EVENTOS incrementos,
+    e `virar_dia` à meia-noite. O arquivo também é gravado na saída do
+    processo. A gravação vai para um arquivo temporário que substitui o
+    anterior com os.replace, então o arquivo nunca fica pela metade.
+
+    Os incrementos também são somados por minuto e, a cada gravação, vão
+    para o histórico (modules/historico_contadores.py), que não é zerado.
+    """
+
+    def __init__(self, caminho, historico=None):
+        self.caminho = caminho
+        self.historico = historico
+        self.por_minuto = {}
+        self.ao_acumular = None
+        self.lock = threading.Lock()
+        self.lock_arquivo = threading.Lock()
+        self.valores = dict.fromkeys(CAMPOS, 0)
+        self.data = datetime.now().date()
+        self.eventos = 0
+        self.carregar()
+
+    def carregar(self):
+        try:
+            with open(self.caminho, 'r', encoding='utf-8') as file:
+                dados = json.load(file)
+        except FileNotFoundError:
+            logging.info("Arquivo de contadores não encontrado. Inicializando os contadores como 0.")
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Erro ao ler o arquivo de contadores: {e}. Inicializando os contadores como 0.")
+            return
+
+        ultima_data = dados.get("ultima_data")
+        if ultima_data and datetime.strptime(ultima_data, "%Y-%m-%d").date() == self.data:
+            self.valores.update({campo: dados.get(campo, 0) for campo in CAMPOS})
+        else:
+            logging.info("Novo dia detectado, resetando contadores.")
+
+    def verificar_novo_dia(self, hoje):
+        # Chamado com self.lock adquirido
+        if hoje == self.data:
+            return False
+        logging.info("Novo dia detectado, resetando contadores.")
+        self.valores = dict.fromkeys(CAMPOS, 0)
+        self.data = hoje
+        return True
+
+    def incrementar(self, campo, quantidade=1):
+        with self.lock:
+            agora = datetime.now()
+            self.verificar_novo_dia(agora.date())
+            self.valores[campo] += quantidade
+            chave = (agora.strftime('%Y-%m-%d %H:%M'), campo)
+            self.por_minuto[chave] = self.por_minuto.get(chave, 0) + quantidade
+            self.eventos += 1
+            antecipar = self.eventos == config.CONTADORES_EVENTOS
+        if antecipar and self.ao_acumular:
+            self.ao_acumular()
+
+    def virar_dia(self):
+        """Grava o dia que terminou e zera os contadores, mesmo sem mensagens novas"""
+        self.salvar()
+        with self.lock:
+            if not self.verificar_novo_dia(datetime.now().date()):
+                return
+            self.eventos += 1
+        self.salvar()
+
+    def dados(self):
+        """Os contadores no formato de contadores.json"""
+        with self.lock:
+            dados = dict(self.valores)
+            dados["ultima_data"] = str(self.data)
+            return dados
+
+    def salvar(self):
+        """Grava o arquivo se houve incrementos desde a última gravação"""
+        with self.lock:
+            if not self.eventos:
+                return
+            self.eventos = 0
+            por_minuto, self.por_minuto = self.por_minuto, {}
+
+        temp = self.caminho + '.tmp'
+        with self.lock_arquivo:
+            # A cópia é feita aqui dentro para uma cópia mais velha nunca
+            # substituir uma mais nova
+            dados = self.dados()
+            try:
+                with open(temp, 'w', encoding='utf-8') as file:
+                    json.dump(dados, file, indent=4, ensure_ascii=False)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp, self.caminho)
+            except OSError as e:
+                logging.error(f"Erro ao gravar o arquivo de contadores: {e}")
+
+            if self.historico:
+                self.gravar_historico(por_minuto)
+
+    def gravar_historico(self, por_minuto):
+        # Chamado com self.lock_arquivo adquirido
+        try:
+            self.historico.registrar(por_minuto)
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao gravar o histórico de contadores: {e}")
+            # Voltam para a próxima gravação
+            with self.lock:
+                for chave, quantidade in por_minuto.items():
+                    self.por_minuto[chave] = self.por_minuto.get(chave, 0) + quantidade
+                self.eventos += 1
+
+# Contadores únicos do processo; gravados também na saída
+contadores = Contadores(config.CONTADORES_ARQUIVO, historico_contadores)
+atexit.register(contadores.salvar)
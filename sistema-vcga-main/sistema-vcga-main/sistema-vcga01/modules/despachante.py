@@ -0,0 +1,294 @@
+from collections import deque
+from datetime import datetime
+import itertools
+import threading
+import logging
+import random
+import heapq
+import time
+import requests
+import config
+from modules.bridge_client import bridge, CircuitoAberto
+from modules.outbox import OutboxEnvios
+from modules.metricas import metricas, envios, latencia_mensagem
+from modules.rastreamento import rastreador, rastro_atual
+
+# Menor valor sai primeiro; na mesma prioridade, na ordem de chegada
+PRIORIDADE_ALTA = 0
+PRIORIDADE_NORMAL = 1
+PRIORIDADE_BAIXA = 2
+
+class BaldeTokens:
+    """Limita os envios a `taxa` por segundo, com rajadas de até `capacidade`"""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.atualizado = time.monotonic()
+
+    def repor(self):
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    def espera(self):
+        """Segundos até haver um token (0 se já há)"""
+        self.repor()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.taxa
+
+    def consumir(self):
+        self.repor()
+        self.tokens -= 1
+
+class Envio:
+    def __init__(self, chat_id, mensagem, prioridade, sequencia, ao_enviar, id_outbox=None, recebido_em=None):
+        self.chat_id = chat_id
+        self.mensagem = mensagem
+        self.prioridade = prioridade
+        self.sequencia = sequencia
+        self.ao_enviar = ao_enviar
+        self.id_outbox = id_outbox
+        # time.monotonic() da chegada da mensagem respondida, se conhecido
+        self.recebido_em = recebido_em
+        self.rastro = None
+        self.tentativas = 0
+        self.ultimo_erro = None
+        self.criado_em = time.monotonic()
+        self.data = datetime.now()
+
+    def resumo(self):
+        return {
+            'chat_id': self.chat_id,
+            'mensagem': self.mensagem,
+            'tentativas': self.tentativas,
+            'erro': self.ultimo_erro,
+            'data': self.data.isoformat()
+        }
+
+class DespachanteEnvios:
+    """Fila única dos send-message ao servidor WhatsApp.
+
+    Quem responde só enfileira e segue; uma thread entrega na ordem de
+    prioridade, no ritmo do balde de tokens (config.ENVIO_TAXA por segundo,
+    rajadas de config.ENVIO_RAJADA). Erros 5xx e de conexão voltam para a
+    fila depois de um backoff exponencial com jitter; erros 4xx, ou
+    config.ENVIO_TENTATIVAS falhas, levam o envio para a lista de falhas
+    definitivas, de onde ele pode ser reenviado. Um timeout esperando a
+    resposta também é definitivo: o servidor pode já ter enviado a
+    mensagem, e repetir a mandaria duas vezes.
+
+    Enquanto um envio espera nova tentativa, as respostas seguintes do mesmo
+    chat ficam retidas, para o chat recebê-las na ordem; elas voltam à fila
+    quando esse envio sai ou falha de vez.
+
+    Com um outbox, cada resposta é gravada em disco antes de sair e
+    confirmada depois da entrega; `retomar` volta à fila, na ordem, as que
+    ficaram pendentes quando o processo parou. A lista de falhas definitivas
+    fica só na memória.
+    """
+
+    def __init__(self, outbox=None):
+        self.outbox = outbox
+        self.retomado = False
+        self.condicao = threading.Condition()
+        self.prontos = []
+        self.adiados = []
+        # Por chat: o envio aguardando nova tentativa e os que vêm depois dele
+        self.retentando = {}
+        self.retidos = {}
+        self.sequencia = itertools.count()
+        self.balde = BaldeTokens(config.ENVIO_TAXA, config.ENVIO_RAJADA)
+        self.mortos = deque(maxlen=config.ENVIO_FALHAS_LIMITE)
+        self.enviados = 0
+        self.falhas = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.thread = None
+
+    def enviar(self, chat_id, mensagem, prioridade=PRIORIDADE_NORMAL, ao_enviar=None, recebido_em=None):
+        """Enfileira a mensagem; `ao_enviar()` é chamado depois da entrega"""
+        self.retomar()
+        id_outbox = self.outbox.registrar(chat_id, mensagem, prioridade) if self.outbox else None
+        return self.enfileirar(chat_id, mensagem, prioridade, ao_enviar, id_outbox, recebido_em, rastro_atual.get())
+
+    def retomar(self):
+        """Enfileira as respostas pendentes no outbox (só na primeira chamada)"""
+        with self.condicao:
+            if self.retomado or self.outbox is None:
+                return
+            self.retomado = True
+            # Ainda com a condição adquirida: as pendentes entram na fila
+            # antes de qualquer resposta nova
+            for registro in self.outbox.carregar():
+                self.enfileirar(registro['chat_id'], registro['mensagem'], registro['prioridade'], None, registro['id'])
+
+    def enfileirar(self, chat_id, mensagem, prioridade, ao_enviar, id_outbox, recebido_em=None, rastro=None):
+        with self.condicao:
+            envio = Envio(chat_id, mensagem, prioridade, next(self.sequencia), ao_enviar, id_outbox, recebido_em)
+            envio.rastro = rastro
+            heapq.heappush(self.prontos, (prioridade, envio.sequencia, envio))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.executar, name='despachante-envios', daemon=True)
+                self.thread.start()
+            self.condicao.notify()
+        return envio
+
+    def proximo(self):
+        """Espera haver um envio pronto e um token no balde"""
+        with self.condicao:
+            while True:
+                agora = time.monotonic()
+                while self.adiados and self.adiados[0][0] <= agora:
+                    _, sequencia, envio = heapq.heappop(self.adiados)
+                    heapq.heappush(self.prontos, (envio.prioridade, sequencia, envio))
+
+                # Respostas de um chat com envio aguardando nova tentativa
+                while self.prontos and self.retido(self.prontos[0][2]):
+                    envio = heapq.heappop(self.prontos)[2]
+                    self.retidos.setdefault(envio.chat_id, []).append(envio)
+
+                espera = None
+                if self.prontos:
+                    espera = self.balde.espera()
+                    if espera == 0:
+                        self.balde.consumir()
+                        return heapq.heappop(self.prontos)[2]
+                if self.adiados:
+                    ate_adiado = self.adiados[0][0] - agora
+                    espera = ate_adiado if espera is None else min(espera, ate_adiado)
+                self.condicao.wait(espera)
+
+    def retido(self, envio):
+        # Chamado com self.condicao adquirida
+        retentando = self.retentando.get(envio.chat_id)
+        return retentando is not None and retentando is not envio
+
+    def liberar_chat(self, envio):
+        """Devolve à fila as respostas retidas atrás do envio, que saiu ou falhou de vez"""
+        # Chamado com self.condicao adquirida
+        if self.retentando.get(envio.chat_id) is not envio:
+            return
+        del self.retentando[envio.chat_id]
+        for retido in self.retidos.pop(envio.chat_id, []):
+            heapq.heappush(self.prontos, (retido.prioridade, retido.sequencia, retido))
+        self.condicao.notify()
+
+    def executar(self):
+        while True:
+            envio = self.proximo()
+            try:
+                self.entregar(envio)
+            except Exception as e:
+                logging.error(f"Erro no despachante de envios: {e}")
+
+    def entregar(self, envio):
+        payload = {
+            'number': envio.chat_id.split('@')[0] if '@' in envio.chat_id else envio.chat_id,
+            'message': envio.mensagem
+        }
+        if envio.id_outbox and not self.outbox.aguardar(envio.id_outbox):
+            # Segurar a resposta até o disco voltar pararia o bot
+            logging.warning(f"Outbox fora do disco ({self.outbox.erro or 'fsync demorado'}) - enviando para {envio.chat_id} sem ele")
+        envio.tentativas += 1
+        pausa = 0
+        inicio = time.monotonic()
+        try:
+            response = bridge.post('/send-message', json=payload)
+            erro = None if response.status_code == 200 else f"HTTP {response.status_code}"
+            definitivo = response.status_code < 500
+        except CircuitoAberto as e:
+            erro, definitivo, pausa = str(e), False, bridge.pausa()
+        except requests.exceptions.ReadTimeout as e:
+            # A mensagem pode ter saído; não repete para não duplicar
+            erro, definitivo = f"Sem resposta do servidor, a mensagem pode ter sido enviada: {e}", True
+        except requests.exceptions.RequestException as e:
+            erro, definitivo = str(e), False
+
+        if envio.rastro and (erro is None or definitivo or envio.tentativas >= config.ENVIO_TENTATIVAS):
+            # Na fila do despachante (ritmo e tentativas anteriores) e a última chamada
+            envio.rastro.adicionar('fila_envio', inicio - envio.criado_em)
+            envio.rastro.adicionar('enviar', time.monotonic() - inicio)
+            rastreador.concluir(envio.rastro, erro)
+
+        if erro is None:
+            logging.info(f"Mensagem enviada para {envio.chat_id}")
+            envios.incrementar(resultado='enviado')
+            if envio.recebido_em is not None:
+                latencia_mensagem.observar(time.monotonic() - envio.recebido_em)
+            espera = time.monotonic() - envio.criado_em
+            with self.condicao:
+                self.enviados += 1
+                self.espera_total += espera
+                self.espera_maxima = max(self.espera_maxima, espera)
+                self.liberar_chat(envio)
+            if envio.id_outbox:
+                self.outbox.confirmar(envio.id_outbox)
+            if envio.ao_enviar:
+                envio.ao_enviar()
+            return
+
+        envio.ultimo_erro = erro
+        with self.condicao:
+            self.falhas += 1
+            if definitivo or envio.tentativas >= config.ENVIO_TENTATIVAS:
+                logging.error(f"Mensagem para {envio.chat_id} não enviada após {envio.tentativas} tentativa(s): {erro}")
+                envios.incrementar(resultado='falha_definitiva')
+                self.mortos.append(envio)
+                if envio.id_outbox:
+                    self.outbox.descartar(envio.id_outbox)
+                self.liberar_chat(envio)
+                return
+
+            envios.incrementar(resultado='nova_tentativa')
+            atraso = max(self.backoff(envio.tentativas), pausa)
+            logging.warning(f"Erro ao enviar mensagem para {envio.chat_id} ({erro}) - nova tentativa em {atraso:.1f}s")
+            heapq.heappush(self.adiados, (time.monotonic() + atraso, envio.sequencia, envio))
+            self.retentando[envio.chat_id] = envio
+            self.condicao.notify()
+
+    def backoff(self, tentativa):
+        teto = min(config.ENVIO_BACKOFF_MAXIMO, config.ENVIO_BACKOFF_BASE * 2 ** (tentativa - 1))
+        return teto / 2 + random.uniform(0, teto / 2)
+
+    def falhas_definitivas(self):
+        with self.condicao:
+            return [envio.resumo() for envio in self.mortos]
+
+    def reenviar_falhas(self):
+        """Devolve à fila, com prioridade baixa, os envios que falharam"""
+        with self.condicao:
+            mortos = list(self.mortos)
+            self.mortos.clear()
+        for envio in mortos:
+            self.enviar(envio.chat_id, envio.mensagem, PRIORIDADE_BAIXA, envio.ao_enviar)
+        return len(mortos)
+
+    def status(self):
+        with self.condicao:
+            self.balde.repor()
+            return {
+                'fila': len(self.prontos),
+                'aguardando_nova_tentativa': len(self.adiados),
+                'retidos': sum(map(len, self.retidos.values())),
+                'enviados': self.enviados,
+                'falhas': self.falhas,
+                'falhas_definitivas': len(self.mortos),
+                'outbox_pendentes': self.outbox.pendentes() if self.outbox and self.retomado else None,
+                'outbox_erro': self.outbox.erro if self.outbox else None,
+                'tokens': round(self.balde.tokens, 2),
+                'espera_media_ms': round(1000 * self.espera_total / self.enviados, 1) if self.enviados else None,
+                'espera_maxima_ms': round(1000 * self.espera_maxima, 1)
+            }
+
+    def tamanho_fila(self):
+        with self.condicao:
+            return {
+                ('pronto',): len(self.prontos),
+                ('aguardando_nova_tentativa',): len(self.adiados),
+                ('retido',): sum(map(len, self.retidos.values()))
+            }
+
+# Despachante único do processo
+despachante = DespachanteEnvios(OutboxEnvios(config.ENVIO_OUTBOX))
+metricas.medidor('vcga_envios_fila', 'Envios aguardando o despachante', despachante.tamanho_fila, rotulos=('estado',))
@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+import time
+import uuid
+from datetime import datetime
+import config
+from modules.metricas import duracao_conversao
+
+# Conversões terminadas que continuam consultáveis pelo id
+TAREFAS_GUARDADAS = 50
+
+class TarefaConversao:
+    """Conversão enviada para a fila (uma planilha ou uma importação em lote)"""
+
+    def __init__(self, bases, conversor, executar):
+        self.id = uuid.uuid4().hex[:12]
+        self.bases = bases
+        self.conversor = conversor
+        self.executar = executar
+        self.estado = 'na_fila'
+        self.mensagem = None
+        self.resultado = None
+        self.criada_em = datetime.now()
+        self.iniciada_em = None
+        self.terminada_em = None
+        # time.monotonic() do início e do fim, para a velocidade
+        self.inicio = None
+        self.fim = None
+
+    @property
+    def terminada(self):
+        return self.estado in ('concluida', 'erro', 'cancelada')
+
+    def status(self):
+        conversor = self.conversor
+        status = {
+            'id': self.id,
+            'bases': self.bases,
+            'estado': self.estado,
+            'fase': conversor.fase,
+            'mensagem': self.mensagem,
+            'linhas_lidas': conversor.linhas_lidas,
+            'linhas_processadas': conversor.linhas_processadas,
+            'total_linhas': conversor.total_linhas,
+            'linhas_por_segundo': None,
+            'eta_segundos': None,
+            'criada_em': self.criada_em.strftime('%d/%m/%Y %H:%M:%S'),
+            'resultado': self.resultado
+        }
+
+        if self.inicio is not None:
+            decorrido = (self.fim if self.fim is not None else time.monotonic()) - self.inicio
+            status['duracao'] = round(decorrido, 1)
+            if decorrido > 0 and conversor.linhas_lidas:
+                velocidade = conversor.linhas_lidas / decorrido
+                status['linhas_por_segundo'] = round(velocidade)
+                if not self.terminada and conversor.total_linhas:
+                    restantes = max(conversor.total_linhas - conversor.linhas_lidas, 0)
+                    status['eta_segundos'] = round(restantes / velocidade)
+        return status
+
+class FilaConversoes:
+    """Fila de conversões executadas por um número fixo de threads.
+
+    Cada base só pode ter uma conversão em andamento; uma nova conversão que
+    envolva uma base ocupada é recusada até a anterior terminar.
+    """
+
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='conversao')
+        self.tarefas = {}
+        self.bases_ocupadas = {}
+        self.lock = threading.Lock()
+
+    def tarefa_da_base(self, numero_base):
+        """Retorna a conversão em andamento da base ou None"""
+        with self.lock:
+            id_tarefa = self.bases_ocupadas.get(numero_base)
+            return self.tarefas.get(id_tarefa)
+
+    def enviar(self, bases, conversor, executar):
+        """Coloca a conversão na fila; retorna None se alguma base está ocupada.
+
+        `bases` é a lista de números das bases que a conversão vai gravar.
+        `executar(conversor)` roda na thread da fila e retorna o resultado
+        (um dict) ou None em caso de falha.
+        """
+        with self.lock:
+            if any(numero in self.bases_ocupadas for numero in bases):
+                return None
+            tarefa = TarefaConversao(list(bases), conversor, executar)
+            self.tarefas[tarefa.id] = tarefa
+            for numero in bases:
+                self.bases_ocupadas[numero] = tarefa.id
+            self.limpar_antigas()
+
+        self.executor.submit(self.executar_tarefa, tarefa)
+        logging.info(f"Conversão {tarefa.id} das bases {tarefa.bases} na fila")
+        return tarefa
+
+    def reservar(self, bases):
+        """Ocupa as bases para um trabalho feito fora da fila (restaurar do
+        cache); retorna a reserva, a passar para `liberar`, ou None se
+        alguma base está ocupada"""
+        reserva = f'reserva-{uuid.uuid4().hex[:12]}'
+        with self.lock:
+            if any(numero in self.bases_ocupadas for numero in bases):
+                return None
+            for numero in bases:
+                self.bases_ocupadas[numero] = reserva
+        return reserva
+
+    def liberar(self, bases, reserva):
+        with self.lock:
+            for numero in bases:
+                if self.bases_ocupadas.get(numero) == reserva:
+                    del self.bases_ocupadas[numero]
+
+    def executar_tarefa(self, tarefa):
+        if tarefa.conversor.cancelado.is_set():
+            self.finalizar(tarefa, 'cancelada', 'Cancelada antes de começar')
+            return
+
+        tarefa.estado = 'executando'
+        tarefa.iniciada_em = datetime.now()
+        tarefa.inicio = time.monotonic()
+        try:
+            resultado = tarefa.executar(tarefa.conversor)
+        except Exception as e:
+            logging.error(f"Erro na conversão {tarefa.id}: {e}")
+            self.finalizar(tarefa, 'erro', f'Erro ao processar arquivo: {str(e)}')
+            return
+
+        # Um cancelamento que chega depois do fim não desfaz a conversão
+        if resultado is None and tarefa.conversor.cancelado.is_set():
+            self.finalizar(tarefa, 'cancelada', 'Conversão cancelada')
+        elif resultado is None:
+            self.finalizar(tarefa, 'erro', 'Erro ao converter planilha')
+        else:
+            tarefa.resultado = resultado
+            if len(tarefa.bases) == 1:
+                mensagem = f'Base {tarefa.bases[0]} convertida com sucesso!'
+            else:
+                mensagem = f"Bases {', '.join(map(str, tarefa.bases))} importadas com sucesso!"
+            self.finalizar(tarefa, 'concluida', mensagem)
+
+    def finalizar(self, tarefa, estado, mensagem):
+        tarefa.terminada_em = datetime.now()
+        tarefa.fim = time.monotonic()
+        if tarefa.inicio is not None:
+            duracao_conversao.observar(tarefa.fim - tarefa.inicio, estado=estado)
+        tarefa.mensagem = mensagem
+        tarefa.conversor.fase = estado
+        tarefa.estado = estado
+        with self.lock:
+            for numero in tarefa.bases:
+                if self.bases_ocupadas.get(numero) == tarefa.id:
+                    del self.bases_ocupadas[numero]
+        logging.info(f"Conversão {tarefa.id} das bases {tarefa.bases}: {estado}")
+
+    def obter(self, id_tarefa):
+        with self.lock:
+            return self.tarefas.get(id_tarefa)
+
+    def cancelar(self, id_tarefa):
+        """Pede o cancelamento; retorna False se a tarefa não existe ou já terminou"""
+        tarefa = self.obter(id_tarefa)
+        if tarefa is None or tarefa.terminada:
+            return False
+        tarefa.conversor.cancelar()
+        return True
+
+    def listar(self):
+        with self.lock:
+            tarefas = list(self.tarefas.values())
+        return [tarefa.status() for tarefa in tarefas]
+
+    def limpar_antigas(self):
+        # Chamado com self.lock adquirido
+        terminadas = [tarefa for tarefa in self.tarefas.values() if tarefa.terminada]
+        for tarefa in terminadas[:max(len(terminadas) - TAREFAS_GUARDADAS, 0)]:
+            del self.tarefas[tarefa.id]
+
+# Fila única do processo
+fila_conversoes = FilaConversoes(config.CONVERSAO_WORKERS)
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+import threading
+import sqlite3
+import logging
+import os
+import config
+
+# Tamanho da chave de cada granularidade: 'AAAA-MM-DD HH:MM', 'AAAA-MM-DD HH'
+# e 'AAAA-MM-DD', na hora local, para as faixas compararem como texto
+GRANULARIDADES = {
+    'minuto': ('minutos', 16),
+    'hora': ('horas', 13),
+    'dia': ('dias', 10)
+}
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS minutos (
+    periodo TEXT NOT NULL,
+    campo TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (periodo, campo)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS horas (
+    periodo TEXT NOT NULL,
+    campo TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (periodo, campo)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dias (
+    periodo TEXT NOT NULL,
+    campo TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (periodo, campo)
+) WITHOUT ROWID;
+"""
+
+SQL_SOMA = (
+    'INSERT INTO {tabela} (periodo, campo, total) VALUES (?, ?, ?) '
+    'ON CONFLICT (periodo, campo) DO UPDATE SET total = total + excluded.total'
+)
+
+def periodo(momento, granularidade):
+    """Chave do período que contém `momento` (datetime ou texto ISO)"""
+    if isinstance(momento, datetime):
+        momento = momento.strftime('%Y-%m-%d %H:%M')
+    return momento.replace('T', ' ')[:GRANULARIDADES[granularidade][1]]
+
+class HistoricoContadores:
+    """Histórico dos contadores do bot num banco SQLite.
+
+    Recebe, a cada gravação dos contadores, os incrementos por minuto e os
+    soma nas tabelas `minutos`, `horas` e `dias` na mesma transação; os
+    relatórios de períodos longos leem as tabelas agregadas, com poucas
+    linhas, em vez de somar minutos. `compactar` apaga os minutos com mais
+    de config.HISTORICO_MINUTOS_DIAS dias e as horas com mais de
+    config.HISTORICO_HORAS_DIAS dias; os dias ficam para sempre.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.local = threading.local()
+        self.lock_escrita = threading.Lock()
+
+    def conexao(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            dir_path = os.path.dirname(self.caminho)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+            conn = sqlite3.connect(self.caminho, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(ESQUEMA)
+            self.local.conn = conn
+        return conn
+
+    def registrar(self, incrementos):
+        """Soma {(minuto 'AAAA-MM-DD HH:MM', campo): quantidade} nas três tabelas"""
+        if not incrementos:
+            return
+        with self.lock_escrita:
+            conn = self.conexao()
+            with conn:
+                for granularidade, (tabela, _) in GRANULARIDADES.items():
+                    somas = {}
+                    for (minuto, campo), quantidade in incrementos.items():
+                        chave = (periodo(minuto, granularidade), campo)
+                        somas[chave] = somas.get(chave, 0) + quantidade
+                    conn.executemany(SQL_SOMA.format(tabela=tabela), ((p, c, q) for (p, c), q in somas.items()))
+
+    def compactar(self, agora=None):
+        """Apaga os minutos e as horas fora da retenção; retorna as linhas apagadas"""
+        agora = agora or datetime.now()
+        limite_minutos = periodo(agora - timedelta(days=config.HISTORICO_MINUTOS_DIAS), 'minuto')
+        limite_horas = periodo(agora - timedelta(days=config.HISTORICO_HORAS_DIAS), 'hora')
+        with self.lock_escrita:
+            conn = self.conexao()
+            with conn:
+                apagadas = conn.execute('DELETE FROM minutos WHERE periodo < ?', (limite_minutos,)).rowcount
+                apagadas += conn.execute('DELETE FROM horas WHERE periodo < ?', (limite_horas,)).rowcount
+        if apagadas:
+            logging.info(f"Histórico de contadores compactado: {apagadas} linhas apagadas")
+        return apagadas
+
+    def consultar(self, inicio, fim, granularidade='hora'):
+        """Totais por período entre `inicio` e `fim` (inclusive).
+
+        Retorna {periodo: {campo: total}} em ordem de período.
+        """
+        tabela, _ = GRANULARIDADES[granularidade]
+        cursor = self.conexao().execute(
+            f'SELECT periodo, campo, total FROM {tabela} WHERE periodo BETWEEN ? AND ? ORDER BY periodo',
+            (periodo(inicio, granularidade), periodo(fim, granularidade))
+        )
+        series = {}
+        for chave, campo, total in cursor:
+            series.setdefault(chave, {})[campo] = total
+        return series
+
+    def totais(self, inicio, fim, granularidade='hora'):
+        """Soma de cada campo entre `inicio` e `fim`, na granularidade indicada"""
+        tabela, _ = GRANULARIDADES[granularidade]
+        cursor = self.conexao().execute(
+            f'SELECT campo, SUM(total) FROM {tabela} WHERE periodo BETWEEN ? AND ? GROUP BY campo',
+            (periodo(inicio, granularidade), periodo(fim, granularidade))
+        )
+        return dict(cursor.fetchall())
+
+# Banco único compartilhado pelo processo (aberto só no primeiro uso)
+historico_contadores = HistoricoContadores(config.HISTORICO_ARQUIVO)
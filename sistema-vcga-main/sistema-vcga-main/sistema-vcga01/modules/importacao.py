@@ -0,0 +1,164 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import threading
+import logging
+import shutil
+import uuid
+import os
+import config
+from modules.base_index import indice_bases, caminho_base, PASTA_BASES
+from modules.base_binaria import caminho_binario, ler_ligacoes_csv
+from modules.base_sqlite import base_sqlite
+from modules.cache_conversao import cache_conversoes
+
+# Cada importação converte para cá antes de publicar as bases
+PASTA_PREPARACAO = os.path.join(PASTA_BASES, 'importacao')
+
+def converter_em_processo(caminho_planilha, caminho_csv):
+    """Converte uma planilha num processo da importação em lote.
+
+    Grava só o CSV e o .bin em `caminho_csv`; a publicação fica com o
+    processo principal. Retorna (sucesso, linhas processadas).
+    """
+    # Importado aqui: o processo novo carrega o módulo por conta própria
+    from modules.data_converter import ConversorDados
+
+    conversor = ConversorDados(caminho_planilha, caminho_csv)
+    sucesso = conversor.converter_para_csv()
+    return sucesso, conversor.linhas_processadas
+
+class ImportacaoLote:
+    """Importação de várias planilhas, uma por base, convertidas em paralelo.
+
+    A leitura e a conversão das planilhas usam CPU o tempo todo, então cada
+    uma roda num processo separado (ProcessPoolExecutor) em vez de threads
+    que o GIL serializaria. Cada processo grava numa pasta de preparação; só
+    quando todas terminam com sucesso as bases novas são publicadas juntas:
+    no modo arquivo dentro de `indice_bases.publicando()`, no modo SQLite
+    numa única transação. Se uma falhar, nenhuma base é trocada.
+
+    Planilhas que já estão no cache de conversões são copiadas de lá em vez
+    de convertidas. Tem os mesmos atributos de progresso do ConversorDados
+    para ser acompanhada pela fila de conversões.
+    """
+
+    def __init__(self, planilhas, chaves=None):
+        # {numero da base: caminho da planilha enviada}
+        self.planilhas = planilhas
+        # {numero da base: chave no cache de conversões}
+        self.chaves = chaves or {}
+        self.id = uuid.uuid4().hex[:12]
+        self.pasta = os.path.join(PASTA_PREPARACAO, self.id)
+        self.usar_sqlite = config.BASE_STORAGE == 'sqlite'
+
+        self.fase = 'na fila'
+        self.total_linhas = None
+        self.linhas_lidas = 0
+        self.linhas_processadas = 0
+        self.arquivos_concluidos = 0
+        self.cancelado = threading.Event()
+
+    def cancelar(self):
+        """Pede o cancelamento; nada é publicado depois disso"""
+        self.cancelado.set()
+
+    def caminho_preparacao(self, numero):
+        return os.path.join(self.pasta, os.path.basename(caminho_base(numero)))
+
+    def converter_todas(self):
+        """Converte as planilhas em paralelo; levanta exceção se alguma falhar"""
+        pendentes = {}
+        for numero, planilha in self.planilhas.items():
+            chave = self.chaves.get(numero)
+            if chave and cache_conversoes.preparar(chave, self.caminho_preparacao(numero)):
+                logging.info(f"Importação {self.id}: base {numero} copiada do cache")
+                self.arquivos_concluidos += 1
+            else:
+                pendentes[numero] = planilha
+        if not pendentes:
+            return
+
+        processos = min(len(pendentes), config.IMPORTACAO_PROCESSOS)
+        logging.info(f"Importação {self.id}: {len(pendentes)} planilhas em {processos} processos")
+
+        # spawn: o processo novo não herda as threads (bot, índice) deste
+        contexto = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers=processos, mp_context=contexto)
+        # Sem `with`: na saída ele esperaria as conversões que estão rodando,
+        # e um cancelamento ou erro tem que voltar logo
+        try:
+            futuros = {
+                executor.submit(converter_em_processo, planilha, self.caminho_preparacao(numero)): numero
+                for numero, planilha in pendentes.items()
+            }
+            restantes = set(futuros)
+            while restantes:
+                concluidos, restantes = wait(restantes, timeout=0.5, return_when=FIRST_COMPLETED)
+                if self.cancelado.is_set():
+                    return
+
+                for futuro in concluidos:
+                    numero = futuros[futuro]
+                    sucesso, processadas = futuro.result()
+                    if not sucesso:
+                        raise RuntimeError(f'Erro ao converter a planilha da base {numero}')
+
+                    self.linhas_processadas += processadas
+                    self.linhas_lidas += processadas
+                    self.arquivos_concluidos += 1
+                    logging.info(f"Importação {self.id}: base {numero} convertida ({self.arquivos_concluidos}/{len(self.planilhas)})")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def publicar(self):
+        """Troca todas as bases convertidas de uma vez"""
+        if self.usar_sqlite:
+            base_sqlite.substituir_bases({
+                numero: ler_ligacoes_csv(self.caminho_preparacao(numero))
+                for numero in self.planilhas
+            })
+            indice_bases.recarregar()
+            return
+
+        # O .bin guarda o mtime do CSV, que os.replace preserva
+        with indice_bases.publicando():
+            for numero in self.planilhas:
+                preparado = self.caminho_preparacao(numero)
+                os.replace(caminho_binario(preparado), caminho_binario(caminho_base(numero)))
+                os.replace(preparado, caminho_base(numero))
+
+    def resultado(self):
+        bases = {}
+        for numero in self.planilhas:
+            if self.usar_sqlite:
+                linhas, _, _ = base_sqlite.status()[numero]
+                bases[numero] = {'records': linhas}
+            else:
+                with open(caminho_base(numero), 'r', encoding='utf-8') as f:
+                    # Desconta o cabeçalho
+                    linhas = sum(1 for line in f) - 1
+                bases[numero] = {'records': linhas, 'size': os.path.getsize(caminho_base(numero))}
+        return {'records': sum(base['records'] for base in bases.values()), 'bases': bases}
+
+    def executar(self):
+        """Roda na fila de conversões; retorna o resultado ou None"""
+        os.makedirs(self.pasta, exist_ok=True)
+        try:
+            self.fase = 'convertendo'
+            self.converter_todas()
+            if self.cancelado.is_set():
+                return None
+
+            self.fase = 'publicando'
+            self.publicar()
+            resultado = self.resultado()
+            for numero, chave in self.chaves.items():
+                cache_conversoes.registrar(numero, chave, resultado['bases'][numero]['records'])
+            return resultado
+        finally:
+            shutil.rmtree(self.pasta, ignore_errors=True)
+            for planilha in self.planilhas.values():
+                try:
+                    os.remove(planilha)
+                except:
+                    pass
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+import threading
+import logging
+import os
+import config
+from modules.agendador import agendador
+from modules.contadores import contadores
+from modules.historico_contadores import historico_contadores
+from modules.registro_mensagens import registro_mensagens
+from modules.base_sqlite import base_sqlite
+from modules.report_manager import pregerar_relatorio
+
+lock = threading.Lock()
+iniciada = False
+
+def rotacionar_logs():
+    """Renomeia cada arquivo de log para <nome>.<data> e apaga os antigos"""
+    sufixo = (datetime.now() - timedelta(minutes=1)).strftime('%Y-%m-%d')
+    for handler in logging.getLogger().handlers:
+        if not isinstance(handler, logging.FileHandler):
+            continue
+        handler.acquire()
+        try:
+            # Fechado, o handler reabre o arquivo (novo) no próximo registro
+            if handler.stream:
+                handler.stream.close()
+                handler.stream = None
+            caminho = handler.baseFilename
+            if os.path.exists(caminho) and os.path.getsize(caminho) > 0:
+                destino = f"{caminho}.{sufixo}"
+                numero = 1
+                while os.path.exists(destino):
+                    destino = f"{caminho}.{sufixo}.{numero}"
+                    numero += 1
+                os.replace(caminho, destino)
+        finally:
+            handler.release()
+
+    limite = datetime.now() - timedelta(days=config.LOGS_RETENCAO_DIAS)
+    for arquivo in os.listdir(config.LOGS_FOLDER):
+        caminho = os.path.join(config.LOGS_FOLDER, arquivo)
+        # Só os já rotacionados: app.log.2024-01-31
+        if '.log.' in arquivo and datetime.fromtimestamp(os.path.getmtime(caminho)) < limite:
+            os.remove(caminho)
+            logging.info(f"Log antigo removido: {arquivo}")
+
+def compactar_indices():
+    """Regrava o registro de mensagens e otimiza o banco das bases (modo SQLite)"""
+    registro_mensagens.compactar_diario()
+    if config.BASE_STORAGE == 'sqlite':
+        base_sqlite.otimizar()
+
+def iniciar_manutencao():
+    """Registra as tarefas e inicia o agendador; só a primeira chamada faz algo.
+
+    Chamada antes de cada requisição: o processo que só vigia os arquivos no
+    modo debug do Flask nunca atende requisições e não roda as tarefas.
+    """
+    global iniciada
+    if iniciada:
+        return
+    with lock:
+        if iniciada:
+            return
+        agendador.adicionar('gravar_contadores', agendador.a_cada(config.CONTADORES_INTERVALO).seconds,
+                            contadores.salvar, 'Grava contadores.json e o histórico')
+        agendador.adicionar('virada_do_dia', agendador.a_cada().day.at('00:00'),
+                            contadores.virar_dia, 'Zera os contadores do dia')
+        agendador.adicionar('compactar_historico', agendador.a_cada().hour,
+                            historico_contadores.compactar, 'Apaga minutos e horas fora da retenção')
+        agendador.adicionar('pregerar_relatorio', agendador.a_cada(config.RELATORIO_PREGERAR_MINUTOS).minutes,
+                            pregerar_relatorio, 'Gera o PDF do relatório')
+        agendador.adicionar('compactar_indices', agendador.a_cada().day.at(config.MANUTENCAO_HORARIO),
+                            compactar_indices, 'Compacta o registro de mensagens e o banco das bases')
+        agendador.adicionar('rotacionar_logs', agendador.a_cada().day.at('00:00'),
+                            rotacionar_logs, 'Rotaciona os logs')
+        # Muitos incrementos antecipam a gravação
+        contadores.ao_acumular = lambda: agendador.executar_agora('gravar_contadores')
+        agendador.iniciar()
+        iniciada = True
@@ -0,0 +1,176 @@
+from flask import Blueprint, Response
+from bisect import bisect_left
+import threading
+import logging
+import math
+
+metricas_bp = Blueprint('metricas', __name__)
+
+# Limites (le) dos baldes de cada histograma
+BALDES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BALDES_BUSCA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+BALDES_LATENCIA = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BALDES_BYTES = tuple(1024 * 4 ** i for i in range(8))  # 1 KB a 16 MB
+BALDES_CONVERSAO = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+def formatar_valor(valor):
+    if valor == math.inf:
+        return '+Inf'
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor)
+
+def formatar_rotulos(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ''
+    escapados = (
+        f'{nome}="' + str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for nome, valor in pares
+    )
+    return '{' + ','.join(escapados) + '}'
+
+class Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def chave(self, rotulos):
+        return tuple(rotulos.get(nome, '') for nome in self.rotulos)
+
+    def cabecalho(self):
+        return [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, quantidade=1, **rotulos):
+        chave = self.chave(rotulos)
+        with self.lock:
+            self.series[chave] = self.series.get(chave, 0) + quantidade
+
+    def exposicao(self):
+        with self.lock:
+            series = dict(self.series)
+        linhas = self.cabecalho()
+        linhas.extend(f'{self.nome}{formatar_rotulos(self.rotulos, chave)} {formatar_valor(valor)}' for chave, valor in series.items())
+        return linhas
+
+class Histograma(Metrica):
+    """Contagens por balde fixo: observar é uma busca binária e três somas sob o lock"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, baldes, rotulos=()):
+        super().__init__(nome, ajuda, rotulos)
+        self.baldes = tuple(sorted(baldes))
+
+    def observar(self, valor, **rotulos):
+        chave = self.chave(rotulos)
+        indice = bisect_left(self.baldes, valor)
+        with self.lock:
+            serie = self.series.get(chave)
+            if serie is None:
+                # [contagem de cada balde (o último é +Inf), soma, total]
+                serie = self.series[chave] = [[0] * (len(self.baldes) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exposicao(self):
+        with self.lock:
+            series = {chave: (list(contagens), soma, total) for chave, (contagens, soma, total) in self.series.items()}
+        linhas = self.cabecalho()
+        for chave, (contagens, soma, total) in series.items():
+            acumulado = 0
+            for limite, contagem in zip(self.baldes + (math.inf,), contagens):
+                acumulado += contagem
+                rotulos = formatar_rotulos(self.rotulos, chave, ('le', formatar_valor(limite)))
+                linhas.append(f'{self.nome}_bucket{rotulos} {acumulado}')
+            rotulos = formatar_rotulos(self.rotulos, chave)
+            linhas.append(f'{self.nome}_sum{rotulos} {formatar_valor(soma)}')
+            linhas.append(f'{self.nome}_count{rotulos} {total}')
+        return linhas
+
+class Medidor(Metrica):
+    """Valor lido na hora da coleta: `funcao()` retorna um número, None
+    (sem valor) ou {valores dos rótulos (tupla): número}"""
+
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, funcao, rotulos=()):
+        super().__init__(nome, ajuda, rotulos)
+        self.funcao = funcao
+
+    def exposicao(self):
+        try:
+            valores = self.funcao()
+        except Exception as e:
+            logging.error(f"Erro ao coletar a métrica {self.nome}: {e}")
+            valores = None
+        if valores is None:
+            return []
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        linhas = self.cabecalho()
+        linhas.extend(f'{self.nome}{formatar_rotulos(self.rotulos, chave)} {formatar_valor(valor)}' for chave, valor in valores.items())
+        return linhas
+
+class RegistroMetricas:
+    def __init__(self):
+        self.metricas = {}
+        self.lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self.lock:
+            self.metricas[metrica.nome] = metrica
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self.registrar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, baldes, rotulos=()):
+        return self.registrar(Histograma(nome, ajuda, baldes, rotulos))
+
+    def medidor(self, nome, ajuda, funcao, rotulos=()):
+        return self.registrar(Medidor(nome, ajuda, funcao, rotulos))
+
+    def exposicao(self):
+        """Todas as métricas no formato texto do Prometheus"""
+        with self.lock:
+            metricas = list(self.metricas.values())
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.exposicao())
+        return '\n'.join(linhas) + '\n'
+
+# Registro único do processo
+metricas = RegistroMetricas()
+
+# Métricas do caminho das mensagens; os medidores são registrados nos módulos
+# que têm os valores (despachante, whatsapp_manager)
+duracao_polling = metricas.histograma(
+    'vcga_polling_duracao_segundos', 'Duração de cada varredura de GET /chats no modo polling', BALDES_SEGUNDOS)
+tamanho_chats = metricas.histograma(
+    'vcga_chats_resposta_bytes', 'Tamanho da resposta de GET /chats', BALDES_BYTES)
+latencia_mensagem = metricas.histograma(
+    'vcga_mensagem_latencia_segundos', 'Do recebimento da mensagem ao send-message com status 200', BALDES_LATENCIA)
+duracao_busca = metricas.histograma(
+    'vcga_busca_duracao_segundos', 'Busca das matrículas/HDs nas bases', BALDES_BUSCA, rotulos=('tipo',))
+envios = metricas.contador(
+    'vcga_envios_total', 'Tentativas de send-message por resultado', rotulos=('resultado',))
+duracao_conversao = metricas.histograma(
+    'vcga_conversao_duracao_segundos', 'Duração das conversões de planilhas', BALDES_CONVERSAO, rotulos=('estado',))
+duracao_pdf = metricas.histograma(
+    'vcga_relatorio_pdf_duracao_segundos', 'Geração do PDF do relatório', BALDES_SEGUNDOS)
+
+@metricas_bp.route('/metrics')
+def exportar():
+    return Response(metricas.exposicao(), content_type='text/plain; version=0.0.4; charset=utf-8')
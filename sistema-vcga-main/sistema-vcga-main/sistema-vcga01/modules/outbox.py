@@ -0,0 +1,188 @@
+import threading
+import logging
+import json
+import time
+import os
+import config
+
+class OutboxEnvios:
+    """Diário em disco das respostas a enviar, para nenhuma se perder num reinício.
+
+    Cada resposta é gravada (uma linha JSON com id, chat e texto) antes de
+    ir ao servidor WhatsApp, e depois da entrega recebe uma linha de
+    confirmação; uma resposta descartada como falha definitiva também deixa
+    de estar pendente. As linhas vão para segmentos `NNNNNN.log` de até
+    config.ENVIO_OUTBOX_SEGMENTO_MB; um segmento é apagado quando ele e os
+    anteriores não têm mais respostas pendentes.
+
+    O fsync é feito em lote por uma thread, no máximo a cada
+    config.ENVIO_OUTBOX_FSYNC_MS: `aguardar(id)` espera a linha da resposta
+    estar no disco. As confirmações vão no lote seguinte; se o processo cai
+    antes disso a resposta é enviada de novo (entrega ao menos uma vez).
+
+    Se o fsync falha (disco cheio, por exemplo), `erro` fica preenchido até
+    um fsync dar certo, as tentativas se espaçam até
+    config.ENVIO_OUTBOX_REPETIR_MAXIMO segundos e `aguardar` retorna False
+    em vez de esperar.
+    """
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.condicao = threading.Condition()
+        self.arquivo = None
+        self.segmento = 0
+        self.proximo_id = 1
+        self.escrito = 0
+        self.duravel = 0
+        self.sujo = False
+        self.erro = None
+        self.segmento_do_id = {}
+        self.pendentes_por_segmento = {}
+        self.thread = None
+
+    def caminho_segmento(self, numero):
+        return os.path.join(self.pasta, f'{numero:06d}.log')
+
+    def carregar(self):
+        """Lê os segmentos e devolve as respostas pendentes, na ordem em que
+        foram gravadas. As novas linhas vão para um segmento novo."""
+        os.makedirs(self.pasta, exist_ok=True)
+        segmentos = sorted(
+            int(nome[:-4]) for nome in os.listdir(self.pasta)
+            if nome.endswith('.log') and nome[:-4].isdigit()
+        )
+
+        pendentes = {}
+        for numero in segmentos:
+            self.pendentes_por_segmento[numero] = set()
+            with open(self.caminho_segmento(numero), 'r', encoding='utf-8') as f:
+                for linha in f:
+                    try:
+                        registro = json.loads(linha)
+                    except ValueError:
+                        # Linha cortada por uma queda no meio da gravação
+                        continue
+                    if 'id' in registro:
+                        pendentes[registro['id']] = registro
+                        self.segmento_do_id[registro['id']] = numero
+                        self.pendentes_por_segmento[numero].add(registro['id'])
+                        self.proximo_id = max(self.proximo_id, registro['id'] + 1)
+                    else:
+                        id_resolvido = registro.get('ok', registro.get('falha'))
+                        pendentes.pop(id_resolvido, None)
+                        self.descontar(id_resolvido)
+
+        with self.condicao:
+            self.segmento = (segmentos[-1] if segmentos else 0) + 1
+            self.abrir_segmento()
+            self.apagar_resolvidos()
+            self.escrito = self.duravel = self.proximo_id - 1
+
+        if pendentes:
+            logging.info(f"Outbox: {len(pendentes)} resposta(s) pendente(s) da execução anterior")
+        return [pendentes[id_envio] for id_envio in sorted(pendentes)]
+
+    def abrir_segmento(self):
+        # Chamado com self.condicao adquirida
+        self.arquivo = open(self.caminho_segmento(self.segmento), 'a', encoding='utf-8')
+        self.pendentes_por_segmento.setdefault(self.segmento, set())
+
+    def registrar(self, chat_id, mensagem, prioridade):
+        """Grava a resposta e devolve o seu id"""
+        with self.condicao:
+            id_envio = self.proximo_id
+            self.proximo_id += 1
+            self.segmento_do_id[id_envio] = self.segmento
+            self.pendentes_por_segmento[self.segmento].add(id_envio)
+            self.escrito = id_envio
+            self.escrever({'id': id_envio, 'chat_id': chat_id, 'mensagem': mensagem, 'prioridade': prioridade})
+            return id_envio
+
+    def aguardar(self, id_envio, timeout=None):
+        """Espera a resposta estar gravada no disco; retorna False se o
+        outbox está com erro ou o tempo (config.ENVIO_OUTBOX_ESPERA) acabou"""
+        limite = time.monotonic() + (config.ENVIO_OUTBOX_ESPERA if timeout is None else timeout)
+        with self.condicao:
+            while self.duravel < id_envio:
+                restante = limite - time.monotonic()
+                if self.erro is not None or restante <= 0:
+                    return False
+                self.condicao.wait(restante)
+            return True
+
+    def confirmar(self, id_envio):
+        self.resolver({'ok': id_envio})
+
+    def descartar(self, id_envio):
+        self.resolver({'falha': id_envio})
+
+    def resolver(self, registro):
+        with self.condicao:
+            self.escrever(registro)
+            self.descontar(registro.get('ok', registro.get('falha')))
+            self.apagar_resolvidos()
+
+    def escrever(self, registro):
+        # Chamado com self.condicao adquirida
+        self.arquivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        if self.arquivo.tell() >= config.ENVIO_OUTBOX_SEGMENTO_MB * 1024 * 1024:
+            self.sincronizar()
+            self.arquivo.close()
+            self.segmento += 1
+            self.abrir_segmento()
+            return
+
+        self.sujo = True
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.sincronizar_em_lote, name='outbox-fsync', daemon=True)
+            self.thread.start()
+        self.condicao.notify_all()
+
+    def descontar(self, id_envio):
+        numero = self.segmento_do_id.pop(id_envio, None)
+        if numero is not None:
+            self.pendentes_por_segmento[numero].discard(id_envio)
+
+    def apagar_resolvidos(self):
+        # Chamado com self.condicao adquirida. Só em ordem: as confirmações
+        # de um segmento antigo podem estar num segmento mais novo
+        for numero in sorted(self.pendentes_por_segmento):
+            if numero == self.segmento or self.pendentes_por_segmento[numero]:
+                break
+            os.remove(self.caminho_segmento(numero))
+            del self.pendentes_por_segmento[numero]
+
+    def sincronizar(self):
+        # Chamado com self.condicao adquirida
+        self.arquivo.flush()
+        os.fsync(self.arquivo.fileno())
+        self.duravel = self.escrito
+        self.sujo = False
+        if self.erro is not None:
+            logging.info("Outbox de envios voltou a gravar no disco")
+            self.erro = None
+        self.condicao.notify_all()
+
+    def sincronizar_em_lote(self):
+        intervalo = config.ENVIO_OUTBOX_FSYNC_MS / 1000
+        espera = intervalo
+        while True:
+            with self.condicao:
+                while not self.sujo:
+                    self.condicao.wait()
+            # Junta as gravações que chegarem nesse intervalo num só fsync
+            time.sleep(espera)
+            with self.condicao:
+                try:
+                    self.sincronizar()
+                    espera = intervalo
+                except OSError as e:
+                    if self.erro is None:
+                        logging.error(f"Erro ao gravar o outbox de envios: {e}")
+                    self.erro = str(e)
+                    self.condicao.notify_all()
+                    espera = min(max(espera, 0.1) * 2, config.ENVIO_OUTBOX_REPETIR_MAXIMO)
+
+    def pendentes(self):
+        with self.condicao:
+            return len(self.segmento_do_id)
@@ -0,0 +1,114 @@
+import threading
+import logging
+import queue
+import time
+import zlib
+
+class PoolChats:
+    """Threads que respondem os chats em paralelo, mantendo a ordem de cada chat.
+
+    Cada chat é sempre atendido pela mesma thread (crc32 do chat_id), com a
+    sua própria fila limitada: as mensagens de um chat saem na ordem em que
+    chegaram, e um envio lento só atrasa os chats daquela thread. Com a fila
+    cheia, `enviar` espera abrir espaço em vez de descartar a mensagem.
+
+    `parar` não espera espaço nas filas: marca o pool como parando e cada
+    thread sai quando a sua fila esvazia.
+    """
+
+    def __init__(self, workers=4, tamanho_fila=100):
+        self.filas = [queue.Queue(maxsize=tamanho_fila) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.processadas = 0
+        self.erros = 0
+        self.filas_cheias = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.duracao_total = 0.0
+        self.duracao_maxima = 0.0
+        self.em_andamento = 0
+        self.parando = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.executar, args=(fila,), name=f'bot-chat-{i}', daemon=True)
+            for i, fila in enumerate(self.filas)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def fila_do_chat(self, chat_id):
+        return self.filas[zlib.crc32(chat_id.encode('utf-8')) % len(self.filas)]
+
+    def enviar(self, chat_id, funcao, *args):
+        """Coloca `funcao(*args)` na fila da thread do chat"""
+        fila = self.fila_do_chat(chat_id)
+        if fila.full():
+            with self.lock:
+                self.filas_cheias += 1
+            logging.warning(f"Fila do chat {chat_id} cheia; aguardando")
+        fila.put((time.monotonic(), funcao, args))
+
+    def executar(self, fila):
+        while True:
+            try:
+                item = fila.get(timeout=0.5)
+            except queue.Empty:
+                # Sem o marcador (fila estava cheia em `parar`)
+                if self.parando.is_set():
+                    return
+                continue
+            if item is None:
+                return
+
+            enviada_em, funcao, args = item
+            inicio = time.monotonic()
+            with self.lock:
+                self.em_andamento += 1
+            try:
+                funcao(*args)
+                erro = False
+            except Exception as e:
+                logging.error(f"Erro ao responder chat: {e}")
+                erro = True
+            fim = time.monotonic()
+
+            with self.lock:
+                self.em_andamento -= 1
+                self.processadas += 1
+                self.erros += erro
+                self.espera_total += inicio - enviada_em
+                self.espera_maxima = max(self.espera_maxima, inicio - enviada_em)
+                self.duracao_total += fim - inicio
+                self.duracao_maxima = max(self.duracao_maxima, fim - inicio)
+
+    def parar(self, timeout=5):
+        """Termina as threads depois do que já está nas filas; retorna False
+        se alguma ainda está rodando depois de `timeout` segundos"""
+        self.parando.set()
+        for fila in self.filas:
+            try:
+                fila.put_nowait(None)
+            except queue.Full:
+                pass
+        limite = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(limite - time.monotonic(), 0))
+        return not self.ativo()
+
+    def ativo(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def status(self):
+        with self.lock:
+            processadas = self.processadas
+            return {
+                'workers': len(self.filas),
+                'filas': [fila.qsize() for fila in self.filas],
+                'em_andamento': self.em_andamento,
+                'processadas': processadas,
+                'erros': self.erros,
+                'filas_cheias': self.filas_cheias,
+                'espera_media_ms': round(1000 * self.espera_total / processadas, 1) if processadas else None,
+                'espera_maxima_ms': round(1000 * self.espera_maxima, 1),
+                'duracao_media_ms': round(1000 * self.duracao_total / processadas, 1) if processadas else None,
+                'duracao_maxima_ms': round(1000 * self.duracao_maxima, 1)
+            }
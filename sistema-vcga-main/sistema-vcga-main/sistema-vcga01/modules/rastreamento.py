@@ -0,0 +1,144 @@
+from contextlib import nullcontext
+from contextvars import ContextVar
+from collections import deque
+from datetime import datetime
+import threading
+import random
+import uuid
+import time
+import config
+
+# Rastro da resposta em andamento na thread (ou tarefa asyncio) atual
+rastro_atual = ContextVar('rastro_atual', default=None)
+
+# Devolvido por `trecho` quando a resposta não está sendo rastreada
+NULO = nullcontext()
+
+class Trecho:
+    def __init__(self, rastro, nome):
+        self.rastro = rastro
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.rastro.adicionar(self.nome, time.perf_counter() - self.inicio)
+        return False
+
+class Rastro:
+    """Tempos de cada etapa de uma resposta, do recebimento à entrega"""
+
+    def __init__(self, chat_id, mensagens, recebido_em=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.chat_id = chat_id
+        self.mensagens = mensagens
+        self.data = datetime.now()
+        self.inicio = time.monotonic()
+        # A espera na fila do bot começa antes do rastro
+        self.recebido_em = recebido_em if recebido_em is not None else self.inicio
+        self.trechos = []
+        self.erro = None
+        self.total = None
+        if recebido_em is not None:
+            self.adicionar('espera', self.inicio - recebido_em)
+
+    def adicionar(self, nome, duracao):
+        self.trechos.append((nome, duracao))
+
+    def resumo(self):
+        return {
+            'id': self.id,
+            'chat_id': self.chat_id,
+            'mensagens': self.mensagens,
+            'data': self.data.isoformat(timespec='seconds'),
+            'total_ms': round(1000 * self.total, 2) if self.total is not None else None,
+            'trechos': [{'nome': nome, 'ms': round(1000 * duracao, 3)} for nome, duracao in self.trechos],
+            'erro': self.erro
+        }
+
+def percentil(ordenados, fracao):
+    # Pelo posto mais próximo; `ordenados` não está vazio
+    return ordenados[min(len(ordenados) - 1, int(fracao * len(ordenados)))]
+
+class Rastreador:
+    """Rastros por amostragem das respostas do bot.
+
+    `iniciar` sorteia a resposta (config.RASTREAMENTO_AMOSTRAGEM, de 0 a 1) e,
+    se ela entra na amostra, deixa o rastro em `rastro_atual`; `trecho(nome)`
+    mede um bloco do rastro atual. Fora da amostra `trecho` devolve um
+    contexto vazio, então o custo é uma consulta à ContextVar. O despachante
+    mede o envio e conclui o rastro; os concluídos ficam num buffer circular
+    de config.RASTREAMENTO_LIMITE rastros.
+    """
+
+    def __init__(self, limite):
+        self.lock = threading.Lock()
+        self.concluidos = deque(maxlen=limite)
+        self.iniciados = 0
+
+    def iniciar(self, chat_id, mensagens=1, recebido_em=None):
+        """Retorna (rastro, token) ou (None, None) se a resposta ficou fora da amostra"""
+        taxa = config.RASTREAMENTO_AMOSTRAGEM
+        if taxa <= 0 or (taxa < 1 and random.random() >= taxa):
+            return None, None
+        rastro = Rastro(chat_id, mensagens, recebido_em)
+        with self.lock:
+            self.iniciados += 1
+        return rastro, rastro_atual.set(rastro)
+
+    def soltar(self, token):
+        """Tira o rastro da thread/tarefa; quem concluir é o despachante"""
+        if token is not None:
+            rastro_atual.reset(token)
+
+    def concluir(self, rastro, erro=None):
+        rastro.erro = erro
+        rastro.total = time.monotonic() - rastro.recebido_em
+        with self.lock:
+            self.concluidos.append(rastro)
+
+    def mais_lentos(self, quantidade=20):
+        with self.lock:
+            rastros = list(self.concluidos)
+        rastros.sort(key=lambda rastro: rastro.total, reverse=True)
+        return [rastro.resumo() for rastro in rastros[:quantidade]]
+
+    def percentis(self):
+        """p50/p95/p99 em ms de cada etapa e do total, nos rastros do buffer"""
+        with self.lock:
+            rastros = list(self.concluidos)
+        etapas = {'total': [rastro.total for rastro in rastros]}
+        for rastro in rastros:
+            for nome, duracao in rastro.trechos:
+                etapas.setdefault(nome, []).append(duracao)
+
+        resultado = {}
+        for nome, duracoes in etapas.items():
+            if not duracoes:
+                continue
+            duracoes.sort()
+            resultado[nome] = {
+                'amostras': len(duracoes),
+                'p50_ms': round(1000 * percentil(duracoes, 0.50), 3),
+                'p95_ms': round(1000 * percentil(duracoes, 0.95), 3),
+                'p99_ms': round(1000 * percentil(duracoes, 0.99), 3)
+            }
+        return resultado
+
+    def status(self):
+        with self.lock:
+            return {
+                'amostragem': config.RASTREAMENTO_AMOSTRAGEM,
+                'iniciados': self.iniciados,
+                'no_buffer': len(self.concluidos)
+            }
+
+def trecho(nome):
+    """Mede o bloco no rastro atual, se houver"""
+    rastro = rastro_atual.get()
+    return NULO if rastro is None else Trecho(rastro, nome)
+
+# Rastreador único do processo
+rastreador = Rastreador(config.RASTREAMENTO_LIMITE)
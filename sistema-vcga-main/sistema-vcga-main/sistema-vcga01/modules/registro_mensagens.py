@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import threading
+import logging
+import os
+import config
+
+class RegistroMensagens:
+    """Ids das mensagens que o bot já processou, para responder cada uma só uma vez.
+
+    Na memória ficam os `limite` ids mais recentes (LRU). Cada id
+    confirmado é acrescentado a um diário em disco, uma linha por id, para o
+    registro sobreviver a reinícios; quando o diário passa de duas vezes o
+    limite, ele é regravado só com os ids confirmados da memória.
+    """
+
+    def __init__(self, caminho, limite=10000):
+        self.caminho = caminho
+        self.limite = limite
+        self.ids = OrderedDict()
+        # Reservados por `primeira_vez` e ainda não confirmados
+        self.pendentes = set()
+        self.linhas_diario = 0
+        self.lock = threading.Lock()
+        self.carregar()
+
+    def carregar(self):
+        try:
+            with open(self.caminho, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    id_mensagem = linha.strip()
+                    if id_mensagem:
+                        self.lembrar(id_mensagem)
+                        self.linhas_diario += 1
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logging.error(f"Erro ao ler o registro de mensagens: {e}")
+        logging.info(f"Registro de mensagens carregado com {len(self.ids)} ids")
+
+    def lembrar(self, id_mensagem):
+        self.ids[id_mensagem] = None
+        self.ids.move_to_end(id_mensagem)
+        if len(self.ids) > self.limite:
+            self.ids.popitem(last=False)
+
+    def primeira_vez(self, id_mensagem):
+        """Reserva a mensagem; False se ela já foi ou está sendo processada.
+
+        O id é reservado na memória antes do processamento: uma mensagem que
+        chega de novo (pela varredura dos chats ou por um evento repetido) é
+        ignorada mesmo que a primeira resposta ainda esteja sendo montada. Ele
+        só vai para o diário em `confirmar`, depois que a resposta foi
+        entregue ao despachante; `esquecer` desfaz a reserva se a resposta
+        falhou, para a mensagem ser tratada de novo.
+        """
+        if not id_mensagem:
+            return True
+
+        with self.lock:
+            if id_mensagem in self.ids:
+                self.ids.move_to_end(id_mensagem)
+                return False
+
+            self.lembrar(id_mensagem)
+            self.pendentes.add(id_mensagem)
+            return True
+
+    def confirmar(self, ids):
+        """Grava no diário os ids reservados cuja resposta já foi enfileirada"""
+        with self.lock:
+            for id_mensagem in ids:
+                if id_mensagem not in self.pendentes:
+                    continue
+                self.pendentes.discard(id_mensagem)
+                try:
+                    self.anotar(id_mensagem)
+                except OSError as e:
+                    logging.error(f"Erro ao gravar o registro de mensagens: {e}")
+
+    def esquecer(self, ids):
+        """Desfaz a reserva dos ids cuja resposta falhou"""
+        with self.lock:
+            for id_mensagem in ids:
+                if id_mensagem in self.pendentes:
+                    self.pendentes.discard(id_mensagem)
+                    self.ids.pop(id_mensagem, None)
+
+    def anotar(self, id_mensagem):
+        # Chamado com self.lock adquirido
+        if self.linhas_diario >= 2 * self.limite:
+            self.compactar()
+            return
+
+        dir_path = os.path.dirname(self.caminho)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        with open(self.caminho, 'a', encoding='utf-8') as f:
+            f.write(id_mensagem + '\n')
+        self.linhas_diario += 1
+
+    def compactar(self):
+        """Regrava o diário só com os ids confirmados da memória"""
+        # Chamado com self.lock adquirido
+        confirmados = [id_mensagem for id_mensagem in self.ids if id_mensagem not in self.pendentes]
+        temp = self.caminho + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.writelines(id_mensagem + '\n' for id_mensagem in confirmados)
+        os.replace(temp, self.caminho)
+        self.linhas_diario = len(confirmados)
+
+    def compactar_diario(self):
+        """Compacta o diário se ele tem ids que já saíram da memória (tarefa agendada)"""
+        with self.lock:
+            if self.linhas_diario > len(self.ids):
+                self.compactar()
+
+    def __len__(self):
+        return len(self.ids)
+
+# Registro único do processo
+registro_mensagens = RegistroMensagens(config.BOT_REGISTRO_MENSAGENS, config.BOT_REGISTRO_LIMITE)
@@ -1,7 +1,5 @@
-from flask import Blueprint, render_template, jsonify, session, redirect, url_for, send_file, make_response
-import json
-import os
-from datetime import datetime
+from flask import Blueprint, render_template, jsonify, session, redirect, url_for, send_file, make_response, request
+from datetime import datetime, timedelta
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -13,28 +11,20 @@ from reportlab.graphics.shapes import Drawing
 from reportlab.graphics.charts.piecharts import Pie
 from reportlab.graphics.charts.legends import Legend
 import io
+import logging
+import time
+import config
+from modules.contadores import contadores
+from modules.historico_contadores import historico_contadores, GRANULARIDADES
+from modules.metricas import duracao_pdf
 
 report_bp = Blueprint('report', __name__)
 
 def get_report_data():
     """Carrega os dados do relatório"""
     try:
-        arquivo_contadores = "contadores.json"
-        
-        if os.path.exists(arquivo_contadores):
-            with open(arquivo_contadores, 'r') as file:
-                dados = json.load(file)
-        else:
-            dados = {
-                "total_hd_encontrado": 0,
-                "total_matriculas_encontradas": 0,
-                "total_hd_nao_encontrado": 0,
-                "total_mensagens_invalidas": 0,
-                "total_respostas_link": 0,
-                "total_matriculas_nao_encontrada": 0,
-                "total_mesagens_respondidas": 0,
-                "ultima_data": str(datetime.now().date())
-            }
+        # Os contadores da memória; o arquivo pode estar alguns segundos atrás
+        dados = contadores.dados()
         
         # Gerar relatório
         total_geral = (
@@ -75,19 +65,245 @@ def report():
 @report_bp.route('/data')
 def report_data():
     try:
-        arquivo_contadores = "contadores.json"
-        
-        if os.path.exists(arquivo_contadores):
-            with open(arquivo_contadores, 'r') as file:
-                dados = json.load(file)
-        else:
-            dados = {}
-        
-        return jsonify(dados)
+        return jsonify(contadores.dados())
         
     except Exception as e:
         return jsonify({'error': str(e)})
 
+def ler_momento(texto, fim=False):
+    """Data ('AAAA-MM-DD') ou data e hora ISO; uma data só no fim vale até 23:59"""
+    momento = datetime.fromisoformat(texto)
+    if fim and len(texto) == 10:
+        momento += timedelta(hours=23, minutes=59)
+    return momento
+
+@report_bp.route('/historico')
+def historico():
+    """Contadores de um período, por minuto, hora ou dia.
+
+    Parâmetros: inicio e fim (padrão: os últimos 7 dias), granularidade
+    ('minuto', 'hora' ou 'dia') e, opcionalmente, comparar_dias para somar
+    também o mesmo período N dias antes.
+    """
+    try:
+        agora = datetime.now()
+        inicio = ler_momento(request.args['inicio']) if request.args.get('inicio') else agora - timedelta(days=7)
+        fim = ler_momento(request.args['fim'], fim=True) if request.args.get('fim') else agora
+        granularidade = request.args.get('granularidade', 'hora')
+        if granularidade not in GRANULARIDADES:
+            return jsonify({'success': False, 'message': f'Granularidade inválida: {granularidade}'})
+
+        series = historico_contadores.consultar(inicio, fim, granularidade)
+        dados = {
+            'success': True,
+            'inicio': inicio.isoformat(timespec='minutes'),
+            'fim': fim.isoformat(timespec='minutes'),
+            'granularidade': granularidade,
+            'series': [{'periodo': periodo, **valores} for periodo, valores in series.items()],
+            'totais': historico_contadores.totais(inicio, fim, granularidade)
+        }
+
+        comparar_dias = request.args.get('comparar_dias', type=int)
+        if comparar_dias:
+            deslocamento = timedelta(days=comparar_dias)
+            dados['comparacao'] = {
+                'inicio': (inicio - deslocamento).isoformat(timespec='minutes'),
+                'fim': (fim - deslocamento).isoformat(timespec='minutes'),
+                'totais': historico_contadores.totais(inicio - deslocamento, fim - deslocamento, granularidade)
+            }
+        return jsonify(dados)
+
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Data inválida: {e}'})
+    except Exception as e:
+        logging.error(f"Erro ao consultar o histórico de contadores: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+# Último PDF gerado pelo agendador: {'dados': report_data, 'pdf': bytes, 'gerado_em': datetime}
+relatorio_pregerado = None
+
+def pdf_pregerado(report_data):
+    """PDF pregerado com esses contadores, ou None. Mais velho que o
+    intervalo da pregeração, o horário no cabeçalho já não vale"""
+    pregerado = relatorio_pregerado
+    if not pregerado or pregerado['dados'] != report_data:
+        return None
+    if datetime.now() - pregerado['gerado_em'] >= timedelta(minutes=config.RELATORIO_PREGERAR_MINUTOS):
+        return None
+    return pregerado['pdf']
+
+def gerar_pdf(report_data):
+    """Monta o relatório em PDF e retorna os bytes"""
+    inicio = time.perf_counter()
+    # Criar buffer para o PDF
+    buffer = io.BytesIO()
+    
+    # Configurar documento PDF
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=18
+    )
+    
+    # Estilos
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        alignment=TA_CENTER,
+        textColor=colors.HexColor('#2c3e50')
+    )
+    
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=16,
+        spaceAfter=12,
+        textColor=colors.HexColor('#34495e')
+    )
+    
+    normal_style = ParagraphStyle(
+        'CustomNormal',
+        parent=styles['Normal'],
+        fontSize=11,
+        spaceAfter=6
+    )
+    
+    # Conteúdo do PDF
+    story = []
+    
+    # Título
+    story.append(Paragraph("Relatório VCGA - Sistema WhatsApp Bot", title_style))
+    story.append(Spacer(1, 20))
+    
+    # Data de geração
+    data_geracao = datetime.now().strftime("%d/%m/%Y às %H:%M:%S")
+    story.append(Paragraph(f"<b>Relatório gerado em:</b> {data_geracao}", normal_style))
+    story.append(Spacer(1, 20))
+    
+    # Resumo Geral
+    story.append(Paragraph("Resumo Geral", heading_style))
+    
+    resumo_data = [
+        ['Métrica', 'Valor'],
+        ['Consultas Bem-sucedidas', str(report_data['hd_encontrado'] + report_data['matriculas_encontradas'])],
+        ['Não Encontrados', str(report_data['hd_nao_encontrado'] + report_data['matriculas_nao_encontradas'])],
+        ['Links Enviados', str(report_data['respostas_link'])],
+        ['Total de Respostas', str(report_data['mensagens_respondidas'])],
+    ]
+    
+    resumo_table = Table(resumo_data, colWidths=[3*inch, 2*inch])
+    resumo_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ]))
+    
+    story.append(resumo_table)
+    story.append(Spacer(1, 30))
+    
+    # Detalhes por Categoria
+    story.append(Paragraph("Detalhes por Categoria", heading_style))
+    
+    detalhes_data = [
+        ['Categoria', 'Quantidade'],
+        ['HDs Encontrados', str(report_data['hd_encontrado'])],
+        ['Matrículas Encontradas', str(report_data['matriculas_encontradas'])],
+        ['HDs Não Encontrados', str(report_data['hd_nao_encontrado'])],
+        ['Matrículas Não Encontradas', str(report_data['matriculas_nao_encontradas'])],
+        ['Mensagens Inválidas', str(report_data['mensagens_invalidas'])],
+        ['Respostas de Link', str(report_data['respostas_link'])],
+    ]
+    
+    detalhes_table = Table(detalhes_data, colWidths=[3*inch, 2*inch])
+    detalhes_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#27ae60')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ]))
+    
+    story.append(detalhes_table)
+    story.append(Spacer(1, 30))
+    
+    # Informações Adicionais
+    story.append(Paragraph("Informações Adicionais", heading_style))
+    
+    taxa_sucesso = 0
+    if report_data['total_geral'] > 0:
+        taxa_sucesso = (report_data['hd_encontrado'] + report_data['matriculas_encontradas']) / report_data['total_geral'] * 100
+    
+    info_data = [
+        ['Informação', 'Valor'],
+        ['Última Atualização', str(report_data['ultima_data'])],
+        ['Total de Interações', str(report_data['total_geral'])],
+        ['Taxa de Sucesso', f"{taxa_sucesso:.1f}%"],
+        ['Mensagens Respondidas', str(report_data['mensagens_respondidas'])],
+    ]
+    
+    info_table = Table(info_data, colWidths=[3*inch, 2*inch])
+    info_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e74c3c')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ]))
+    
+    story.append(info_table)
+    story.append(Spacer(1, 30))
+    
+    # Rodapé
+    story.append(Spacer(1, 50))
+    footer_style = ParagraphStyle(
+        'Footer',
+        parent=styles['Normal'],
+        fontSize=10,
+        alignment=TA_CENTER,
+        textColor=colors.grey
+    )
+    story.append(Paragraph("Sistema VCGA - WhatsApp Bot Administrativo", footer_style))
+    story.append(Paragraph("Desenvolvido por Alisson Cardozo Varela", footer_style))
+    
+    # Construir PDF
+    doc.build(story)
+    pdf = buffer.getvalue()
+    buffer.close()
+    duracao_pdf.observar(time.perf_counter() - inicio)
+    return pdf
+
+def pregerar_relatorio():
+    """Gera o PDF com os contadores atuais (tarefa agendada); sempre de novo,
+    para o horário no cabeçalho acompanhar o intervalo"""
+    global relatorio_pregerado
+    report_data, error = get_report_data()
+    if error:
+        raise RuntimeError(error)
+    relatorio_pregerado = {'dados': report_data, 'pdf': gerar_pdf(report_data), 'gerado_em': datetime.now()}
+
 @report_bp.route('/download-pdf')
 def download_pdf():
     """Gera e baixa o relatório em PDF"""
@@ -97,173 +313,17 @@ def download_pdf():
         if error:
             return jsonify({'error': error}), 500
         
-        # Criar buffer para o PDF
-        buffer = io.BytesIO()
-        
-        # Configurar documento PDF
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=A4,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=72,
-            bottomMargin=18
-        )
-        
-        # Estilos
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#2c3e50')
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            spaceAfter=12,
-            textColor=colors.HexColor('#34495e')
-        )
-        
-        normal_style = ParagraphStyle(
-            'CustomNormal',
-            parent=styles['Normal'],
-            fontSize=11,
-            spaceAfter=6
-        )
-        
-        # Conteúdo do PDF
-        story = []
-        
-        # Título
-        story.append(Paragraph("Relatório VCGA - Sistema WhatsApp Bot", title_style))
-        story.append(Spacer(1, 20))
-        
-        # Data de geração
-        data_geracao = datetime.now().strftime("%d/%m/%Y às %H:%M:%S")
-        story.append(Paragraph(f"<b>Relatório gerado em:</b> {data_geracao}", normal_style))
-        story.append(Spacer(1, 20))
-        
-        # Resumo Geral
-        story.append(Paragraph("Resumo Geral", heading_style))
-        
-        resumo_data = [
-            ['Métrica', 'Valor'],
-            ['Consultas Bem-sucedidas', str(report_data['hd_encontrado'] + report_data['matriculas_encontradas'])],
-            ['Não Encontrados', str(report_data['hd_nao_encontrado'] + report_data['matriculas_nao_encontradas'])],
-            ['Links Enviados', str(report_data['respostas_link'])],
-            ['Total de Respostas', str(report_data['mensagens_respondidas'])],
-        ]
-        
-        resumo_table = Table(resumo_data, colWidths=[3*inch, 2*inch])
-        resumo_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ]))
-        
-        story.append(resumo_table)
-        story.append(Spacer(1, 30))
-        
-        # Detalhes por Categoria
-        story.append(Paragraph("Detalhes por Categoria", heading_style))
-        
-        detalhes_data = [
-            ['Categoria', 'Quantidade'],
-            ['HDs Encontrados', str(report_data['hd_encontrado'])],
-            ['Matrículas Encontradas', str(report_data['matriculas_encontradas'])],
-            ['HDs Não Encontrados', str(report_data['hd_nao_encontrado'])],
-            ['Matrículas Não Encontradas', str(report_data['matriculas_nao_encontradas'])],
-            ['Mensagens Inválidas', str(report_data['mensagens_invalidas'])],
-            ['Respostas de Link', str(report_data['respostas_link'])],
-        ]
-        
-        detalhes_table = Table(detalhes_data, colWidths=[3*inch, 2*inch])
-        detalhes_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#27ae60')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ]))
-        
-        story.append(detalhes_table)
-        story.append(Spacer(1, 30))
-        
-        # Informações Adicionais
-        story.append(Paragraph("Informações Adicionais", heading_style))
-        
-        taxa_sucesso = 0
-        if report_data['total_geral'] > 0:
-            taxa_sucesso = (report_data['hd_encontrado'] + report_data['matriculas_encontradas']) / report_data['total_geral'] * 100
-        
-        info_data = [
-            ['Informação', 'Valor'],
-            ['Última Atualização', str(report_data['ultima_data'])],
-            ['Total de Interações', str(report_data['total_geral'])],
-            ['Taxa de Sucesso', f"{taxa_sucesso:.1f}%"],
-            ['Mensagens Respondidas', str(report_data['mensagens_respondidas'])],
-        ]
-        
-        info_table = Table(info_data, colWidths=[3*inch, 2*inch])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e74c3c')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ]))
-        
-        story.append(info_table)
-        story.append(Spacer(1, 30))
-        
-        # Rodapé
-        story.append(Spacer(1, 50))
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=10,
-            alignment=TA_CENTER,
-            textColor=colors.grey
-        )
-        story.append(Paragraph("Sistema VCGA - WhatsApp Bot Administrativo", footer_style))
-        story.append(Paragraph("Desenvolvido por Alisson Cardozo Varela", footer_style))
-        
-        # Construir PDF
-        doc.build(story)
-        
-        # Preparar resposta
-        buffer.seek(0)
+        # O PDF pregerado serve enquanto os contadores não mudarem
+        pdf = pdf_pregerado(report_data)
+        if pdf is None:
+            pdf = gerar_pdf(report_data)
         
         filename = f"relatorio_vcga_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         
-        response = make_response(buffer.getvalue())
+        response = make_response(pdf)
         response.headers['Content-Type'] = 'application/pdf'
         response.headers['Content-Disposition'] = f'attachment; filename={filename}'
         
-        buffer.close()
-        
         return response
         
     except Exception as e:
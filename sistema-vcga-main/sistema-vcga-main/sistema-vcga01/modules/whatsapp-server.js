@@ -2,6 +2,7 @@
 const { Client, LocalAuth, MessageMedia } = require('whatsapp-web.js');
 const express = require('express');
 const qrcode = require('qrcode');
+const http = require('http');
 const app = express();
 app.use(express.json());
 
@@ -9,6 +10,11 @@ let requestQueue = [];
 let isProcessing = false;
 let currentQRCode = null;
 
+// Endereço do Flask que recebe as mensagens (vazio: bot em modo polling)
+const INGEST_URL = process.env.INGEST_URL || '';
+// Intervalo entre envios; com o Flask ditando o ritmo pode ser 0
+const SEND_GAP_MS = parseInt(process.env.SEND_GAP_MS || '1000', 10);
+
 const restartClient = () => {
     console.log('Reinicializando o cliente...');
     currentQRCode = null;
@@ -49,6 +55,43 @@ client.on('ready', () => {
     }
 });
 
+// Encaminha uma mensagem recebida para o bot
+const forwardMessage = (payload) => {
+    const data = JSON.stringify(payload);
+    const req = http.request(INGEST_URL, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Content-Length': Buffer.byteLength(data)
+        },
+        timeout: 5000
+    });
+    req.on('timeout', () => req.destroy());
+    req.on('error', (error) => {
+        console.error('Erro ao encaminhar mensagem:', error.message);
+    });
+    req.end(data);
+};
+
+client.on('message', async (msg) => {
+    if (!INGEST_URL || msg.fromMe || msg.isStatus || msg.from.endsWith('@g.us')) return;
+
+    try {
+        const chat = await msg.getChat();
+        if (chat.isGroup) return;
+
+        forwardMessage({
+            id: msg.id._serialized,
+            chatId: chat.id._serialized,
+            name: chat.name,
+            body: msg.body,
+            timestamp: msg.timestamp
+        });
+    } catch (error) {
+        console.error('Erro ao processar mensagem recebida:', error);
+    }
+});
+
 app.get('/qr', (req, res) => {
     if (currentQRCode) {
         res.json({ qr: currentQRCode });
@@ -67,7 +110,7 @@ const processQueue = () => {
         setTimeout(() => {
             isProcessing = false;
             processQueue();
-        }, 1000);
+        }, SEND_GAP_MS);
     });
 };
 
@@ -82,6 +125,8 @@ app.post('/send-message', (req, res) => {
 
         try {
             await client.sendMessage(chatId, message);
+            // Respondido: o chat sai da lista de não lidos
+            await client.sendSeen(chatId).catch(() => {});
             res.status(200).send({ status: 'success', message: 'Mensagem enviada!' });
         } catch (error) {
             if (attempt < 3) {
@@ -97,6 +142,19 @@ app.post('/send-message', (req, res) => {
     processQueue();
 });
 
+app.post('/mark-seen', async (req, res) => {
+    if (!client.info) {
+        return res.status(500).send({ status: 'error', message: 'Cliente não está conectado' });
+    }
+
+    try {
+        await client.sendSeen(req.body.chatId);
+        res.status(200).send({ status: 'success' });
+    } catch (error) {
+        res.status(500).send({ status: 'error', message: error.toString() });
+    }
+});
+
 app.get('/status', (req, res) => {
     const info = client.info;
     if (info) {
@@ -116,6 +174,20 @@ app.get('/status', (req, res) => {
     }
 });
 
+// Mensagens não lidas de um chat, para o bot responder todas de uma vez
+app.get('/unread-messages', async (req, res) => {
+    try {
+        const chat = await client.getChatById(req.query.chatId);
+        const limit = Math.max(parseInt(req.query.limit, 10) || chat.unreadCount || 1, 1);
+        const messages = await chat.fetchMessages({ limit });
+        res.status(200).json(messages
+            .filter((msg) => !msg.fromMe)
+            .map((msg) => ({ id: msg.id._serialized, body: msg.body, timestamp: msg.timestamp })));
+    } catch (error) {
+        res.status(500).send({ status: 'error', message: error.toString() });
+    }
+});
+
 app.get('/chats', async (req, res) => {
     try {
         const chats = await client.getChats();
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, url_for, has_request_context
 import subprocess
 import threading
 import requests
@@ -7,6 +7,10 @@ import logging
 import os
 import shutil
 import psutil
+import config
+from modules.bridge_client import bridge
+from modules.despachante import despachante
+from modules.metricas import metricas
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 
@@ -24,9 +28,28 @@ def get_whatsapp_status():
     return {
         'status': whatsapp_status,
         'server_running': is_server_running,
-        'has_qr': qr_code_data is not None
+        'has_qr': qr_code_data is not None,
+        'bridge': bridge.status()
     }
 
+def memoria_node():
+    """RSS do servidor Node e, somados, dos processos filhos (o Chromium)"""
+    if node_process is None or node_process.poll() is not None:
+        return None
+    try:
+        processo = psutil.Process(node_process.pid)
+        filhos = 0
+        for filho in processo.children(recursive=True):
+            try:
+                filhos += filho.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return {('node',): processo.memory_info().rss, ('filhos',): filhos}
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+metricas.medidor('vcga_node_rss_bytes', 'Memória residente do servidor WhatsApp', memoria_node, rotulos=('processo',))
+
 def force_kill_node_processes():
     """Força o encerramento de todos os processos Node.js relacionados"""
     try:
@@ -202,6 +225,7 @@ def create_js_file():
 const { Client, LocalAuth, MessageMedia } = require('whatsapp-web.js');
 const express = require('express');
 const qrcode = require('qrcode');
+const http = require('http');
 const app = express();
 app.use(express.json());
 
@@ -209,6 +233,11 @@ let requestQueue = [];
 let isProcessing = false;
 let currentQRCode = null;
 
+// Endereço do Flask que recebe as mensagens (vazio: bot em modo polling)
+const INGEST_URL = process.env.INGEST_URL || '';
+// Intervalo entre envios; com o Flask ditando o ritmo pode ser 0
+const SEND_GAP_MS = parseInt(process.env.SEND_GAP_MS || '1000', 10);
+
 const restartClient = () => {
     console.log('Reinicializando o cliente...');
     currentQRCode = null;
@@ -249,6 +278,43 @@ client.on('ready', () => {
     }
 });
 
+// Encaminha uma mensagem recebida para o bot
+const forwardMessage = (payload) => {
+    const data = JSON.stringify(payload);
+    const req = http.request(INGEST_URL, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Content-Length': Buffer.byteLength(data)
+        },
+        timeout: 5000
+    });
+    req.on('timeout', () => req.destroy());
+    req.on('error', (error) => {
+        console.error('Erro ao encaminhar mensagem:', error.message);
+    });
+    req.end(data);
+};
+
+client.on('message', async (msg) => {
+    if (!INGEST_URL || msg.fromMe || msg.isStatus || msg.from.endsWith('@g.us')) return;
+
+    try {
+        const chat = await msg.getChat();
+        if (chat.isGroup) return;
+
+        forwardMessage({
+            id: msg.id._serialized,
+            chatId: chat.id._serialized,
+            name: chat.name,
+            body: msg.body,
+            timestamp: msg.timestamp
+        });
+    } catch (error) {
+        console.error('Erro ao processar mensagem recebida:', error);
+    }
+});
+
 app.get('/qr', (req, res) => {
     if (currentQRCode) {
         res.json({ qr: currentQRCode });
@@ -267,7 +333,7 @@ const processQueue = () => {
         setTimeout(() => {
             isProcessing = false;
             processQueue();
-        }, 1000);
+        }, SEND_GAP_MS);
     });
 };
 
@@ -282,6 +348,8 @@ app.post('/send-message', (req, res) => {
 
         try {
             await client.sendMessage(chatId, message);
+            // Respondido: o chat sai da lista de não lidos
+            await client.sendSeen(chatId).catch(() => {});
             res.status(200).send({ status: 'success', message: 'Mensagem enviada!' });
         } catch (error) {
             if (attempt < 3) {
@@ -297,6 +365,19 @@ app.post('/send-message', (req, res) => {
     processQueue();
 });
 
+app.post('/mark-seen', async (req, res) => {
+    if (!client.info) {
+        return res.status(500).send({ status: 'error', message: 'Cliente não está conectado' });
+    }
+
+    try {
+        await client.sendSeen(req.body.chatId);
+        res.status(200).send({ status: 'success' });
+    } catch (error) {
+        res.status(500).send({ status: 'error', message: error.toString() });
+    }
+});
+
 app.get('/status', (req, res) => {
     const info = client.info;
     if (info) {
@@ -316,6 +397,20 @@ app.get('/status', (req, res) => {
     }
 });
 
+// Mensagens não lidas de um chat, para o bot responder todas de uma vez
+app.get('/unread-messages', async (req, res) => {
+    try {
+        const chat = await client.getChatById(req.query.chatId);
+        const limit = Math.max(parseInt(req.query.limit, 10) || chat.unreadCount || 1, 1);
+        const messages = await chat.fetchMessages({ limit });
+        res.status(200).json(messages
+            .filter((msg) => !msg.fromMe)
+            .map((msg) => ({ id: msg.id._serialized, body: msg.body, timestamp: msg.timestamp })));
+    } catch (error) {
+        res.status(500).send({ status: 'error', message: error.toString() });
+    }
+});
+
 app.get('/chats', async (req, res) => {
     try {
         const chats = await client.getChats();
@@ -358,6 +453,15 @@ client.on('disconnected', (reason) => {
         logging.error(f"Erro ao criar arquivo JavaScript: {e}")
         return False
 
+def url_ingestao():
+    """Endereço de /bot/ingest para o servidor Node: o de config ou, sem ele,
+    o da porta em que este processo atende, na mesma máquina"""
+    if config.BOT_INGESTAO_URL:
+        return config.BOT_INGESTAO_URL
+    if has_request_context():
+        return f"http://127.0.0.1:{request.environ.get('SERVER_PORT', config.FLASK_PORT)}{url_for('bot.ingest')}"
+    return f"http://127.0.0.1:{config.FLASK_PORT}/bot/ingest"
+
 def start_node_server():
     global node_process, is_server_running, whatsapp_status
     
@@ -378,7 +482,14 @@ def start_node_server():
             
         # Iniciar o servidor Node.js
         logging.info(f"Iniciando servidor Node.js com arquivo: {JS_FILE_PATH}")
+        # No modo 'eventos' o servidor envia as mensagens recebidas ao bot
+        env = dict(os.environ)
+        env['INGEST_URL'] = url_ingestao() if config.BOT_INGESTAO == 'eventos' else ''
+        if env['INGEST_URL']:
+            logging.info(f"Mensagens recebidas irão para {env['INGEST_URL']}")
+        env['SEND_GAP_MS'] = str(config.WHATSAPP_INTERVALO_ENVIO_MS)
         node_process = subprocess.Popen(['node', JS_FILE_PATH], 
+                                      env=env,
                                       stdout=subprocess.PIPE, 
                                       stderr=subprocess.PIPE,
                                       text=True,
@@ -393,11 +504,15 @@ def start_node_server():
         # Aguardar um pouco para o servidor iniciar
         time.sleep(5)
         
-        # Verificar se o servidor está rodando
+        # Verificar se o servidor está rodando; falhas de antes do início
+        # não valem para o servidor novo
+        bridge.reiniciar()
         try:
-            response = requests.get('http://localhost:3000/ping', timeout=5)
+            response = bridge.get('/ping')
             if response.status_code == 200:
                 logging.info("Servidor Node.js iniciado com sucesso")
+                # Respostas que ficaram sem entrega na execução anterior
+                despachante.retomar()
                 return True
             else:
                 logging.error(f"Servidor respondeu com status: {response.status_code}")
@@ -436,7 +551,7 @@ def read_node_output():
             logging.info("Status atualizado para: Aguardando QR Code")
             try:
                 time.sleep(1)
-                response = requests.get('http://localhost:3000/qr')
+                response = bridge.get('/qr')
                 if response.status_code == 200:
                     qr_data = response.json()
                     qr_code_data = qr_data.get('qr')
@@ -463,7 +578,7 @@ def stop_node_server():
     if node_process and is_server_running:
         try:
             # Tentar parar graciosamente
-            requests.post('http://localhost:3000/shutdown', timeout=5)
+            bridge.post('/shutdown')
             node_process.wait(timeout=5)
         except:
             try:
@@ -566,7 +681,7 @@ def get_qr():
         return jsonify({'qr': qr_code_data})
     else:
         try:
-            response = requests.get('http://localhost:3000/qr')
+            response = bridge.get('/qr')
             if response.status_code == 200:
                 qr_data = response.json()
                 qr_code_data = qr_data.get('qr')
@@ -617,14 +732,13 @@ def test_message():
             formatted_number = number
             
         # Chamar API do WhatsApp
-        url = 'http://localhost:3000/send-message' #f'{base_url}/send-message'
         payload = {
             'number': formatted_number,
             'message': message
         }
         
         logging.info(f"Enviando mensagem de teste para {formatted_number}")
-        response = requests.post(url, json=payload, timeout=10)
+        response = bridge.post('/send-message', json=payload)
         
         if response.status_code == 200:
             logging.info(f"Mensagem de teste enviada com sucesso para {formatted_number}")